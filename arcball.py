@@ -1,13 +1,38 @@
+import math
 import numpy as np
-from scipy.spatial.transform import Rotation as R
+
+IDENTITY_QUAT = (0.0, 0.0, 0.0, 1.0)
+
+
+def quat_multiply(a, b):
+    # Hamilton product, quaternions stored as (x, y, z, w)
+    ax, ay, az, aw = a
+    bx, by, bz, bw = b
+    return (aw * bx + ax * bw + ay * bz - az * by,
+            aw * by - ax * bz + ay * bw + az * bx,
+            aw * bz + ax * by - ay * bx + az * bw,
+            aw * bw - ax * bx - ay * by - az * bz)
+
+
+def quat_normalize(q):
+    length = math.sqrt(q[0] * q[0] + q[1] * q[1] + q[2] * q[2] + q[3] * q[3])
+    return (q[0] / length, q[1] / length, q[2] / length, q[3] / length)
+
+
+def quat_to_matrix(q):
+    # Rotation matrix of a unit quaternion, column-vector convention
+    x, y, z, w = q
+    return ((1.0 - 2.0 * (y * y + z * z), 2.0 * (x * y - z * w), 2.0 * (x * z + y * w)),
+            (2.0 * (x * y + z * w), 1.0 - 2.0 * (x * x + z * z), 2.0 * (y * z - x * w)),
+            (2.0 * (x * z - y * w), 2.0 * (y * z + x * w), 1.0 - 2.0 * (x * x + y * y)))
 
 
 class ArcBall:
     def __init__(self, NewWidth: float, NewHeight: float):
-        self.StVec = np.zeros(3, 'f4')  # Saved click vector
-        self.EnVec = np.zeros(3, 'f4')  # Saved drag vector
-        self.AdjustWidth = 0.           # Mouse bounds width
-        self.AdjustHeight = 0.          # Mouse bounds height
+        self.StVec = (0.0, 0.0, 0.0)  # Saved click vector
+        self.EnVec = (0.0, 0.0, 0.0)  # Saved drag vector
+        self.AdjustWidth = 0.         # Mouse bounds width
+        self.AdjustHeight = 0.        # Mouse bounds height
         self.setBounds(NewWidth, NewHeight)
         self.Epsilon = 1.0e-5
 
@@ -19,88 +44,87 @@ class ArcBall:
 
     def click(self, NewPt):
         # Map the point to the sphere
-        self._mapToSphere(NewPt, self.StVec)
+        self.StVec = self._mapToSphere(NewPt)
 
     def drag(self, NewPt):
-        NewRot = np.zeros((4,), 'f4')
-        # Map the point to the sphere
-        self._mapToSphere(NewPt, self.EnVec)
-        Perp = np.cross(self.StVec, self.EnVec)
+        # Rotation from the click vector to the drag vector as a quaternion,
+        # all zeros when the two are (almost) parallel
+        self.EnVec = EnVec = self._mapToSphere(NewPt)
+        StVec = self.StVec
+        Perp = (StVec[1] * EnVec[2] - StVec[2] * EnVec[1],
+                StVec[2] * EnVec[0] - StVec[0] * EnVec[2],
+                StVec[0] * EnVec[1] - StVec[1] * EnVec[0])
         # Compute the length of the perpendicular vector
-        if np.linalg.norm(Perp) > self.Epsilon:  # if its non-zero
-            NewRot[:3] = Perp[:3]
-            NewRot[3] = np.dot(self.StVec, self.EnVec)
-        else:
-            pass
-        return NewRot
-
-    def _mapToSphere(self, NewPt, NewVec):
-        TempPt = NewPt.copy()
-        TempPt[0] = (TempPt[0] * self.AdjustWidth) - 1.0
-        TempPt[1] = 1.0 - (TempPt[1] * self.AdjustHeight)
-        # center
-        length2 = np.dot(TempPt, TempPt)
+        if math.sqrt(Perp[0] * Perp[0] + Perp[1] * Perp[1] + Perp[2] * Perp[2]) > self.Epsilon:
+            return Perp + (StVec[0] * EnVec[0] + StVec[1] * EnVec[1] + StVec[2] * EnVec[2],)
+        return (0.0, 0.0, 0.0, 0.0)
+
+    def _mapToSphere(self, NewPt):
+        x = (NewPt[0] * self.AdjustWidth) - 1.0
+        y = 1.0 - (NewPt[1] * self.AdjustHeight)
+        length2 = x * x + y * y
         if length2 > 1.0:
-            # Compute a normalizing factor
-            norm = 1.0 / np.sqrt(length2)
-            NewVec[0] = TempPt[0] * norm
-            NewVec[1] = TempPt[1] * norm
-            NewVec[2] = 0.0
-        else:
-            # Return a vector to a point mapped inside the sphere
-            NewVec[0] = TempPt[0]
-            NewVec[1] = TempPt[1]
-            NewVec[2] = np.sqrt(1.0 - length2)
+            # Outside the sphere: the closest point on its rim
+            norm = 1.0 / math.sqrt(length2)
+            return (x * norm, y * norm, 0.0)
+        # Return a vector to a point mapped inside the sphere
+        return (x, y, math.sqrt(1.0 - length2))
 
 
 class ArcBallUtil(ArcBall):
+    # Rotation is accumulated as a quaternion and only written to Transform as a
+    # matrix when a drag is applied; mouse moves just record the latest cursor
     def __init__(self, NewWidth: float, NewHeight: float):
         self.Transform = np.identity(4, 'f4')
-        self.LastRot = np.identity(3, 'f4')
-        self.ThisRot = np.identity(3, 'f4')
+        self.LastQuat = IDENTITY_QUAT
+        self.ThisQuat = IDENTITY_QUAT
+        self.PendingPt = None
         self.isDragging = False
         super().__init__(NewWidth, NewHeight)
 
     def onDrag(self, cursor_x, cursor_y):
+        # Coalesced, applyDrag() computes one rotation per frame
         if self.isDragging:
-            mouse_pt = np.array([cursor_x, cursor_y], 'f4')
-            # Update End Vector And Get Rotation As Quaternion
-            self.ThisQuat = self.drag(mouse_pt)
-            self.ThisQuat[0] *= 0.5  # Reduce the influence of the vertical axis
-            self.ThisRot = self.Matrix3fSetRotationFromQuat4f(self.ThisQuat)
-            self.ThisRot = np.matmul(self.LastRot, self.ThisRot)
-            self.Transform = self.Matrix4fSetRotationFromMatrix3f(
-                self.Transform, self.ThisRot)
-        return
+            self.PendingPt = (cursor_x, cursor_y)
+
+    def applyDrag(self):
+        # Returns True when the rotation changed
+        if self.PendingPt is None:
+            return False
+        NewPt, self.PendingPt = self.PendingPt, None
+        DragQuat = self.drag(NewPt)
+        if DragQuat[0] ** 2 + DragQuat[1] ** 2 + DragQuat[2] ** 2 + DragQuat[3] ** 2 < self.Epsilon:
+            self.ThisQuat = self.LastQuat
+        else:
+            x, y, z, w = DragQuat
+            x *= 0.5  # Reduce the influence of the vertical axis
+            # The drag rotates the model the inverse way, hence the conjugate
+            self.ThisQuat = quat_normalize(quat_multiply(self.LastQuat, quat_normalize((-x, -y, -z, w))))
+        self.setRotation(self.ThisQuat)
+        return True
+
+    def setRotation(self, quat):
+        # Keep the uniform scale init_arcball applied to the rotation block
+        row = self.Transform[0, :3]
+        scale = math.sqrt(float(row[0] * row[0] + row[1] * row[1] + row[2] * row[2]))
+        self.Transform[:3, :3] = quat_to_matrix(quat)
+        self.Transform[:3, :3] *= scale
 
     def resetRotation(self):
         self.isDragging = False
-        self.LastRot = np.identity(3, 'f4')
-        self.ThisRot = np.identity(3, 'f4')
-        self.Transform = self.Matrix4fSetRotationFromMatrix3f(self.Transform,
-                                                              self.ThisRot)
+        self.PendingPt = None
+        self.LastQuat = IDENTITY_QUAT
+        self.ThisQuat = IDENTITY_QUAT
+        self.setRotation(self.ThisQuat)
 
     def onClickLeftUp(self):
+        self.applyDrag()
         self.isDragging = False
         # Set Last Static Rotation To Last Dynamic One
-        self.LastRot = self.ThisRot.copy()
+        self.LastQuat = self.ThisQuat
 
     def onClickLeftDown(self, cursor_x: float, cursor_y: float):
-        self.LastRot = self.ThisRot.copy()
+        self.applyDrag()
+        self.LastQuat = self.ThisQuat
         self.isDragging = True
-        mouse_pt = np.array([cursor_x, cursor_y], 'f4')
-        self.click(mouse_pt)
-        return
-
-    @staticmethod
-    def Matrix4fSetRotationFromMatrix3f(NewObj, m3x3):
-        scale = np.linalg.norm(NewObj[:3, :3], ord='fro') / np.sqrt(3)
-        NewObj[0:3, 0:3] = m3x3 * scale
-        scaled_NewObj = NewObj
-        return scaled_NewObj
-
-    def Matrix3fSetRotationFromQuat4f(self, q1):
-        if np.sum(np.dot(q1, q1)) < self.Epsilon:
-            return np.identity(3, 'f4')
-        r = R.from_quat(q1)
-        return r.as_matrix().T
+        self.click((cursor_x, cursor_y))
@@ -0,0 +1,82 @@
+# Per-event cost of the arcball on the mouse-move path.
+# "event" runs the full rotation for every mouse move, "coalesced" records
+# moves and applies one rotation per frame the way paintGL does now.
+# --baseline loads arcball.py from an older revision (it needs scipy).
+#
+#   python benchmarks/bench_arcball.py --events 20000 --baseline f8eaf66
+import argparse
+import json
+import random
+import subprocess
+import time
+import types
+
+from common import ROOT
+
+
+def load_revision(revision):
+    source = subprocess.run(["git", "show", f"{revision}:arcball.py"], cwd=ROOT, capture_output=True,
+                            text=True, check=True).stdout
+    module = types.ModuleType(f"arcball_{revision}")
+    exec(compile(source, f"{revision}:arcball.py", "exec"), module.__dict__)
+    return module
+
+
+def cursor_path(events, width, height, seed=0):
+    generator = random.Random(seed)
+    return [(generator.uniform(0, width), generator.uniform(0, height)) for _ in range(events)]
+
+
+def per_event(arc_ball, path):
+    apply = getattr(arc_ball, "applyDrag", None)
+    arc_ball.onClickLeftDown(*path[0])
+    start = time.perf_counter()
+    for x, y in path:
+        arc_ball.onDrag(x, y)
+        if apply is not None:
+            apply()
+    return (time.perf_counter() - start) / len(path)
+
+
+def coalesced(arc_ball, path, events_per_frame):
+    arc_ball.onClickLeftDown(*path[0])
+    start = time.perf_counter()
+    for index, (x, y) in enumerate(path, 1):
+        arc_ball.onDrag(x, y)
+        if index % events_per_frame == 0:
+            arc_ball.applyDrag()
+    return (time.perf_counter() - start) / len(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ArcBall mouse-move latency")
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--events-per-frame", type=int, default=4,
+                        help="Mouse moves Qt delivers per displayed frame")
+    parser.add_argument("--baseline", type=str, default=None, help="Git revision to compare against")
+    parser.add_argument("--json", type=str, default=None, help="Write results to this file")
+    args = parser.parse_args()
+
+    import arcball
+    width, height = 870, 731
+    path = cursor_path(args.events, width, height)
+    results = {"events": args.events,
+               "current_event_us": per_event(arcball.ArcBallUtil(width, height), path) * 1e6,
+               "current_coalesced_us": coalesced(arcball.ArcBallUtil(width, height), path,
+                                                 args.events_per_frame) * 1e6}
+    if args.baseline:
+        try:
+            baseline = load_revision(args.baseline)
+            results["baseline_event_us"] = per_event(baseline.ArcBallUtil(width, height), path) * 1e6
+        except (ImportError, subprocess.CalledProcessError) as error:
+            results["baseline_error"] = str(error)
+
+    for name, value in results.items():
+        print(f"{name:24} {value:.2f}" if isinstance(value, float) else f"{name:24} {value}")
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# Compares the fast-path readers against openmesh.read_trimesh.
+# Every run happens in a fresh process so peak RSS is measured per reader.
+#
+#   python benchmarks/bench_readers.py scan.stl scan.ply scan.obj --repeat 3
+import argparse
+import json
+import os
+import time
+
+from common import peak_rss, run_isolated
+
+
+def load_native(file_name):
+    import geometry
+    import readers
+    arrays = readers.read_mesh(file_name)
+    if arrays is None:
+        return None
+    geometry.vertex_normals(arrays["points"], arrays["indices"])
+    return len(arrays["indices"]) // 3
+
+
+def load_openmesh(file_name):
+    import numpy
+    import openmesh
+    mesh = openmesh.read_trimesh(file_name)
+    mesh.update_normals()
+    numpy.array(mesh.points(), dtype="f4")
+    numpy.array(mesh.vertex_normals(), dtype="f4")
+    indices = numpy.array(mesh.face_vertex_indices(), dtype="u4")
+    return len(indices)
+
+
+def measure(method, file_name):
+    baseline = peak_rss()
+    start = time.perf_counter()
+    triangles = METHODS[method](file_name)
+    elapsed = time.perf_counter() - start
+    return elapsed, triangles, baseline, peak_rss()
+
+
+METHODS = {"native": load_native, "openmesh": load_openmesh}
+
+
+def run(method, file_name):
+    # The reader crashed or is not installed
+    return run_isolated(measure, method, file_name) or (float("nan"), None, None, None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reader benchmark")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", type=str, default=None, help="Write results to this file")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'file':40} {'reader':9} {'triangles':>10} {'best s':>8} {'peak MB':>9}")
+    for file_name in args.files:
+        for method in METHODS:
+            runs = [run(method, file_name) for _ in range(args.repeat)]
+            best = min(runs, key=lambda item: item[0])
+            elapsed, triangles, baseline, peak = best
+            peak_mb = None if peak is None else (peak - baseline) / 2 ** 20
+            results.append({"file": file_name, "reader": method, "triangles": triangles,
+                            "seconds": [item[0] for item in runs], "peak_rss_delta_mb": peak_mb})
+            if triangles is None:
+                status = "failed" if elapsed != elapsed else "fallback"
+                print(f"{os.path.basename(file_name):40} {method:9} {status:>10}")
+                continue
+            peak_text = "n/a" if peak_mb is None else f"{peak_mb:.1f}"
+            print(f"{os.path.basename(file_name):40} {method:9} {triangles:>10} {elapsed:>8.3f} {peak_text:>9}")
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+# Load, upload and render benchmark on synthetic meshes.
+# Each (format, size) case runs in a fresh process: pipeline.load_mesh (the path
+# open_file takes, stage by stage), camera.grid, GPU upload through GpuResources
+# (what set_mesh does) and steady-state frame time on a standalone context
+# (llvmpipe without a GPU), with the peak RSS of the whole case.
+#
+#   python benchmarks/bench_suite.py --sizes 10k 100k 1m --json results/$(git rev-parse --short HEAD).json
+#   python benchmarks/bench_suite.py --sizes 10m 50m --formats stl ply
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy
+
+from common import git_revision, peak_rss, run_isolated
+from synthetic import FORMATS, generate
+
+DEFAULT_SIZES = ("10k", "100k", "1m")
+SUFFIXES = {"k": 10 ** 3, "m": 10 ** 6}
+
+
+def parse_size(text):
+    text = text.lower()
+    if text[-1] in SUFFIXES:
+        return int(float(text[:-1]) * SUFFIXES[text[-1]])
+    return int(text)
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def gpu_case(mesh, frames, backend, compact=False, size=(1280, 720)):
+    import math
+    import moderngl
+    from camera import grid, view_projection, model_transform, turntable_rotation, camera_distance
+    from quantize import COMPACT_LAYOUT, FLOAT_LAYOUT, index_dtype, position_range
+    from resource import shaders
+    from resources import GpuResources
+
+    ctx = moderngl.create_standalone_context(**({"backend": backend} if backend else {}))
+    result = {"renderer": ctx.info["GL_RENDERER"]}
+    prog = ctx.program(vertex_shader=shaders.vertex_shader, fragment_shader=shaders.fragment_shader)
+    prog["Light"].value = (1.0, 1.0, 1.0)
+    prog["Color"].value = (1.0, 1.0, 1.0, 1.0)
+    resources = GpuResources(ctx)
+
+    grid_lines, result["grid"] = timed(grid, 20, 50)
+
+    # Upload exactly as set_mesh does, finish() so the copy is part of the time
+    start = time.perf_counter()
+    indices_dtype = index_dtype(mesh.n_vertices)
+    index_buffer = resources.buffer("mesh_indices", mesh.indices, dtype=indices_dtype)
+    if compact:
+        offset, scale = position_range(mesh.bounding_box)
+        prog["CompactVertices"].value = True
+        prog["PositionOffset"].value = tuple(offset)
+        prog["PositionScale"].value = tuple(scale)
+        vertex_buffer = resources.buffer("mesh_vertices", mesh.compact)
+        vao_content = [(vertex_buffer,) + COMPACT_LAYOUT]
+    else:
+        vertex_buffer = resources.interleaved_buffer("mesh_vertices", (mesh.points, mesh.normals))
+        vao_content = [(vertex_buffer,) + FLOAT_LAYOUT]
+    vao = resources.vertex_array("mesh", prog, vao_content, index_buffer, numpy.dtype(indices_dtype).itemsize)
+    ctx.finish()
+    result["upload"] = time.perf_counter() - start
+    result["gpu_bytes"] = resources.allocated_bytes
+    grid_vao = ctx.vertex_array(prog, [(resources.buffer("grid", grid_lines), '3f', 'in_position')])
+
+    bounding_box_min, bounding_box_max = mesh.bounding_box
+    center = 0.5 * (bounding_box_max + bounding_box_min)
+    scale = numpy.linalg.norm(bounding_box_max - center) or 1.0
+    view = view_projection(60.0, size[0] / size[1], camera_distance(60.0))
+    fbo = ctx.simple_framebuffer(size)
+    fbo.use()
+    ctx.enable(moderngl.BLEND | moderngl.DEPTH_TEST | moderngl.CULL_FACE)
+
+    # Warm up, then one finished frame at a time like paintGL followed by a swap
+    times = []
+    for frame in range(frames + 3):
+        start = time.perf_counter()
+        transform = model_transform(turntable_rotation(2.0 * math.pi * frame / max(1, frames)), center, scale)
+        prog["Mvp"].write((view * transform).astype('f4'))
+        fbo.clear(0.1, 0.1, 0.1, 1.0)
+        prog["CompactVertices"].value = compact
+        vao.render()
+        prog["CompactVertices"].value = False
+        grid_vao.render(moderngl.LINES)
+        ctx.finish()
+        if frame >= 3:
+            times.append(time.perf_counter() - start)
+    result["frame"] = dict(zip(("p50", "p95", "max"), map(float, numpy.percentile(times, [50, 95, 100]))))
+    return result
+
+
+def run_case(file_name, frames, backend, compact):
+    from pipeline import load_mesh
+
+    baseline = peak_rss()
+    start = time.perf_counter()
+    mesh = load_mesh(file_name, compact=compact)
+    result = {"load": time.perf_counter() - start, "stages": dict(mesh.timings),
+              "vertices": int(mesh.n_vertices), "triangles": int(mesh.n_faces)}
+    result["load_peak_rss"] = peak_rss()
+    if frames:
+        try:
+            result.update(gpu_case(mesh, frames, backend, compact))
+        except Exception as error:
+            result["gpu_error"] = str(error)
+    result["baseline_rss"] = baseline
+    result["peak_rss"] = peak_rss()
+    return result
+
+
+def megabytes(value, baseline):
+    return None if value is None or baseline is None else (value - baseline) / 2 ** 20
+
+
+def main():
+    parser = argparse.ArgumentParser(description="3D Viewer load/upload/render benchmark")
+    parser.add_argument("--sizes", nargs="+", default=DEFAULT_SIZES, help="Triangle counts, e.g. 10k 1m 50m")
+    parser.add_argument("--formats", nargs="+", default=FORMATS, choices=FORMATS)
+    parser.add_argument("--data", type=str, default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"),
+                        help="Where generated meshes are kept between runs")
+    parser.add_argument("--frames", type=int, default=30, help="Timed frames per case, 0 skips the GPU")
+    parser.add_argument("--backend", type=str, default="egl" if sys.platform.startswith("linux") else None,
+                        help="moderngl standalone backend")
+    parser.add_argument("--compact", action="store_true", help="Upload the quantized vertex format")
+    parser.add_argument("--json", type=str, default=None, help="Write results to this file")
+    args = parser.parse_args()
+
+    results = {"revision": git_revision(), "python": platform.python_version(), "numpy": numpy.__version__,
+               "platform": platform.platform(), "cpu_count": os.cpu_count(),
+               "compact": args.compact, "cases": []}
+    print(f"{'case':18} {'load s':>8} {'upload s':>9} {'frame ms':>9} {'peak MB':>9}  stages")
+    for size in map(parse_size, args.sizes):
+        for file_format in args.formats:
+            case = {"format": file_format, "requested_triangles": size}
+            name = f"{file_format} {size}"
+            try:
+                file_name, case["generate"] = timed(generate, args.data, size, file_format)
+            except ImportError as error:
+                # .om needs openmesh to be written
+                case["skipped"] = str(error)
+                results["cases"].append(case)
+                print(f"{name:18} skipped: {error}")
+                continue
+            case["file_size"] = os.path.getsize(file_name)
+            result = run_isolated(run_case, file_name, args.frames, args.backend, args.compact)
+            if result is None:
+                case["failed"] = True
+                results["cases"].append(case)
+                print(f"{name:18} failed")
+                continue
+            case.update(result)
+            case["load_peak_rss_delta_mb"] = megabytes(result["load_peak_rss"], result["baseline_rss"])
+            case["peak_rss_delta_mb"] = megabytes(result["peak_rss"], result["baseline_rss"])
+            results["cases"].append(case)
+
+            upload = f"{case['upload']:9.3f}" if "upload" in case else f"{'n/a':>9}"
+            frame = f"{case['frame']['p50'] * 1e3:9.2f}" if "frame" in case else f"{'n/a':>9}"
+            peak = case["peak_rss_delta_mb"]
+            peak = f"{peak:9.1f}" if peak is not None else f"{'n/a':>9}"
+            stages = ", ".join(f"{stage} {seconds:.3f}" for stage, seconds in case["stages"].items())
+            print(f"{name:18} {case['load']:8.3f} {upload} {frame} {peak}  {stages}")
+
+    if args.json:
+        os.makedirs(os.path.dirname(os.path.abspath(args.json)), exist_ok=True)
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# Peak RSS while uploading a mesh: the old copy-and-tobytes upload against the
+# GpuResources path set_mesh uses now (buffer protocol, chunked interleaving).
+# Each run is a fresh process; the mesh comes either from pipeline.load_mesh
+# (arrays in RAM, the pickled-loader case) or memory-mapped from the cache.
+#
+#   python benchmarks/bench_upload_memory.py benchmarks/data/torus_10000000.ply --json upload.json
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+from common import peak_rss, reset_peak_rss, run_isolated
+
+
+def upload_copy(ctx, mesh):
+    import numpy
+    # What set_mesh did before: full typed copies, then another copy as bytes
+    points = numpy.array(mesh.points, dtype="f4")
+    normals = numpy.array(mesh.normals, dtype="f4")
+    indices = numpy.array(mesh.indices, dtype="u4")
+    return [ctx.buffer(indices.tobytes()), ctx.buffer(points.tobytes()), ctx.buffer(normals.tobytes())]
+
+
+def upload_direct(ctx, mesh):
+    from resources import GpuResources
+    resources = GpuResources(ctx)
+    resources.buffer("mesh_indices", mesh.indices)
+    resources.interleaved_buffer("mesh_vertices", (mesh.points, mesh.normals))
+    return resources
+
+
+METHODS = {"copy": upload_copy, "direct": upload_direct}
+
+
+def measure(method, source, file_name, cache_dir, backend):
+    import moderngl
+    import cache
+    from pipeline import load_mesh
+
+    ctx = moderngl.create_standalone_context(**({"backend": backend} if backend else {}))
+    mesh = cache.load(file_name, cache_dir) if source == "mapped" else load_mesh(file_name)
+    if mesh is None:
+        return None
+    reset_peak_rss()
+    baseline = peak_rss()
+    start = time.perf_counter()
+    uploaded = METHODS[method](ctx, mesh)
+    ctx.finish()
+    elapsed = time.perf_counter() - start
+    del uploaded
+    mesh_bytes = mesh.points.nbytes + mesh.normals.nbytes + mesh.indices.nbytes
+    return {"seconds": elapsed, "mesh_bytes": mesh_bytes, "baseline_rss": baseline, "peak_rss": peak_rss()}
+
+
+def prepare_cache(file_name, cache_dir):
+    import cache
+    from pipeline import load_mesh
+    cache.store(load_mesh(file_name), cache_dir)
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Upload peak memory benchmark")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--backend", type=str, default="egl" if sys.platform.startswith("linux") else None,
+                        help="moderngl standalone backend")
+    parser.add_argument("--json", type=str, default=None, help="Write results to this file")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'file':32} {'source':7} {'upload':7} {'mesh MB':>8} {'peak MB':>8} {'ratio':>6} {'s':>7}")
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for file_name in args.files:
+            run_isolated(prepare_cache, file_name, cache_dir)
+            for source in ("memory", "mapped"):
+                for method in METHODS:
+                    result = run_isolated(measure, method, source, file_name, cache_dir, args.backend)
+                    name = os.path.basename(file_name)
+                    if result is None:
+                        print(f"{name:32} {source:7} {method:7} failed")
+                        continue
+                    peak = None
+                    if result["peak_rss"] is not None and result["baseline_rss"] is not None:
+                        peak = (result["peak_rss"] - result["baseline_rss"]) / 2 ** 20
+                    result.update(file=file_name, source=source, upload=method, peak_rss_delta_mb=peak)
+                    results.append(result)
+                    mesh_mb = result["mesh_bytes"] / 2 ** 20
+                    peak_text = "n/a" if peak is None else f"{peak:8.1f}"
+                    ratio = "n/a" if peak is None else f"{peak / mesh_mb:6.2f}"
+                    print(f"{name:32} {source:7} {method:7} {mesh_mb:8.1f} {peak_text:>8} {ratio:>6} "
+                          f"{result['seconds']:7.3f}")
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
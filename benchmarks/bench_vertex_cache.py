@@ -0,0 +1,115 @@
+# ACMR, load time and frame time of a scanner-like mesh (a torus with its triangles and
+# vertices shuffled) loaded in file order and with --optimize-indices cache / overdraw.
+# Runs on a standalone context, llvmpipe without a GPU.
+#
+#   python benchmarks/bench_vertex_cache.py --triangles 100000 1000000 --dir /tmp/bench
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy
+
+from common import ROOT  # noqa: F401, puts the repo on sys.path
+from synthetic import torus, write_ply
+
+MODES = (None, "cache", "overdraw")
+
+
+def shuffled_torus(directory, triangles, seed=0):
+    os.makedirs(directory, exist_ok=True)
+    file_name = os.path.join(directory, f"torus_shuffled_{triangles}.ply")
+    if not os.path.exists(file_name):
+        points, indices = torus(triangles)
+        random = numpy.random.default_rng(seed)
+        order = random.permutation(len(points))
+        remap = numpy.empty(len(points), dtype="u4")
+        remap[order] = numpy.arange(len(points), dtype="u4")
+        faces = remap[indices].reshape(-1, 3)[random.permutation(len(indices) // 3)]
+        write_ply(file_name + ".tmp", points[order], faces.reshape(-1))
+        os.replace(file_name + ".tmp", file_name)
+    return file_name
+
+
+def frame_time(ctx, program, mesh, frames, size):
+    from resources import GpuResources
+    resources = GpuResources(ctx)
+    index_buffer = resources.buffer("mesh_indices", mesh.indices)
+    vertex_buffer = resources.interleaved_buffer("mesh_vertices", (mesh.points, mesh.normals))
+    vertex_array = resources.vertex_array("mesh", program, [(vertex_buffer, '3f 3f', 'in_position', 'in_normal')],
+                                          index_buffer, 4)
+    framebuffer = ctx.simple_framebuffer(size)
+    framebuffer.use()
+    times = []
+    for _ in range(frames + 1):
+        framebuffer.clear(0.1, 0.1, 0.1, 1.0)
+        start = time.perf_counter()
+        vertex_array.render()
+        ctx.finish()
+        times.append(time.perf_counter() - start)
+    resources.release()
+    framebuffer.release()
+    # The first frame includes shader and driver warm-up
+    return float(numpy.median(times[1:])) * 1e3
+
+
+def run(file_name, frames, size, backend):
+    import moderngl
+    from camera import view_projection, model_transform, turntable_rotation, camera_distance
+    from pipeline import load_mesh
+    from resource import shaders
+    from vertexcache import acmr
+
+    ctx = moderngl.create_standalone_context(**({"backend": backend} if backend else {}))
+    program = ctx.program(vertex_shader=shaders.vertex_shader, fragment_shader=shaders.fragment_shader)
+    # Close and tilted, so the tube overlaps itself and overdraw shows
+    view = view_projection(60.0, size[0] / size[1], camera_distance(60.0))
+    mvp = numpy.array(view * model_transform(turntable_rotation(0.9), numpy.zeros(3), 1.0), dtype='f4')
+    program["Mvp"].write(mvp)
+    program["Light"].value = (1.0, 1.0, 1.0)
+    program["Color"].value = (0.8, 0.8, 0.8, 1.0)
+    ctx.enable(moderngl.DEPTH_TEST | moderngl.CULL_FACE)
+
+    results = {"renderer": ctx.info["GL_RENDERER"]}
+    for mode in MODES:
+        start = time.perf_counter()
+        mesh = load_mesh(file_name, optimize=mode)
+        name = mode or "file"
+        results["triangles"] = mesh.n_faces
+        results[f"{name}_load_s"] = time.perf_counter() - start
+        results[f"{name}_acmr"] = acmr(mesh.indices)
+        results[f"{name}_lod1_acmr"] = acmr(mesh.lods[0]) if mesh.lods else None
+        results[f"{name}_ms"] = frame_time(ctx, program, mesh, frames, size)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vertex cache and overdraw optimization")
+    parser.add_argument("--triangles", type=int, nargs="+", default=[100000, 1000000])
+    parser.add_argument("--frames", type=int, default=10)
+    parser.add_argument("--size", type=str, default="1280x720", help="Framebuffer size as WIDTHxHEIGHT")
+    parser.add_argument("--backend", type=str, default="egl" if sys.platform.startswith("linux") else None)
+    parser.add_argument("--dir", type=str, default=os.path.join(tempfile.gettempdir(), "3dviewer-bench"),
+                        help="Where the shuffled meshes are written and kept")
+    parser.add_argument("--json", type=str, default=None, help="Write results to this file")
+    args = parser.parse_args()
+
+    size = tuple(int(value) for value in args.size.lower().split("x"))
+    results = [run(shuffled_torus(args.dir, triangles), args.frames, size, args.backend)
+               for triangles in args.triangles]
+    names = [mode or "file" for mode in MODES]
+    print(f"{'triangles':>10} " + " ".join(f"{name + ' acmr':>13} {name + ' ms':>11} {name + ' load s':>13}"
+                                           for name in names))
+    for result in results:
+        print(f"{result['triangles']:>10} " + " ".join(
+            f"{result[name + '_acmr']:>13.3f} {result[name + '_ms']:>11.1f} {result[name + '_load_s']:>13.2f}"
+            for name in names))
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
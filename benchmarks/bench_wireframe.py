@@ -0,0 +1,97 @@
+# Frame time of the wireframe modes on a synthetic torus: "solid", "polygon"
+# (ctx.wireframe, what the Wireframe mode does) and "overlay" (the single-pass
+# geometry shader program behind Wire overlay, solid and edges together).
+# Runs on a standalone context, llvmpipe without a GPU.
+#
+#   python benchmarks/bench_wireframe.py --triangles 100000 1000000 --png renders
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy
+
+from common import ROOT  # noqa: F401, puts the repo on sys.path
+from synthetic import torus
+
+MODES = ("solid", "polygon", "overlay")
+
+
+def frame_times(triangles, frames, size, backend, png_dir=None):
+    import moderngl
+    from camera import view_projection, model_transform, turntable_rotation, camera_distance
+    from headless import write_png
+    from resource import shaders
+    from resources import GpuResources
+
+    ctx = moderngl.create_standalone_context(**({"backend": backend} if backend else {}))
+    solid = ctx.program(vertex_shader=shaders.vertex_shader, fragment_shader=shaders.fragment_shader)
+    wire = ctx.program(vertex_shader=shaders.vertex_shader, geometry_shader=shaders.wire_geometry_shader,
+                       fragment_shader=shaders.wire_fragment_shader)
+    points, indices = torus(triangles)
+    normals = points.copy()
+    resources = GpuResources(ctx)
+    index_buffer = resources.buffer("mesh_indices", indices)
+    vertex_buffer = resources.interleaved_buffer("mesh_vertices", (points, normals))
+    content = [(vertex_buffer, '3f 3f', 'in_position', 'in_normal')]
+    vertex_arrays = {"solid": resources.vertex_array("mesh", solid, content, index_buffer, 4),
+                     "overlay": resources.vertex_array("mesh_wire", wire, content, index_buffer, 4)}
+    vertex_arrays["polygon"] = vertex_arrays["solid"]
+
+    view = view_projection(60.0, size[0] / size[1], camera_distance(60.0))
+    mvp = numpy.array(view * model_transform(turntable_rotation(0.5), numpy.zeros(3), 1.3), dtype='f4')
+    for program in (solid, wire):
+        program["Mvp"].write(mvp)
+        program["Light"].value = (1.0, 1.0, 1.0)
+        program["Color"].value = (0.8, 0.8, 0.8, 1.0)
+    wire["Viewport"].value = size
+    wire["WireColor"].value = (0.24, 0.24, 0.24, 1.0)
+    wire["WireWidth"].value = 1.0
+
+    framebuffer = ctx.simple_framebuffer(size)
+    framebuffer.use()
+    ctx.enable(moderngl.BLEND | moderngl.DEPTH_TEST | moderngl.CULL_FACE)
+    results = {"renderer": ctx.info["GL_RENDERER"], "triangles": len(indices) // 3}
+    for mode in MODES:
+        ctx.wireframe = mode == "polygon"
+        times = []
+        for _ in range(frames + 1):
+            framebuffer.clear(0.1, 0.1, 0.1, 1.0)
+            start = time.perf_counter()
+            vertex_arrays[mode].render()
+            ctx.finish()
+            times.append(time.perf_counter() - start)
+        # The first frame includes shader and driver warm-up
+        results[f"{mode}_ms"] = float(numpy.median(times[1:])) * 1e3
+        if png_dir is not None:
+            write_png(os.path.join(png_dir, f"wireframe_{mode}_{results['triangles']}.png"), size[0], size[1],
+                      framebuffer.read(components=4))
+    ctx.wireframe = False
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Wireframe overlay frame time")
+    parser.add_argument("--triangles", type=int, nargs="+", default=[100000, 1000000])
+    parser.add_argument("--frames", type=int, default=10)
+    parser.add_argument("--size", type=str, default="1280x720", help="Framebuffer size as WIDTHxHEIGHT")
+    parser.add_argument("--backend", type=str, default="egl" if sys.platform.startswith("linux") else None)
+    parser.add_argument("--png", type=str, default=None, help="Write the last frame of every mode here")
+    parser.add_argument("--json", type=str, default=None, help="Write results to this file")
+    args = parser.parse_args()
+
+    size = tuple(int(value) for value in args.size.lower().split("x"))
+    if args.png:
+        os.makedirs(args.png, exist_ok=True)
+    results = [frame_times(triangles, args.frames, size, args.backend, args.png) for triangles in args.triangles]
+    print(f"{'triangles':>10} " + " ".join(f"{mode + ' ms':>11}" for mode in MODES))
+    for result in results:
+        print(f"{result['triangles']:>10} " + " ".join(f"{result[mode + '_ms']:>11.1f}" for mode in MODES))
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
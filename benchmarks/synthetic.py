@@ -0,0 +1,100 @@
+# Synthetic test meshes: a closed torus with an exact triangle count,
+# written in every format the viewer opens.
+import os
+
+import numpy
+
+from common import ROOT  # noqa: F401, puts the repo on sys.path
+from readers import STL_RECORD
+
+FORMATS = ("obj", "stl", "ply", "off", "om")
+CHUNK_TRIANGLES = 1 << 20
+
+
+def torus(triangles, radius=1.0, tube=0.3):
+    # rows x cols quads, two triangles each, rounded down to an even count
+    rows = max(3, int(numpy.sqrt(triangles / 2 / 4)))
+    cols = max(3, triangles // (2 * rows))
+    u = numpy.linspace(0.0, 2.0 * numpy.pi, cols, endpoint=False, dtype="f4")
+    v = numpy.linspace(0.0, 2.0 * numpy.pi, rows, endpoint=False, dtype="f4")
+    u, v = numpy.meshgrid(u, v)
+    ring = radius + tube * numpy.cos(v)
+    points = numpy.stack([ring * numpy.cos(u), tube * numpy.sin(v), ring * numpy.sin(u)], axis=-1)
+    points = points.reshape(-1, 3).astype("f4")
+
+    row, col = numpy.meshgrid(numpy.arange(rows, dtype="u4"), numpy.arange(cols, dtype="u4"), indexing="ij")
+    a = row * cols + col
+    b = row * cols + (col + 1) % cols
+    c = (row + 1) % rows * cols + col
+    d = (row + 1) % rows * cols + (col + 1) % cols
+    indices = numpy.stack([a, c, b, b, c, d], axis=-1).reshape(-1)
+    return points, indices
+
+
+def write_obj(file_name, points, indices):
+    with open(file_name, "w") as file:
+        for start in range(0, len(points), CHUNK_TRIANGLES):
+            numpy.savetxt(file, points[start:start + CHUNK_TRIANGLES], fmt="v %.6f %.6f %.6f")
+        faces = indices.reshape(-1, 3)
+        for start in range(0, len(faces), CHUNK_TRIANGLES):
+            numpy.savetxt(file, faces[start:start + CHUNK_TRIANGLES] + 1, fmt="f %d %d %d")
+
+
+def write_off(file_name, points, indices):
+    faces = indices.reshape(-1, 3)
+    with open(file_name, "w") as file:
+        file.write(f"OFF\n{len(points)} {len(faces)} 0\n")
+        for start in range(0, len(points), CHUNK_TRIANGLES):
+            numpy.savetxt(file, points[start:start + CHUNK_TRIANGLES], fmt="%.6f %.6f %.6f")
+        for start in range(0, len(faces), CHUNK_TRIANGLES):
+            numpy.savetxt(file, faces[start:start + CHUNK_TRIANGLES], fmt="3 %d %d %d")
+
+
+def write_stl(file_name, points, indices):
+    faces = indices.reshape(-1, 3)
+    with open(file_name, "wb") as file:
+        file.write(b"synthetic torus".ljust(80, b" "))
+        file.write(numpy.uint32(len(faces)).tobytes())
+        for start in range(0, len(faces), CHUNK_TRIANGLES):
+            chunk = faces[start:start + CHUNK_TRIANGLES]
+            records = numpy.zeros(len(chunk), dtype=STL_RECORD)
+            records["vertices"] = points[chunk]
+            records.tofile(file)
+
+
+def write_ply(file_name, points, indices):
+    faces = indices.reshape(-1, 3)
+    header = ("ply\nformat binary_little_endian 1.0\n"
+              f"element vertex {len(points)}\nproperty float x\nproperty float y\nproperty float z\n"
+              f"element face {len(faces)}\nproperty list uchar int vertex_indices\nend_header\n")
+    face_dtype = numpy.dtype([("count", "u1"), ("vertices", "<i4", 3)])
+    with open(file_name, "wb") as file:
+        file.write(header.encode("ascii"))
+        points.astype("<f4").tofile(file)
+        for start in range(0, len(faces), CHUNK_TRIANGLES):
+            chunk = faces[start:start + CHUNK_TRIANGLES]
+            records = numpy.empty(len(chunk), dtype=face_dtype)
+            records["count"] = 3
+            records["vertices"] = chunk
+            records.tofile(file)
+
+
+def write_om(file_name, points, indices):
+    import openmesh
+    mesh = openmesh.TriMesh(points.astype("f8"), indices.reshape(-1, 3).astype("i4"))
+    openmesh.write_mesh(file_name, mesh)
+
+
+WRITERS = {"obj": write_obj, "stl": write_stl, "ply": write_ply, "off": write_off, "om": write_om}
+
+
+def generate(directory, triangles, file_format):
+    # Files are kept between runs, the name carries everything that defines them
+    os.makedirs(directory, exist_ok=True)
+    file_name = os.path.join(directory, f"torus_{triangles}.{file_format}")
+    if not os.path.exists(file_name):
+        points, indices = torus(triangles)
+        temp_name = file_name + ".tmp." + file_format
+        WRITERS[file_format](temp_name, points, indices)
+        os.replace(temp_name, file_name)
+    return file_name
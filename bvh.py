@@ -0,0 +1,113 @@
+import numpy
+
+# Triangles per leaf, leaves are tested together with one vectorized ray/triangle test
+LEAF_SIZE = 16
+# Triangles per step while building, bounds the temporary arrays
+BUILD_CHUNK = 1 << 20
+
+
+def _spread_bits(values):
+    # 10-bit integers to every third bit of a 30-bit Morton code
+    values = values.astype("u4")
+    for shift, mask in ((16, 0x030000FF), (8, 0x0300F00F), (4, 0x030C30C3), (2, 0x09249249)):
+        values |= values << shift
+        values &= mask
+    return values
+
+
+def _corners(points, triangles):
+    # The three corners as separate (n, 3) arrays, cheaper than one (n, 3, 3) gather
+    return points[triangles[:, 0]], points[triangles[:, 1]], points[triangles[:, 2]]
+
+
+def morton_codes(points, triangles, low, high):
+    # Z-order of the triangle centroids, nearby triangles end up in the same leaf
+    codes = numpy.empty(len(triangles), dtype="u4")
+    scale = 1023.0 / numpy.maximum(high - low, 1e-12)
+    for start in range(0, len(triangles), BUILD_CHUNK):
+        first, second, third = _corners(points, triangles[start:start + BUILD_CHUNK])
+        cells = first + second
+        cells += third
+        cells -= (3 * low).astype("f4")
+        cells *= (scale / 3).astype("f4")
+        cells = numpy.clip(cells, 0, 1023, out=cells).astype("u4")
+        codes[start:start + len(cells)] = (_spread_bits(cells[:, 0]) << 2 | _spread_bits(cells[:, 1]) << 1
+                                           | _spread_bits(cells[:, 2]))
+    return codes
+
+
+class TriangleBVH:
+    # Complete binary tree over Morton-sorted triangles, stored one array per level
+    # from the root down; the children of node i on one level are 2i and 2i+1 on the next
+    def __init__(self, points, indices):
+        self.points = points
+        self.triangles = numpy.asarray(indices).reshape(-1, 3)
+        n_faces = len(self.triangles)
+        low = numpy.asarray(points).min(axis=0).astype("f8")
+        high = numpy.asarray(points).max(axis=0).astype("f8")
+        self.order = numpy.argsort(morton_codes(points, self.triangles, low, high), kind="stable")
+
+        # Leaf boxes, padded to a power of two with empty boxes (min > max)
+        n_leaves = max(1, -(-n_faces // LEAF_SIZE))
+        padded = 1 << (n_leaves - 1).bit_length()
+        mins = numpy.full((padded, 3), numpy.inf, dtype="f4")
+        maxs = numpy.full((padded, 3), -numpy.inf, dtype="f4")
+        step = BUILD_CHUNK - BUILD_CHUNK % LEAF_SIZE
+        for start in range(0, n_faces, step):
+            first, second, third = _corners(points, self.triangles[self.order[start:start + step]])
+            starts = numpy.arange(0, len(first), LEAF_SIZE)
+            leaf = start // LEAF_SIZE
+            low_corner = numpy.minimum(numpy.minimum(first, second), third)
+            high_corner = numpy.maximum(numpy.maximum(first, second), third)
+            mins[leaf:leaf + len(starts)] = numpy.minimum.reduceat(low_corner, starts)
+            maxs[leaf:leaf + len(starts)] = numpy.maximum.reduceat(high_corner, starts)
+
+        self.levels = [(mins, maxs)]
+        while len(mins) > 1:
+            mins = numpy.minimum(mins[0::2], mins[1::2])
+            maxs = numpy.maximum(maxs[0::2], maxs[1::2])
+            self.levels.insert(0, (mins, maxs))
+
+    @property
+    def nbytes(self):
+        return self.order.nbytes + sum(mins.nbytes + maxs.nbytes for mins, maxs in self.levels)
+
+    def intersect(self, origin, direction):
+        # Closest hit along origin + t * direction, t >= 0, as (face, t, u, v) or None
+        origin = numpy.asarray(origin, dtype="f8")
+        direction = numpy.asarray(direction, dtype="f8")
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            inverse = 1.0 / direction
+            nodes = numpy.zeros(1, dtype=numpy.int64)
+            for level, (mins, maxs) in enumerate(self.levels):
+                if level:
+                    nodes = (nodes[:, None] * 2 + (0, 1)).ravel()
+                low, high = mins[nodes], maxs[nodes]
+                near = (low - origin) * inverse
+                far = (high - origin) * inverse
+                t_near = numpy.fmax.reduce(numpy.fmin(near, far), axis=1)
+                t_far = numpy.fmin.reduce(numpy.fmax(near, far), axis=1)
+                nodes = nodes[(t_near <= t_far) & (t_far >= 0) & (low[:, 0] <= high[:, 0])]
+                if len(nodes) == 0:
+                    return None
+
+        # Moller-Trumbore on every triangle of the leaves the ray passes through
+        slots = (nodes[:, None] * LEAF_SIZE + numpy.arange(LEAF_SIZE)).ravel()
+        faces = self.order[slots[slots < len(self.order)]]
+        corners = self.points[self.triangles[faces]].astype("f8")
+        edge1 = corners[:, 1] - corners[:, 0]
+        edge2 = corners[:, 2] - corners[:, 0]
+        p = numpy.cross(direction, edge2)
+        determinant = (edge1 * p).sum(axis=1)
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            inverse_determinant = 1.0 / determinant
+            s = origin - corners[:, 0]
+            u = (s * p).sum(axis=1) * inverse_determinant
+            q = numpy.cross(s, edge1)
+            v = (q * direction).sum(axis=1) * inverse_determinant
+            t = (q * edge2).sum(axis=1) * inverse_determinant
+        hit = (numpy.abs(determinant) > 1e-18) & (u >= 0) & (v >= 0) & (u + v <= 1) & (t >= 0)
+        if not hit.any():
+            return None
+        closest = numpy.flatnonzero(hit)[numpy.argmin(t[hit])]
+        return int(faces[closest]), float(t[closest]), float(u[closest]), float(v[closest])
@@ -0,0 +1,212 @@
+import hashlib
+import json
+import os
+import numpy
+
+from meshdata import MeshData
+from pipeline import load_mesh
+from quantize import COMPACT_VERTEX
+from scanner import ObjInfo
+
+CACHE_DIR = os.environ.get("VIEWER_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "3dviewer"))
+CACHE_LIMIT = int(os.environ.get("VIEWER_CACHE_LIMIT_MB", "4096")) * 2 ** 20
+MAGIC = b"3DVCACHE"
+VERSION = 8
+ALIGNMENT = 64
+SAMPLE_SIZE = 1 << 16
+SAMPLE_COUNT = 16
+
+
+def content_digest(file_name):
+    # Sampled hash: head, tail and evenly spaced blocks, so a cache hit
+    # never costs a full read of a multi-GB file
+    size = os.path.getsize(file_name)
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_name, "rb") as file:
+        if size <= SAMPLE_SIZE * SAMPLE_COUNT:
+            digest.update(file.read())
+        else:
+            step = (size - SAMPLE_SIZE) // (SAMPLE_COUNT - 1)
+            for sample in range(SAMPLE_COUNT):
+                file.seek(sample * step)
+                digest.update(file.read(SAMPLE_SIZE))
+    return digest.hexdigest()
+
+
+def cache_key(file_name):
+    stat = os.stat(file_name)
+    identity = f"{os.path.abspath(file_name)}|{stat.st_mtime_ns}|{stat.st_size}|{content_digest(file_name)}"
+    return hashlib.sha1(identity.encode()).hexdigest()
+
+
+def cache_path(file_name, cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, cache_key(file_name) + ".mesh")
+
+
+def store(mesh, cache_dir=CACHE_DIR, limit=CACHE_LIMIT):
+    # Layout: magic, header length, JSON header, then 64-byte aligned arrays;
+    # returns the entry's path, or None for an entry that alone exceeds the limit
+    os.makedirs(cache_dir, exist_ok=True)
+    path = cache_path(mesh.file_name, cache_dir)
+    arrays = {"points": mesh.points, "indices": mesh.indices}
+    if mesh.normals is not None:
+        arrays["normals"] = mesh.normals
+    if mesh.colors is not None:
+        arrays["colors"] = mesh.colors
+    if mesh.texcoords is not None:
+        arrays["texcoords"] = mesh.texcoords
+    if mesh.triangle_order is not None:
+        arrays["triangle_order"] = mesh.triangle_order
+    if mesh.ranges is not None:
+        arrays["ranges"] = mesh.ranges
+    for level, lod_indices in enumerate(mesh.lods, 1):
+        arrays[f"lod{level}"] = lod_indices
+        if mesh.lod_ranges[level - 1] is not None:
+            arrays[f"lod{level}_ranges"] = mesh.lod_ranges[level - 1]
+    if mesh.chunks is not None:
+        arrays["chunks"] = mesh.chunks
+        arrays["chunk_bounds"] = mesh.chunk_bounds
+    if mesh.compact is not None:
+        # Stored as raw bytes, the record layout is fixed by quantize.py
+        arrays["compact"] = mesh.compact.view("u1").reshape(len(mesh.compact), -1)
+    header = {
+        "version": VERSION,
+        "file_name": os.path.abspath(mesh.file_name),
+        "n_edges": int(mesh.n_edges),
+        "bounding_box": [list(map(float, corner)) for corner in mesh.bounding_box],
+        "obj_info": None if mesh.obj_info is None else mesh.obj_info.to_dict(),
+        "lod_count": len(mesh.lods),
+        "materials": mesh.materials,
+        "stats": mesh.stats,
+        "point_spacing": mesh.point_spacing if mesh.point_cloud else None,
+        "arrays": {},
+    }
+
+    # Offsets depend on the header size, so lay them out relative to the data start
+    offset = 0
+    for name, array in arrays.items():
+        header["arrays"][name] = {"offset": offset, "dtype": array.dtype.str, "shape": list(array.shape)}
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    encoded = json.dumps(header).encode()
+    data_start = -(-(len(MAGIC) + 8 + len(encoded)) // ALIGNMENT) * ALIGNMENT
+    if data_start + offset > limit:
+        return None
+
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as file:
+        file.write(MAGIC)
+        file.write(len(encoded).to_bytes(8, "little"))
+        file.write(encoded)
+        for name, array in arrays.items():
+            file.seek(data_start + header["arrays"][name]["offset"])
+            file.write(memoryview(numpy.ascontiguousarray(array)).cast("B"))
+    os.replace(temp_path, path)
+    evict(cache_dir, limit, keep=path)
+    return path
+
+
+def load(file_name, cache_dir=CACHE_DIR):
+    # Memory-maps a cached mesh, returns None on a miss
+    if not os.path.exists(file_name):
+        return None
+    path = cache_path(file_name, cache_dir)
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            return None
+        length = int.from_bytes(file.read(8), "little")
+        header = json.loads(file.read(length))
+    if header.get("version") != VERSION:
+        return None
+    data_start = -(-(len(MAGIC) + 8 + length) // ALIGNMENT) * ALIGNMENT
+
+    arrays = {}
+    for name, layout in header["arrays"].items():
+        shape = tuple(layout["shape"])
+        if 0 in shape:
+            arrays[name] = numpy.empty(shape, dtype=layout["dtype"])
+            continue
+        arrays[name] = numpy.memmap(path, dtype=layout["dtype"], mode="r",
+                                    offset=data_start + layout["offset"], shape=shape)
+
+    # Touch the entry so eviction sees it as recently used
+    os.utime(path)
+    obj_info = None if header["obj_info"] is None else ObjInfo.from_dict(header["obj_info"])
+    bounding_box = tuple(numpy.array(corner, dtype="f4") for corner in header["bounding_box"])
+    lods = [arrays[f"lod{level}"] for level in range(1, header["lod_count"] + 1)]
+    mesh = MeshData(file_name, arrays["points"], arrays.get("normals"), arrays["indices"],
+                    header["n_edges"], obj_info, bounding_box, lods)
+    mesh.stats = header["stats"]
+    if "chunks" in arrays:
+        mesh.chunks, mesh.chunk_bounds = arrays["chunks"], arrays["chunk_bounds"]
+    if header["point_spacing"] is not None:
+        mesh.set_points(arrays.get("colors"), header["point_spacing"])
+    mesh.texcoords = arrays.get("texcoords")
+    mesh.triangle_order = arrays.get("triangle_order")
+    if "compact" in arrays:
+        mesh.compact = arrays["compact"].view(COMPACT_VERTEX).reshape(-1)
+    if "ranges" in arrays:
+        mesh.set_materials(header["materials"], arrays["ranges"],
+                           [arrays.get(f"lod{level}_ranges") for level in range(1, header["lod_count"] + 1)])
+    return mesh
+
+
+def evict(cache_dir=CACHE_DIR, limit=CACHE_LIMIT, keep=None):
+    # Least recently used entries go first until the cache fits the limit,
+    # keep (the entry just written) is never removed
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if name.endswith(".mesh") and path != keep:
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    if keep is not None and os.path.exists(keep):
+        total += os.path.getsize(keep)
+    for _, size, path in sorted(entries):
+        if total <= limit:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            # Still mapped by a running viewer on Windows
+            continue
+        total -= size
+
+
+def serves(mesh, compact=False, optimize=None):
+    # Whether a loaded entry has what a load with these options needs, else it is rebuilt;
+    # entries in file order or optimized the other way do not serve an optimized load
+    if mesh.point_cloud:
+        return True
+    if compact and mesh.compact is None:
+        return False
+    return not optimize or mesh.stats.get("vertex_cache", {}).get("mode") == optimize
+
+
+def build_directory(directory, extensions=(".obj", ".stl", ".ply", ".off", ".om"), cache_dir=CACHE_DIR, optimize=None,
+                    compact=False):
+    # Prebuild cache entries for every mesh below directory, optimize and compact as in pipeline.load_mesh;
+    # entries from an older version or without what the options ask for are rebuilt
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() not in extensions:
+                continue
+            file_name = os.path.join(root, name)
+            try:
+                entry = load(file_name, cache_dir)
+            except (OSError, ValueError, KeyError):
+                entry = None
+            if entry is not None and serves(entry, compact, optimize):
+                print(f"cached   {file_name}")
+                continue
+            # Unmapped before the entry is replaced
+            del entry
+            try:
+                if store(load_mesh(file_name, compact=compact, optimize=optimize), cache_dir) is None:
+                    print(f"too big  {file_name}")
+                else:
+                    print(f"built    {file_name}")
+            except Exception as error:
+                print(f"failed   {file_name}: {error}")
@@ -0,0 +1,48 @@
+import math
+import numpy
+
+
+def grid(size, steps):
+    # Create grid parameters
+    u = numpy.repeat(numpy.linspace(-size, size, steps), 2)
+    v = numpy.tile([-size, size], steps)
+    w = numpy.zeros(steps * 2)
+    new_grid = numpy.concatenate([numpy.dstack([u, v, w]), numpy.dstack([v, u, w])])
+
+    # Rotate grid
+    lower_grid = 0.135
+    rotation_matrix = numpy.array([
+        [0, 0, 1],
+        [1, 0, 0],
+        [0, lower_grid, 0]
+    ])
+    return numpy.dot(new_grid, rotation_matrix)
+
+
+def view_projection(fov, aspect_ratio, camera_zoom):
+    # pyrr is only needed once there is a mesh to draw, keep it off the startup path
+    from pyrr import Matrix44
+    proj = Matrix44.perspective_projection(fov, aspect_ratio, 0.1, 1000.0)
+    lookat = Matrix44.look_at(
+        (0.0, 0.0, camera_zoom),
+        (0.0, 0.0, 0.0),
+        (0.0, 1.0, 0.0),
+    )
+    return proj * lookat
+
+
+def model_transform(rotation, center, scale):
+    # Same layout ArcBallUtil.Transform uses: row vectors, translation in the last row
+    transform = numpy.identity(4, 'f4')
+    transform[:3, :3] = rotation / scale
+    transform[3, :3] = -transform[:3, :3].T @ center
+    return transform
+
+
+def turntable_rotation(angle):
+    c, s = math.cos(angle), math.sin(angle)
+    return numpy.array([[c, 0.0, -s], [0.0, 1.0, 0.0], [s, 0.0, c]], 'f4')
+
+
+def camera_distance(num):
+    return 1 / (math.tan(math.radians(num / 2)))
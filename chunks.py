@@ -0,0 +1,84 @@
+import numpy
+
+from bvh import morton_codes
+
+# Triangles per chunk, the unit of frustum and occlusion culling
+CHUNK_TRIANGLES = 32768
+# Meshes below this many triangles are always drawn whole
+CHUNK_MIN_TRIANGLES = 4 * CHUNK_TRIANGLES
+
+
+def build_chunks(points, indices, bounding_box, triangle_materials=None):
+    # Reorders the triangles of each material along a Morton curve and cuts them
+    # into chunks; returns the new indices and materials, chunk rows of
+    # (material, first triangle, triangle count), per-chunk (min, max) boxes
+    # and the old index of every reordered triangle
+    triangles = indices.reshape(-1, 3)
+    low, high = (numpy.asarray(corner, dtype="f8") for corner in bounding_box)
+    codes = morton_codes(points, triangles, low, high)
+    if triangle_materials is None:
+        order = numpy.argsort(codes, kind="stable")
+        runs = [(0, 0, len(triangles))]
+    else:
+        order = numpy.lexsort((codes, triangle_materials))
+        triangle_materials = triangle_materials[order]
+        starts = numpy.concatenate(([0], numpy.flatnonzero(numpy.diff(triangle_materials.astype("i8"))) + 1))
+        stops = numpy.concatenate((starts[1:], [len(triangles)]))
+        runs = [(int(triangle_materials[start]), int(start), int(stop - start)) for start, stop in zip(starts, stops)]
+    del codes
+    triangles = triangles[order]
+
+    chunks = []
+    for material, first, count in runs:
+        for start in range(first, first + count, CHUNK_TRIANGLES):
+            chunks.append((material, start, min(CHUNK_TRIANGLES, first + count - start)))
+    chunks = numpy.array(chunks, dtype="u4").reshape(-1, 3)
+
+    bounds = numpy.empty((len(chunks), 2, 3), dtype="f4")
+    for row, (_, first, count) in enumerate(chunks):
+        corners = points[triangles[first:first + count].reshape(-1)]
+        bounds[row, 0] = corners.min(axis=0)
+        bounds[row, 1] = corners.max(axis=0)
+    return triangles.reshape(-1), triangle_materials, chunks, bounds, order
+
+
+def frustum_planes(matrix):
+    # Clip planes of a row-vector view-projection matrix (clip = point @ matrix),
+    # one (a, b, c, d) row each with inside meaning a*x + b*y + c*z + d >= 0
+    matrix = numpy.asarray(matrix, dtype="f8")
+    w = matrix[:, 3]
+    return numpy.stack([w + matrix[:, 0], w - matrix[:, 0], w + matrix[:, 1],
+                        w - matrix[:, 1], w + matrix[:, 2], w - matrix[:, 2]])
+
+
+def visible_chunks(bounds, matrix):
+    # Boolean mask of the boxes not entirely outside one of the frustum planes,
+    # each box is tested through its corner furthest along the plane normal
+    planes = frustum_planes(matrix)
+    normals = planes[:, :3]
+    corners = numpy.where(normals[None] >= 0, bounds[:, 1:2], bounds[:, 0:1])
+    distances = numpy.einsum("cpj,pj->cp", corners, normals) + planes[:, 3]
+    return (distances >= 0).all(axis=1)
+
+
+def visible_ranges(chunks, mask):
+    # Merges runs of consecutive visible chunks of one material into draw ranges
+    chunks = chunks[mask]
+    if len(chunks) == 0:
+        return []
+    ends = chunks[:, 1] + chunks[:, 2]
+    joined = (chunks[1:, 0] == chunks[:-1, 0]) & (chunks[1:, 1] == ends[:-1])
+    starts = numpy.concatenate(([0], numpy.flatnonzero(~joined) + 1))
+    stops = numpy.concatenate((starts[1:], [len(chunks)]))
+    return [(int(chunks[start, 0]), int(chunks[start, 1]), int(ends[stop - 1] - chunks[start, 1]))
+            for start, stop in zip(starts, stops)]
+
+
+def box_triangles(bounds):
+    # 12 triangles per box, for drawing chunk bounds in occlusion queries
+    low, high = bounds[:, 0], bounds[:, 1]
+    corners = numpy.stack([numpy.where(numpy.array([x, y, z], dtype=bool), high, low)
+                           for x in (0, 1) for y in (0, 1) for z in (0, 1)], axis=1)
+    faces = numpy.array([0, 1, 3, 0, 3, 2, 4, 6, 7, 4, 7, 5, 0, 4, 5, 0, 5, 1,
+                         2, 3, 7, 2, 7, 6, 0, 2, 6, 0, 6, 4, 1, 5, 7, 1, 7, 3])
+    return numpy.ascontiguousarray(corners[:, faces], dtype="f4")
@@ -1,31 +1,31 @@
 import numpy
 import moderngl
-import math
+import threading
+import time
 
-from PyQt5 import QtOpenGL, QtCore
+from PyQt5 import QtOpenGL, QtCore, QtGui
 from arcball import ArcBallUtil
-from pyrr import Matrix44
+from bvh import TriangleBVH
+from chunks import box_triangles, visible_chunks, visible_ranges
+from camera import grid, view_projection, camera_distance
+from lod import LOD_MAX_LEVELS
+from profiler import Profiler
+from quantize import COMPACT_LAYOUT, COMPACT_VERTEX, FLOAT_LAYOUT, compact_vertices, index_dtype, position_range
+from resources import GpuResources, write_array
+from scene import Scene
+from textures import TextureCache
 from resource import shaders
 
 
-def grid(size, steps):
-    # Create grid parameters
-    u = numpy.repeat(numpy.linspace(-size, size, steps), 2)
-    v = numpy.tile([-size, size], steps)
-    w = numpy.zeros(steps * 2)
-    new_grid = numpy.concatenate([numpy.dstack([u, v, w]), numpy.dstack([v, u, w])])
-
-    # Rotate grid
-    lower_grid = 0.135
-    rotation_matrix = numpy.array([
-        [0, 0, 1],
-        [1, 0, 0],
-        [0, lower_grid, 0]
-    ])
-    return numpy.dot(new_grid, rotation_matrix)
-
-
 class QGLControllerWidget(QtOpenGL.QGLWidget):
+    lod_changed = QtCore.pyqtSignal(int, int)
+    draw_calls_changed = QtCore.pyqtSignal(int)
+    stats_changed = QtCore.pyqtSignal(object)
+    mesh_changed = QtCore.pyqtSignal(object)
+    first_frame_drawn = QtCore.pyqtSignal()
+    picked = QtCore.pyqtSignal(object)
+    scene_changed = QtCore.pyqtSignal(object)
+
     def __init__(self, parent=None):
         self.parent = parent
         super(QGLControllerWidget, self).__init__(parent)
@@ -39,22 +39,129 @@ class QGLControllerWidget(QtOpenGL.QGLWidget):
         self.setMouseTracking(True)
         self.wheelEvent = self.update_zoom
         self.is_wireframe = False
+        # Edges drawn over the shaded mesh in the same pass by a geometry shader program,
+        # compiled on first use; far cheaper than polygon-mode lines on software rasterizers
+        self.is_overlay = False
+        self.wire_prog = None
+        # Set from --wire-width; the wireframe color and slider pick the edge color and
+        # opacity while the overlay is shown, edges follow the model color until then
+        self.wire_width = 1.0
+        self.wire_rgb = None
+        self.wire_alpha = 1.0
         self.texture = None
         self.cell = 50
         self.size = 20
-        self.grid = grid(self.size, self.cell)
+        self.grid = None
         self.grid_alpha_value = 1.0
 
+        # Frames are drawn on demand, coalesced to the display refresh rate
+        refresh_rate = QtGui.QGuiApplication.primaryScreen().refreshRate() or 60.0
+        self.frame_interval = 1.0 / refresh_rate
+        self.last_frame = 0.0
+        self.frame_timer = QtCore.QTimer(self)
+        self.frame_timer.setSingleShot(True)
+        self.frame_timer.setTimerType(QtCore.Qt.PreciseTimer)
+        self.frame_timer.timeout.connect(self.updateGL)
+
+        # Level of detail, coarser levels are used while interacting over budget
+        self.lod_vaos = []
+        self.lod_triangles = []
+        self.lod_level = 0
+        self.interacting = False
+        self.interaction_timer = QtCore.QTimer(self)
+        self.interaction_timer.setSingleShot(True)
+        self.interaction_timer.setInterval(250)
+        self.interaction_timer.timeout.connect(self.end_interaction)
+
+        # Per-material draw batches, optionally submitted with one multi-draw call
+        self.multi_draw = False
+        self.lod_ranges = []
+        self.draw_lists = []
+        self.material_colors = []
+        self.multi_draw_vaos = []
+        self.indirect_buffers = []
+
+        # Vertex layout of the current mesh, compact halves the vertex memory
+        self.compact_vertices = False
+        self.vertex_layout = FLOAT_LAYOUT
+        self.index_element_size = 4
+        # Triangle order loads are optimized for: None (file order), "cache" or "overdraw"
+        self.index_optimization = None
+
+        # Frame and upload timings, the panel is refreshed a few times per second
+        self.profiler = Profiler()
+        self.last_stats = 0.0
+        self.load_time = None
+        self.frames_drawn = 0
+        # Draw calls the models took in the current frame (culled chunks and models take none,
+        # occlusion boxes count), the label follows the last finished frame
+        self.frame_draw_calls = 0
+        self.draw_calls = None
+        # A mesh that arrives before the context exists waits for initializeGL
+        self.pending_mesh = None
+
+        # Spatial chunks of the full-detail level, culled against the view every frame
+        self.occlusion_culling = False
+        self.chunk_queries = []
+        self.chunks_drawn = None
+
+        # Progressive preview of a large file while it loads, drawn flat shaded
+        self.stream_vao = None
+        self.stream_vertices = 0
+        self.stream_triangles = 0
+        self.stream_points = False
+        self.stream_bounds = None
+        # Bumped for every load, blocks queued by a superseded loader are dropped
+        self.stream_generation = 0
+
+        # Extra models placed next to the opened mesh; uploaded when they come into view,
+        # the least recently viewed are released beyond the scene's GPU memory budget
+        self.scene = Scene()
+        self.scene_vaos = {}
+
+        # Material textures (map_Kd), decoded off the GUI thread and shared by every model;
+        # a material draws in its diffuse color until its texture is uploaded
+        self.textures = TextureCache(parent=self)
+        self.textures.ready.connect(self.request_update)
+        self.material_textures = []
+
+        # Point clouds are drawn as discs this many point spacings wide, they overlap a
+        # little so that the sparser voxel levels show no holes
+        self.point_scale = 1.5
+
+        # Ctrl+click picking, rays are cast on the CPU against a BVH built in the background
+        self.bvh = None
+        self.view_matrix = None
+        self.picks = []
+
+    def request_update(self):
+        # Mark the view dirty, several requests within one frame draw once
+        if self.frame_timer.isActive():
+            return
+        wait = self.frame_interval - (time.perf_counter() - self.last_frame)
+        self.frame_timer.start(max(0, int(wait * 1000)))
+
     def initializeGL(self):
         # Create a new OpenGL context
-        self.ctx = moderngl.create_context()
+        with self.profiler.span("GL context", "startup"):
+            self.ctx = moderngl.create_context()
 
         # Create the shader program
-        self.prog = self.ctx.program(
-            vertex_shader=shaders.vertex_shader,
-            fragment_shader=shaders.fragment_shader
-        )
-        self.set_scene()
+        with self.profiler.span("Compile shaders", "startup"):
+            self.prog = self.ctx.program(
+                vertex_shader=shaders.vertex_shader,
+                fragment_shader=shaders.fragment_shader
+            )
+        with self.profiler.span("Grid and scene", "startup"):
+            self.resources = GpuResources(self.ctx)
+            self.grid = grid(self.size, self.cell)
+            self.render_query = self.ctx.query(time=True)
+            self.textures.max_size = self.ctx.info["GL_MAX_TEXTURE_SIZE"]
+            self.render_timed = False
+            self.set_scene()
+        if self.pending_mesh is not None:
+            self.set_mesh(self.pending_mesh)
+            self.pending_mesh = None
 
     def set_scene(self):
         # Setting shader parameters
@@ -62,13 +169,29 @@ class QGLControllerWidget(QtOpenGL.QGLWidget):
         self.color = self.prog['Color']
         self.mvp = self.prog['Mvp']
         self.prog["Texture"].value = 0
+        self.prog["FlatShading"].value = False
+        self.prog["Instanced"].value = False
+        self.prog["Points"].value = False
+        self.prog["PointColors"].value = False
+        self.prog["Textured"].value = False
         self.light.value = (1.0, 1.0, 1.0)
         self.color.value = (1.0, 1.0, 1.0, 1.0)
+        self.compact = self.prog['CompactVertices']
+        self.compact.value = False
 
         # Setting mesh parameters
         self.mesh = None
-        self.vbo = self.ctx.buffer(self.grid.astype('f4'))
-        self.vao2 = self.ctx.simple_vertex_array(self.prog, self.vbo, 'in_position')
+        self.bvh = None
+        self.picks = []
+        self.resources.release("mesh")
+        self.resources.release("pick")
+        self.end_stream()
+        self.lod_vaos = []
+        self.lod_triangles = []
+        self.lod_ranges = []
+        self.update_draw_batches()
+        self.set_lod_level(0)
+        self.update_grid()
 
         # Setting ArcBall parameters
         self.arc_ball = ArcBallUtil(self.width(), self.height())
@@ -77,55 +200,732 @@ class QGLControllerWidget(QtOpenGL.QGLWidget):
 
     def paintGL(self):
         # OpenGL loop
+        start = self.last_frame = time.perf_counter()
+        # GPU time of the previous frame, read before its query is reused
+        gpu_time = self.render_query.elapsed * 1e-9 if self.render_timed else None
+        self.render_timed = False
+        self.frame_draw_calls = 0
         self.ctx.clear(*self.bg_color)
         self.ctx.enable(moderngl.BLEND)
         self.ctx.enable(moderngl.DEPTH_TEST | moderngl.CULL_FACE)
         self.ctx.wireframe = self.is_wireframe
-        if self.mesh is None:
+        # Decoded textures go up one per frame, the next frame is asked for while more wait
+        if self.textures.upload_pending(self.ctx):
+            self.request_update()
+        self.textures.in_use = {file_name for file_name in self.material_textures if file_name}
+        if self.mesh is None and self.stream_vao is None and not self.scene.models:
+            self.end_frame(start, gpu_time)
             return
 
         # Update projection matrix loop
         self.aspect_ratio = self.width() / max(1.0, self.height())
-        proj = Matrix44.perspective_projection(self.fov, self.aspect_ratio, 0.1, 1000.0)
-        lookat = Matrix44.look_at(
-            (0.0, 0.0, self.camera_zoom),
-            (0.0, 0.0, 0.0),
-            (0.0, 1.0, 0.0),
-        )
+        view = view_projection(self.fov, self.aspect_ratio, self.camera_zoom)
+        self.arc_ball.applyDrag()
         self.arc_ball.Transform[3, :3] = -self.arc_ball.Transform[:3, :3].T @ self.center
-        self.mvp.write((proj * lookat * self.arc_ball.Transform).astype('f4'))
+        self.view_matrix = numpy.array(view * self.arc_ball.Transform, dtype='f8')
+        self.mvp.write(self.view_matrix.astype('f4'))
 
-        # Render mesh loop
+        # Render mesh loop, the GPU time of the previous frame drives the LOD choice
+        if gpu_time is not None and self.interacting:
+            self.adapt_lod(gpu_time)
         self.color.value = self.new_color
-        self.vao.render()
+        with self.render_query:
+            if self.mesh is None:
+                if self.stream_vao is not None:
+                    self.render_stream()
+            else:
+                self.compact.value = self.vertex_layout is COMPACT_LAYOUT
+                if self.is_overlay and not self.mesh.point_cloud:
+                    self.render_overlay(self.lod_level)
+                else:
+                    self.render_mesh(self.lod_level)
+                self.compact.value = False
+            self.render_scene()
 
-        # Render grid loop
-        self.color.value = (1.0, 1.0, 1.0, self.grid_alpha_value)
-        self.vao2.render(moderngl.LINES)
-        self.color.value = self.new_color
+            # Render grid loop
+            self.color.value = (1.0, 1.0, 1.0, self.grid_alpha_value)
+            self.vao2.render(moderngl.LINES)
+            self.color.value = self.new_color
+        self.render_picks()
+        self.render_timed = True
+        self.end_frame(start, gpu_time)
+
+    def end_frame(self, start, gpu_time):
+        now = time.perf_counter()
+        self.profiler.frame(start, now - start, gpu_time)
+        self.frames_drawn += 1
+        if self.frames_drawn == 1:
+            self.profiler.record("First frame", start, now - start, "startup")
+            self.first_frame_drawn.emit()
+        if self.frame_draw_calls != self.draw_calls:
+            self.draw_calls = self.frame_draw_calls
+            self.draw_calls_changed.emit(self.draw_calls)
+        if now - self.last_stats < 0.25:
+            return
+        self.last_stats = now
+        stats = self.profiler.frame_stats()
+        stats["gpu_memory"] = self.resources.allocated_bytes + self.textures.total
+        stats["load_time"] = self.load_time
+        stats["chunks"] = self.chunks_drawn
+        stats["scene_memory"] = (self.scene.residency.total, self.scene.residency.budget)
+        self.stats_changed.emit(stats)
 
     def set_mesh(self, new_mesh):
+        if not hasattr(self, "ctx"):
+            self.pending_mesh = new_mesh
+            return
         if new_mesh is None:
             self.set_scene()
+            self.request_update()
             return
+        # Arrays arrive ready-made from the loader, only the upload runs here
+        streamed = self.stream_bounds is not None
+        self.end_stream()
         self.mesh = new_mesh
-        self.mesh.update_normals()
+        start = time.perf_counter()
+        self.profiler.record_timings(self.mesh.timings, start, file=self.mesh.file_name)
+
+        with self.profiler.span("Buffer upload", vertices=int(self.mesh.n_vertices), triangles=int(self.mesh.n_faces)):
+            if self.mesh.point_cloud:
+                self.upload_points()
+            else:
+                self.upload_triangles()
+            for level in range(len(self.mesh.lods) + 1, LOD_MAX_LEVELS + 1):
+                self.resources.release(f"mesh_lod{level}")
+
+            # Chunk bounds as boxes, drawn into occlusion queries
+            self.resources.release("mesh_chunk_boxes")
+            self.chunks_drawn = None
+            if self.mesh.chunks is not None:
+                boxes = self.resources.buffer("mesh_chunk_boxes", box_triangles(self.mesh.chunk_bounds))
+                self.chunk_box_vao = self.resources.vertex_array(
+                    "mesh_chunk_boxes", self.prog, [(boxes, '3f', 'in_position')])
+        self.render_timed = False
+        self.set_lod_level(0)
+
+        self.lod_ranges = [self.mesh.ranges] + list(self.mesh.lod_ranges)
+        self.update_draw_batches()
+
+        # Picking works once the BVH is ready, the view stays interactive meanwhile
+        self.bvh = None
+        self.picks = []
+        self.resources.release("pick")
+        if not self.mesh.point_cloud:
+            threading.Thread(target=self.build_bvh, args=(self.mesh,), daemon=True).start()
+
+        with self.profiler.span("init_arcball"):
+            if streamed:
+                # The user may already be orbiting the preview, keep the rotation
+                self.frame_bounds(self.mesh.bounding_box)
+            else:
+                self.init_arcball()
+            if self.scene.models:
+                self.frame_bounds(self.scene.bounds(self.mesh.bounding_box))
+        self.load_time = sum(duration for _, duration in self.mesh.timings) + time.perf_counter() - start
+        self.last_stats = 0.0
+        self.mesh_changed.emit(self.mesh)
+        self.request_update()
+
+    def begin_stream(self):
+        # Drops the preview of the previous load, returns the generation its blocks carry
+        self.discard_stream()
+        self.stream_generation += 1
+        return self.stream_generation
+
+    def append_stream(self, points, indices, generation=None):
+        # Parsed vertices and triangles appended to growing buffers; the first block
+        # replaces whatever was shown and the camera follows the running bounding box
+        if not hasattr(self, "ctx") or generation not in (None, self.stream_generation):
+            return
+        start = time.perf_counter()
+        if self.stream_bounds is None:
+            self.set_scene()
+        points = numpy.asarray(points, dtype='f4').reshape(-1, 3)
+        if len(points):
+            vertex_buffer = self.resources.grow("stream_vertices", (self.stream_vertices + len(points)) * 12)
+            write_array(vertex_buffer, points, offset=self.stream_vertices * 12)
+            self.stream_vertices += len(points)
+            low, high = points.min(axis=0), points.max(axis=0)
+            if self.stream_bounds is not None:
+                low = numpy.minimum(low, self.stream_bounds[0])
+                high = numpy.maximum(high, self.stream_bounds[1])
+            self.stream_bounds = (low, high)
+            self.frame_bounds(self.stream_bounds)
+
+        # Triangles over vertices that have not arrived yet wait for the full mesh,
+        # point clouds come without indices and show their points as they arrive
+        self.stream_points = indices is None
+        triangles = numpy.empty((0, 3), dtype='u4') if indices is None else numpy.asarray(indices).reshape(-1, 3)
+        triangles = triangles[triangles.max(axis=1) < self.stream_vertices] if len(triangles) else triangles
+        if len(triangles):
+            index_buffer = self.resources.grow("stream_indices", (self.stream_triangles + len(triangles)) * 12)
+            write_array(index_buffer, triangles, dtype='u4', offset=self.stream_triangles * 12)
+            self.stream_triangles += len(triangles)
+        if self.stream_triangles:
+            self.stream_vao = self.resources.vertex_array(
+                "stream", self.prog, [(self.resources.buffers["stream_vertices"], '3f', 'in_position')],
+                self.resources.buffers["stream_indices"], 4)
+        elif self.stream_points and self.stream_vertices:
+            self.stream_vao = self.resources.vertex_array(
+                "stream", self.prog, [(self.resources.buffers["stream_vertices"], '3f', 'in_position')])
+        self.profiler.record("Stream upload", start, time.perf_counter() - start,
+                             vertices=len(points), triangles=len(triangles))
+        self.request_update()
+
+    def discard_stream(self, generation=None):
+        # A cancelled or failed load leaves an empty view rather than half a mesh,
+        # unless a newer load has started streaming meanwhile
+        if self.stream_bounds is not None and generation in (None, self.stream_generation):
+            self.end_stream()
+            self.request_update()
+
+    def end_stream(self):
+        self.resources.release("stream")
+        self.stream_vao = None
+        self.stream_vertices = 0
+        self.stream_triangles = 0
+        self.stream_points = False
+        self.stream_bounds = None
+
+    def render_stream(self):
+        if self.stream_points:
+            # Small unlit discs until the spacing is known
+            self.ctx.point_size = 2.0
+            self.prog["Points"].value = True
+            self.stream_vao.render(moderngl.POINTS, vertices=self.stream_vertices)
+            self.frame_draw_calls += 1
+            self.prog["Points"].value = False
+            return
+        # Normals come later with the full mesh, faces are lit from screen-space derivatives
+        self.prog["FlatShading"].value = True
+        self.stream_vao.render(vertices=self.stream_triangles * 3)
+        self.frame_draw_calls += 1
+        self.prog["FlatShading"].value = False
+
+    def upload_triangles(self):
+        # Creates an index buffer, buffers from the previous mesh are refilled in place
+        indices_dtype = index_dtype(self.mesh.n_vertices)
+        self.index_element_size = numpy.dtype(indices_dtype).itemsize
+        index_buffer = self.resources.buffer("mesh_indices", self.mesh.indices, dtype=indices_dtype)
+        self.resources.release("mesh_colors")
+
+        # One interleaved position/normal vertex buffer object (VBO), texture coordinates apart
+        vertex_buffer = self.upload_vertices()
+        vao_content = [(vertex_buffer,) + self.vertex_layout]
+        if self.mesh.texcoords is None:
+            self.resources.release("mesh_texcoords")
+        else:
+            vao_content.append((self.resources.buffer("mesh_texcoords", self.mesh.texcoords), '2f', 'in_texcoord_0'))
+        self.mesh_content = vao_content
+        self.vao = self.resources.vertex_array("mesh", self.prog, vao_content, index_buffer, self.index_element_size)
+
+        # LOD levels share the vertex buffers and only bring their own indices
+        self.lod_vaos = [self.vao]
+        self.lod_triangles = [self.mesh.n_faces]
+        for level, lod_indices in enumerate(self.mesh.lods, 1):
+            lod_buffer = self.resources.buffer(f"mesh_lod{level}_indices", lod_indices, dtype=indices_dtype)
+            self.lod_vaos.append(self.resources.vertex_array(
+                f"mesh_lod{level}", self.prog, vao_content, lod_buffer, self.index_element_size))
+            self.lod_triangles.append(len(lod_indices) // 3)
+
+    def upload_points(self):
+        # Level 0 draws every point without indices, the voxel levels index subsets of the
+        # same vertices; lod_triangles counts points here
+        self.resources.release("mesh_indices")
+        self.resources.release("mesh_texcoords")
+        self.vertex_layout = FLOAT_LAYOUT
+        self.index_element_size = 4
+        vao_content = self.point_content("mesh", self.mesh)
+        self.vao = self.resources.vertex_array("mesh", self.prog, vao_content)
+        self.lod_vaos = [self.vao]
+        self.lod_triangles = [self.mesh.n_vertices]
+        for level, lod_indices in enumerate(self.mesh.lods, 1):
+            lod_buffer = self.resources.buffer(f"mesh_lod{level}_indices", lod_indices, dtype="u4")
+            self.lod_vaos.append(self.resources.vertex_array(f"mesh_lod{level}", self.prog, vao_content, lod_buffer, 4))
+            self.lod_triangles.append(len(lod_indices))
+
+    def point_content(self, name, mesh):
+        # Positions, normals when the scan has them and normalized RGBA bytes when it has colors
+        if mesh.normals is None:
+            content = [(self.resources.buffer(f"{name}_vertices", mesh.points, dtype="f4"), '3f', 'in_position')]
+        else:
+            content = [(self.resources.interleaved_buffer(f"{name}_vertices", (mesh.points, mesh.normals)),)
+                       + FLOAT_LAYOUT]
+        if mesh.colors is None:
+            self.resources.release(f"{name}_colors")
+        else:
+            content.append((self.resources.buffer(f"{name}_colors", mesh.colors), '4f1', 'in_color'))
+        return content
+
+    def render_points(self, vertex_array, mesh, count, colors=True, instances=1):
+        # Discs sized in screen space: the spacing of the drawn subset, which grows as
+        # fewer points cover the same surface, projected at each point's depth
+        self.ctx.enable(moderngl.PROGRAM_POINT_SIZE)
+        self.prog["Points"].value = True
+        self.prog["PointColors"].value = colors and mesh.colors is not None
+        self.prog["PointSize"].value = self.point_scale * mesh.point_spacing * numpy.sqrt(mesh.n_vertices / max(1, count))
+        self.prog["PointScale"].value = 0.5 * self.ctx.viewport[3] * numpy.linalg.norm(self.view_matrix[:3, 1])
+        vertex_array.render(moderngl.POINTS, vertices=count, instances=instances)
+        self.frame_draw_calls += 1
+        self.prog["Points"].value = False
+        self.prog["PointColors"].value = False
+        self.ctx.disable(moderngl.PROGRAM_POINT_SIZE)
+
+    def set_point_scale(self, scale):
+        self.point_scale = scale
+        if hasattr(self, "ctx"):
+            self.request_update()
+
+    def upload_vertices(self):
+        points, normals = self.mesh.points, self.mesh.normals
+        if not self.compact_vertices:
+            self.vertex_layout = FLOAT_LAYOUT
+            return self.resources.interleaved_buffer("mesh_vertices", (points, normals))
+        # Quantized against the same bounding box init_arcball frames,
+        # normally already done by the loader process
+        offset, scale = position_range(self.mesh.bounding_box)
+        self.prog["PositionOffset"].value = tuple(offset)
+        self.prog["PositionScale"].value = tuple(scale)
+        self.vertex_layout = COMPACT_LAYOUT
+        if self.mesh.compact is not None:
+            return self.resources.buffer("mesh_vertices", self.mesh.compact)
+        return self.resources.chunked_buffer(
+            "mesh_vertices", len(points), COMPACT_VERTEX.itemsize,
+            lambda start, stop: compact_vertices(points[start:stop], normals[start:stop], self.mesh.bounding_box))
+
+    def build_bvh(self, mesh):
+        with self.profiler.span("Build BVH", triangles=int(mesh.n_faces)):
+            bvh = TriangleBVH(mesh.points, mesh.indices)
+        # A newer mesh may have been loaded while this one was building
+        if self.mesh is mesh:
+            self.bvh = bvh
+
+    def pick(self, x, y):
+        # Surface point under a widget position, None when the ray misses the mesh
+        if self.bvh is None or self.view_matrix is None:
+            return None
+        start = time.perf_counter()
+        ndc_x = 2.0 * x / max(1, self.width()) - 1.0
+        ndc_y = 1.0 - 2.0 * y / max(1, self.height())
+        inverse = numpy.linalg.inv(self.view_matrix)
+        near = numpy.array([ndc_x, ndc_y, -1.0, 1.0]) @ inverse
+        far = numpy.array([ndc_x, ndc_y, 1.0, 1.0]) @ inverse
+        near = near[:3] / near[3]
+        direction = far[:3] / far[3] - near
+        hit = self.bvh.intersect(near, direction)
+        if hit is None:
+            return None
+        face, distance, u, v = hit
+        corners = self.mesh.indices[face * 3:face * 3 + 3]
+        weights = numpy.array([1.0 - u - v, u, v])
+        normal = weights @ self.mesh.normals[corners].astype('f8')
+        normal /= max(numpy.linalg.norm(normal), 1e-12)
+        # Reported as the triangle's index in the file, not in the reordered index buffer
+        if self.mesh.triangle_order is not None:
+            face = int(self.mesh.triangle_order[face])
+        self.profiler.record("Pick", start, time.perf_counter() - start, "frame", face=face)
+        return {"point": near + distance * direction, "normal": normal, "face": face,
+                "seconds": time.perf_counter() - start}
+
+    def pick_at(self, x, y):
+        # The last two picks are measured and joined by a line
+        if self.bvh is None:
+            # Point clouds have no surface to pick
+            self.picked.emit({} if self.mesh is not None and self.mesh.point_cloud else None)
+            return
+        hit = self.pick(x, y)
+        if hit is not None:
+            self.picks = (self.picks + [hit["point"]])[-2:]
+            if len(self.picks) == 2:
+                hit["distance"] = float(numpy.linalg.norm(self.picks[1] - self.picks[0]))
+            pick_buffer = self.resources.buffer("pick", numpy.array(self.picks, dtype='f4'))
+            self.pick_vao = self.resources.vertex_array("pick", self.prog, [(pick_buffer, '3f', 'in_position')])
+            self.request_update()
+        self.picked.emit(hit if hit is not None else {})
+
+    def render_picks(self):
+        # Drawn over the mesh so the measured segment stays visible
+        if not self.picks:
+            return
+        self.ctx.disable(moderngl.DEPTH_TEST)
+        self.ctx.point_size = 6.0
+        self.color.value = (1.0, 0.8, 0.0, 1.0)
+        self.pick_vao.render(moderngl.LINES if len(self.picks) == 2 else moderngl.POINTS, vertices=len(self.picks))
+        self.color.value = self.new_color
+        self.ctx.enable(moderngl.DEPTH_TEST)
 
-        # Creates an index buffer
-        index_buffer = self.ctx.buffer(numpy.array(self.mesh.face_vertex_indices(), dtype="u4").tobytes())
+    def add_model(self, mesh):
+        # Placed to the right of everything shown, the camera frames the whole scene
+        primary = None if self.mesh is None else self.mesh.bounding_box
+        self.scene.add(mesh, self.scene.bounds(primary), tuple(self.new_color[:3]))
+        self.frame_bounds(self.scene.bounds(primary))
+        self.scene_changed.emit(self.scene)
+        self.request_update()
 
-        # Creates a list of vertex buffer objects (VBOs)
-        vao_content = [(self.ctx.buffer(numpy.array(self.mesh.points(), dtype="f4").tobytes()), '3f', 'in_position'),
-                       (self.ctx.buffer(numpy.array(self.mesh.vertex_normals(), dtype="f4").tobytes()), '3f', 'in_normal')]
-        self.vao = self.ctx.vertex_array(self.prog, vao_content, index_buffer, 4)
-        self.init_arcball()
+    def remove_model(self, index):
+        mesh = self.scene.remove(index)
+        if mesh is not None:
+            self.release_model(id(mesh))
+        self.scene_changed.emit(self.scene)
+        self.request_update()
+
+    def clear_scene(self):
+        for key in list(self.scene_vaos):
+            self.release_model(key)
+        self.scene.models = []
+        self.scene_changed.emit(self.scene)
+        self.request_update()
+
+    def release_model(self, key):
+        # Only the GPU copy goes, the host arrays (memory-mapped from the cache when
+        # it is available) stay with the mesh for the next upload
+        self.resources.release(f"scene{key}_")
+        self.scene_vaos.pop(key, None)
+        self.scene.residency.discard(key)
+
+    def set_model_visible(self, index, visible):
+        self.scene.models[index].visible = visible
+        self.request_update()
+
+    def set_model_color(self, index, color):
+        self.scene.models[index].color = tuple(color)
+        self.request_update()
+
+    def set_model_offset(self, index, offset):
+        self.scene.models[index].transform[3, :3] = offset
+        self.request_update()
+
+    def upload_model(self, key, mesh, in_view):
+        # Makes room under the budget, then uploads like set_mesh does for the primary mesh
+        indices_dtype = index_dtype(mesh.n_vertices)
+        size = sum(array.nbytes for array in (mesh.points, mesh.normals, mesh.colors, mesh.texcoords)
+                   if array is not None)
+        size += len(mesh.indices) * numpy.dtype(indices_dtype).itemsize
+        for evicted in self.scene.residency.admit(key, size, in_view):
+            self.resources.release(f"scene{evicted}_")
+            self.scene_vaos.pop(evicted, None)
+        if mesh.point_cloud:
+            with self.profiler.span("Scene upload", file=mesh.file_name, bytes=size):
+                instance_buffer = self.resources.buffer(f"scene{key}_instances", reserve=76, dynamic=True)
+                self.scene_vaos[key] = self.resources.vertex_array(
+                    f"scene{key}", self.prog, self.point_content(f"scene{key}", mesh)
+                    + [(instance_buffer, '16f 3f/i', 'in_model', 'in_material')])
+            return
+        with self.profiler.span("Scene upload", file=mesh.file_name, bytes=size):
+            index_buffer = self.resources.buffer(f"scene{key}_indices", mesh.indices, dtype=indices_dtype)
+            vertex_buffer = self.resources.interleaved_buffer(f"scene{key}_vertices", (mesh.points, mesh.normals))
+            instance_buffer = self.resources.buffer(f"scene{key}_instances", reserve=76, dynamic=True)
+            content = [(vertex_buffer,) + FLOAT_LAYOUT, (instance_buffer, '16f 3f/i', 'in_model', 'in_material')]
+            if mesh.texcoords is not None:
+                content.append((self.resources.buffer(f"scene{key}_texcoords", mesh.texcoords), '2f', 'in_texcoord_0'))
+            self.scene_vaos[key] = self.resources.vertex_array(
+                f"scene{key}", self.prog, content, index_buffer, numpy.dtype(indices_dtype).itemsize)
+
+    def render_scene(self):
+        # One instanced draw per mesh for its models inside the view frustum
+        groups = []
+        for key, (mesh, models) in self.scene.visible_groups().items():
+            bounds = numpy.array([model.bounds for model in models], dtype='f4')
+            in_view = visible_chunks(bounds, self.view_matrix)
+            if in_view.any():
+                groups.append((key, mesh, [model for model, shown in zip(models, in_view) if shown]))
+        if not groups:
+            return
+        in_view = {key for key, _, _ in groups}
+        self.prog["Instanced"].value = True
+        self.prog["MaterialColors"].value = True
+        for key, mesh, models in groups:
+            if key in self.scene_vaos:
+                self.scene.residency.touch(key)
+            else:
+                self.upload_model(key, mesh, in_view)
+            instances = numpy.array([tuple(model.transform.ravel()) + model.color for model in models], dtype='f4')
+            self.resources.buffer(f"scene{key}_instances", instances)
+            if mesh.point_cloud:
+                self.render_points(self.scene_vaos[key], mesh, mesh.n_vertices, instances=len(models))
+            elif mesh.texcoords is not None:
+                self.render_textured_instances(self.scene_vaos[key], mesh, len(models))
+            else:
+                self.scene_vaos[key].render(instances=len(models))
+                self.frame_draw_calls += 1
+        self.prog["Instanced"].value = False
+        self.prog["MaterialColors"].value = False
+
+    def render_textured_instances(self, vertex_array, mesh, instances):
+        # One instanced draw per material range, models keep their own color where there is no texture
+        for material, first, count in mesh.ranges:
+            file_name = mesh.materials[material]["texture"]
+            texture = None
+            if file_name is not None:
+                self.textures.in_use.add(file_name)
+                texture = self.textures.get(file_name)
+            if texture is not None:
+                texture.use(0)
+            self.prog["Textured"].value = texture is not None
+            vertex_array.render(first=int(first) * 3, vertices=int(count) * 3, instances=instances)
+            self.frame_draw_calls += 1
+        self.prog["Textured"].value = False
+
+    def set_scene_budget(self, budget):
+        self.scene.residency.budget = budget
+
+    def set_texture_budget(self, budget):
+        self.textures.set_budget(budget)
+
+    def set_compact_vertices(self, enabled):
+        # Takes effect from the next load
+        self.compact_vertices = enabled
+
+    def set_index_optimization(self, mode):
+        # Takes effect from the next load
+        self.index_optimization = mode
+
+    def render_mesh(self, level):
+        if self.mesh.point_cloud:
+            self.render_points(self.lod_vaos[level], self.mesh, self.lod_triangles[level])
+        elif level == 0 and self.mesh.chunks is not None:
+            self.render_chunks()
+        else:
+            self.render_batches(level)
+
+    def render_batches(self, level):
+        ranges = self.draw_lists[level]
+        if ranges is None:
+            self.lod_vaos[level].render()
+            self.frame_draw_calls += 1
+            return
+        if self.multi_draw_vaos:
+            # One call, the per-instance attribute picks each batch's color
+            self.prog["MaterialColors"].value = True
+            self.multi_draw_vaos[level].render_indirect(self.indirect_buffers[level], count=len(ranges))
+            self.frame_draw_calls += 1
+            self.prog["MaterialColors"].value = False
+            return
+        self.render_ranges(level, ranges)
+
+    def render_ranges(self, level, ranges):
+        # Rows of (material, first triangle, triangle count), colored per material when there are materials
+        alpha = self.new_color[3]
+        for material, first, count in ranges:
+            if self.material_colors:
+                self.use_material(material, alpha)
+            self.lod_vaos[level].render(first=first * 3, vertices=count * 3)
+        self.frame_draw_calls += len(ranges)
+        self.color.value = self.new_color
+        self.prog["Textured"].value = False
+
+    def use_material(self, material, alpha):
+        # Diffuse color and, once it is uploaded, the texture of one material
+        self.color.value = self.material_colors[material] + (alpha,)
+        file_name = self.material_textures[material]
+        texture = None if file_name is None else self.textures.get(file_name)
+        if texture is not None:
+            texture.use(0)
+        self.prog["Textured"].value = texture is not None
+
+    def render_overlay(self, level):
+        # The usual mesh draws, sent through the wire program with VAOs over the same buffers;
+        # multi-draw VAOs belong to the solid program, so batches go one call each here
+        solid_prog, solid_vaos, multi_draw_vaos = self.prog, self.lod_vaos, self.multi_draw_vaos
+        if self.wire_prog is None:
+            self.wire_prog = self.ctx.program(vertex_shader=shaders.vertex_shader,
+                                              geometry_shader=shaders.wire_geometry_shader,
+                                              fragment_shader=shaders.wire_fragment_shader)
+            self.wire_prog["Texture"].value = 0
+        self.bind_program(self.wire_prog)
+        # Chunk boxes of the occlusion queries still go through the solid program
+        solid_prog["CompactVertices"].value = False
+        self.prog["Viewport"].value = tuple(self.ctx.viewport[2:])
+        self.prog["WireColor"].value = self.wire_color()
+        self.prog["WireWidth"].value = self.wire_width
+        self.lod_vaos = self.wire_vertex_arrays()
+        self.multi_draw_vaos = []
+        self.render_mesh(level)
+        self.bind_program(solid_prog)
+        self.lod_vaos, self.multi_draw_vaos = solid_vaos, multi_draw_vaos
+
+    def bind_program(self, program):
+        # Uniform values belong to a program, the per-frame ones follow the switch
+        for name in ("Mvp", "Light", "Color", "CompactVertices", "PositionOffset", "PositionScale"):
+            program[name].value = self.prog[name].value
+        self.prog = program
+        self.light = program['Light']
+        self.color = program['Color']
+        self.mvp = program['Mvp']
+        self.compact = program['CompactVertices']
+
+    def wire_vertex_arrays(self):
+        # Built once per mesh, the resource cache hands back the same VAOs every frame
+        content = self.mesh_content
+        names = ["mesh_indices"] + [f"mesh_lod{level}_indices" for level in range(1, len(self.lod_vaos))]
+        return [self.resources.vertex_array(f"mesh_wire{level}", self.wire_prog, content,
+                                            self.resources.buffers[name], self.index_element_size)
+                for level, name in enumerate(names)]
+
+    def wire_color(self):
+        # The picked edge color, else a dark shade of the model color or a light one for dark models
+        if self.wire_rgb is not None:
+            return tuple(self.wire_rgb) + (self.wire_alpha,)
+        r, g, b = self.new_color[:3]
+        if 0.3 * r + 0.59 * g + 0.11 * b > 0.35:
+            return (0.3 * r, 0.3 * g, 0.3 * b, self.wire_alpha)
+        return tuple(value + 0.7 * (1.0 - value) for value in (r, g, b)) + (self.wire_alpha,)
+
+    def set_wire_width(self, width):
+        self.wire_width = width
+        if hasattr(self, "ctx"):
+            self.request_update()
+
+    def render_chunks(self):
+        # Only chunks inside the view frustum are drawn, consecutive ones in one call
+        mask = visible_chunks(self.mesh.chunk_bounds, self.view_matrix)
+        self.chunks_drawn = (int(mask.sum()), len(mask))
+        if self.occlusion_culling:
+            self.render_occluded(numpy.flatnonzero(mask))
+            return
+        if mask.all():
+            self.render_batches(0)
+            return
+        self.render_ranges(0, visible_ranges(self.mesh.chunks, mask))
+
+    def render_occluded(self, visible):
+        # Front to back; the box of each chunk is drawn into an occlusion query against the
+        # depth of the chunks before it and the chunk itself only renders if the box passed
+        bounds = self.mesh.chunk_bounds[visible]
+        clip_w = self.view_matrix[:3, 3]
+        nearest = numpy.where(clip_w >= 0, bounds[:, 0], bounds[:, 1]) @ clip_w + self.view_matrix[3, 3]
+        while len(self.chunk_queries) < len(visible):
+            self.chunk_queries.append(self.ctx.query(any_samples=True))
+        framebuffer = self.ctx.fbo or self.ctx.detect_framebuffer()
+        ranges = self.mesh.chunks
+        alpha = self.new_color[3]
+        compact = self.compact.value
+        order = numpy.argsort(nearest)
+        for index, (chunk, distance) in enumerate(zip(visible[order], nearest[order])):
+            material, first, count = (int(value) for value in ranges[chunk])
+            if self.material_colors:
+                self.use_material(material, alpha)
+            if distance <= 0:
+                # The box reaches behind the camera, its test would be meaningless
+                self.lod_vaos[0].render(first=first * 3, vertices=count * 3)
+                self.frame_draw_calls += 1
+                continue
+            query = self.chunk_queries[index]
+            # Masks only take effect when the framebuffer is bound again
+            framebuffer.color_mask = (False, False, False, False)
+            framebuffer.depth_mask = False
+            framebuffer.use()
+            self.ctx.disable(moderngl.CULL_FACE)
+            self.ctx.wireframe = False
+            self.compact.value = False
+            with query:
+                self.chunk_box_vao.render(first=int(chunk) * 36, vertices=36)
+            self.compact.value = compact
+            framebuffer.color_mask = (True, True, True, True)
+            framebuffer.depth_mask = True
+            framebuffer.use()
+            self.ctx.enable(moderngl.CULL_FACE)
+            self.ctx.wireframe = self.is_wireframe
+            with query.crender:
+                self.lod_vaos[0].render(first=first * 3, vertices=count * 3)
+            # The box and the chunk, which the GPU skips when the box was hidden
+            self.frame_draw_calls += 2
+        self.color.value = self.new_color
+        self.prog["Textured"].value = False
+
+    def set_occlusion_culling(self, enabled):
+        self.occlusion_culling = enabled
+        if hasattr(self, "ctx"):
+            self.request_update()
+
+    def set_multi_draw(self, enabled):
+        # glMultiDrawElementsIndirect needs OpenGL 4.3
+        self.multi_draw = enabled
+        if hasattr(self, "ctx"):
+            self.update_draw_batches()
+            self.request_update()
+
+    def update_draw_batches(self):
+        self.draw_lists = [None if ranges is None else [tuple(int(value) for value in row) for row in ranges]
+                           for ranges in self.lod_ranges]
+        self.update_material_colors()
+        self.resources.release("mesh_multi_draw")
+        self.multi_draw_vaos = []
+        self.indirect_buffers = []
+        # Textures are bound between draws, textured meshes keep one call per batch
+        use_multi_draw = self.multi_draw and self.ctx.version_code >= 430 and not any(self.material_textures)
+        if use_multi_draw and self.mesh is not None and self.mesh.ranges is not None:
+            colors = self.resources.buffer("mesh_multi_draw_colors", numpy.array(self.material_colors, dtype="f4"))
+            vao_content = [(self.resources.buffers["mesh_vertices"],) + self.vertex_layout,
+                           (colors, '3f/i', 'in_material')]
+            for level, ranges in enumerate(self.lod_ranges):
+                # Rows of (count, instance count, first index, base vertex, base instance)
+                commands = numpy.zeros((len(ranges), 5), dtype="u4")
+                commands[:, 0] = ranges[:, 2] * 3
+                commands[:, 1] = 1
+                commands[:, 2] = ranges[:, 1] * 3
+                commands[:, 4] = ranges[:, 0]
+                name = "mesh_indices" if level == 0 else f"mesh_lod{level}_indices"
+                self.indirect_buffers.append(self.resources.buffer(f"mesh_multi_draw_commands{level}", commands))
+                self.multi_draw_vaos.append(self.resources.vertex_array(
+                    f"mesh_multi_draw{level}", self.prog, vao_content, self.resources.buffers[name],
+                    self.index_element_size))
+
+    def update_material_colors(self):
+        # Materials without a diffuse color use the model color
+        fallback = tuple(self.new_color[:3])
+        materials = [] if self.mesh is None else self.mesh.materials
+        self.material_colors = [fallback if material["color"] is None else tuple(material["color"])
+                                for material in materials]
+        # Texture coordinates only come with meshes that have a textured material
+        textured = self.mesh is not None and self.mesh.texcoords is not None
+        self.material_textures = [material["texture"] if textured else None for material in materials]
+        for file_name in self.material_textures:
+            if file_name is not None:
+                # Starts decoding before the first frame asks for it
+                self.textures.get(file_name)
+        if "mesh_multi_draw_colors" in self.resources.buffers and self.material_colors:
+            self.resources.buffer("mesh_multi_draw_colors", numpy.array(self.material_colors, dtype="f4"))
+
+    def set_lod_level(self, level):
+        self.lod_level = level
+        self.lod_changed.emit(level, self.lod_triangles[level] if self.lod_triangles else 0)
+
+    def adapt_lod(self, render_time):
+        # Coarser when over the frame budget, finer when the finer level is predicted to fit
+        level = self.lod_level
+        if render_time > self.frame_interval and level < len(self.lod_vaos) - 1:
+            level += 1
+        elif level > 0:
+            predicted = render_time * self.lod_triangles[level - 1] / max(1, self.lod_triangles[level])
+            if predicted < self.frame_interval * 0.7:
+                level -= 1
+        if level != self.lod_level:
+            self.set_lod_level(level)
+
+    def begin_interaction(self):
+        self.interacting = True
+        self.interaction_timer.stop()
+
+    def end_interaction(self):
+        # Back to full detail once the camera settles
+        self.interacting = False
+        if self.lod_level != 0:
+            self.set_lod_level(0)
+            self.request_update()
+
+    def frame_bounds(self, bounding_box):
+        # Recenters and rescales on a bounding box, the rotation is kept
+        bounding_box_min, bounding_box_max = bounding_box
+        self.center = 0.5*(bounding_box_max+bounding_box_min)
+        scale = numpy.linalg.norm(bounding_box_max-self.center) or 1.0
+        self.arc_ball.Transform[:3, :3] *= self.scale / scale
+        self.scale = scale
 
     def init_arcball(self):
         # Create ArcBall
         self.arc_ball = ArcBallUtil(self.width(), self.height())
-        mesh_points = self.mesh.points()
-        bounding_box_min = numpy.min(mesh_points, axis=0)
-        bounding_box_max = numpy.max(mesh_points, axis=0)
+        bounding_box_min, bounding_box_max = self.mesh.bounding_box
         self.center = 0.5*(bounding_box_max+bounding_box_min)
         self.scale = numpy.linalg.norm(bounding_box_max-self.center)
         self.arc_ball.Transform[:3, :3] /= self.scale
@@ -137,27 +937,40 @@ class QGLControllerWidget(QtOpenGL.QGLWidget):
         print(color)
         self.color.value = color
         self.new_color = color
+        self.update_material_colors()
+        self.request_update()
+
+    def change_wire_color(self, color):
+        # The wireframe color button colors the edges of the overlay, the model otherwise
+        if not self.is_overlay:
+            self.change_light_color(color)
+            return
+        self.wire_rgb = color
+        self.request_update()
 
     def update_alpha(self, alpha):
+        if self.is_overlay:
+            self.wire_alpha = (alpha*0.01)
+            self.request_update()
+            return
         self.color_alpha = (alpha*0.01)
         color_list = list(self.new_color)
         color_list[-1] = self.color_alpha
         self.new_color = tuple(color_list)
+        self.request_update()
 
     def update_grid_alpha(self, alpha):
         self.grid_alpha_value = (alpha*0.01)
+        self.request_update()
 
     def background_color(self, color):
         self.bg_color = color
+        self.request_update()
 
     def update_fov(self, num):
         self.fov = num
-        self.camera_zoom = self.camera_distance(num)
-        self.update()
-
-    @staticmethod
-    def camera_distance(num):
-        return 1 / (math.tan(math.radians(num / 2)))
+        self.camera_zoom = camera_distance(num)
+        self.request_update()
 
     def update_grid_cell(self, cells):
         self.cell = cells
@@ -170,8 +983,9 @@ class QGLControllerWidget(QtOpenGL.QGLWidget):
         self.update_grid()
 
     def update_grid(self):
-        self.vbo = self.ctx.buffer(self.grid.astype('f4'))
-        self.vao2 = self.ctx.simple_vertex_array(self.prog, self.vbo, 'in_position')
+        self.vbo = self.resources.buffer("grid", self.grid.astype('f4'))
+        self.vao2 = self.resources.vertex_array("grid", self.prog, [(self.vbo, '3f', 'in_position')])
+        self.request_update()
 
     def resizeGL(self, width, height):
         width = max(2, width)
@@ -182,12 +996,25 @@ class QGLControllerWidget(QtOpenGL.QGLWidget):
 
     def make_wireframe(self):
         self.is_wireframe = True
+        self.is_overlay = False
+        self.request_update()
 
     def make_solid(self):
         self.is_wireframe = False
+        self.is_overlay = False
+        self.request_update()
+
+    def make_overlay(self):
+        self.is_wireframe = False
+        self.is_overlay = True
+        self.request_update()
 
     # Input handling
     def mousePressEvent(self, event):
+        if event.buttons() & QtCore.Qt.LeftButton and event.modifiers() & QtCore.Qt.ControlModifier:
+            self.pick_at(event.x(), event.y())
+            return
+        self.begin_interaction()
         if event.buttons() & QtCore.Qt.LeftButton:
             self.arc_ball.onClickLeftDown(event.x(), event.y())
         elif event.buttons() & QtCore.Qt.RightButton:
@@ -195,27 +1022,29 @@ class QGLControllerWidget(QtOpenGL.QGLWidget):
             self.prev_y = event.y()
 
     def mouseReleaseEvent(self, event):
-        if event.buttons() & QtCore.Qt.LeftButton:
+        if event.button() == QtCore.Qt.LeftButton:
             self.arc_ball.onClickLeftUp()
-
-    def mouseMoveEvent(self, event):
-        if event.buttons() & QtCore.Qt.LeftButton:
-            self.arc_ball.onDrag(event.x(), event.y())
+        if not event.buttons():
+            self.interaction_timer.start()
 
     def update_zoom(self, event):
+        self.begin_interaction()
+        self.interaction_timer.start()
         self.camera_zoom += event.angleDelta().y() * 0.001
         if self.camera_zoom < 0.1:
             self.camera_zoom = 0.1
-        self.update()
+        self.request_update()
 
     def mouseMoveEvent(self, event):
         if event.buttons() & QtCore.Qt.LeftButton:
+            # Only the latest cursor position is kept, paintGL rotates once per frame
             self.arc_ball.onDrag(event.x(), event.y())
+            self.request_update()
         elif event.buttons() & QtCore.Qt.RightButton:
             x_movement = event.x() - self.prev_x
             y_movement = event.y() - self.prev_y
             self.center[0] -= x_movement * 0.01
             self.center[1] += y_movement * 0.01
-            self.update()
+            self.request_update()
             self.prev_x = event.x()
             self.prev_y = event.y()
@@ -1,8 +1,11 @@
+import os
+import sys
+
 from PyQt5.QtWidgets import QColorDialog, QMessageBox
-from PyQt5 import QtWidgets
-from OpenGL.GLUT import *
-import openmesh
-import re
+from PyQt5 import QtCore, QtWidgets
+
+current_loader = None
+scene_loaders = []
 
 
 def open_file_ask(opengl_obj, obj_path, obj_name, uv_label, material_label, drawcalls_label, vertices_label, triangles_label, edges_label):
@@ -14,17 +17,152 @@ def open_file_ask(opengl_obj, obj_path, obj_name, uv_label, material_label, draw
 
 
 def open_file(file_name, opengl_obj, obj_path, obj_name, uv_label, material_label, drawcalls_label, vertices_label, triangles_label, edges_label):
-    mesh = openmesh.read_trimesh(file_name)
-    opengl_obj.set_mesh(mesh)
-    set_name(file_name, obj_path, obj_name)
-    set_file_info(mesh, vertices_label, triangles_label, edges_label)
+    global current_loader
+    # The loading pipeline is imported on the first open, not at startup
+    from loader import MeshLoader
+    cancel_loading()
+
+    # Parse in the background, upload on the GUI thread once the arrays are ready
+    def loaded(mesh):
+        # Queued before this load was superseded by a newer one
+        if generation != opengl_obj.stream_generation:
+            return
+        opengl_obj.set_mesh(mesh)
+        set_name(file_name, obj_path, obj_name)
+        set_file_info(mesh, vertices_label, triangles_label, edges_label)
+        if mesh.obj_info is not None:
+            set_obj_info(mesh.obj_info, uv_label, material_label)
+
+    loader = MeshLoader(file_name, opengl_obj, opengl_obj.compact_vertices, optimize=opengl_obj.index_optimization)
+    loader.progress.connect(lambda percent, message: obj_path.setText(
+        f"Loading {os.path.basename(file_name)}: {message} ({percent}%)"))
+    generation = opengl_obj.begin_stream()
+    loader.partial.connect(lambda points, indices: opengl_obj.append_stream(points, indices, generation))
+    loader.loaded.connect(loaded)
+    loader.failed.connect(lambda error: obj_path.setText(f"Failed to load {file_name}: {error}"))
+    loader.failed.connect(lambda error: opengl_obj.discard_stream(generation))
+    loader.cancelled.connect(lambda: obj_path.setText(""))
+    loader.cancelled.connect(lambda: opengl_obj.discard_stream(generation))
+    loader.finished.connect(lambda: loader_finished(loader))
+    current_loader = loader
+    loader.start()
+
+
+def add_to_scene_ask(opengl_obj, obj_path):
+    file_name = QtWidgets.QFileDialog.getOpenFileName(
+        None, 'Add to scene', '', "Mesh files (*.obj *.stl *.ply *.off *.om)")
+    if not file_name[0]:
+        return
+    add_to_scene(file_name[0], opengl_obj, obj_path)
+
+
+def add_to_scene(file_name, opengl_obj, obj_path):
+    # A file that is already open is placed again without loading, as another instance
+    mesh = opengl_obj.scene.find_mesh(file_name)
+    if mesh is None and opengl_obj.mesh is not None and \
+            os.path.abspath(opengl_obj.mesh.file_name) == os.path.abspath(file_name):
+        mesh = opengl_obj.mesh
+    if mesh is not None:
+        opengl_obj.add_model(mesh)
+        return
+    from loader import MeshLoader
+
+    # Loaded alongside the opened mesh, never shown progressively
+    def loaded(mesh):
+        # Queued before the load was cancelled by closing the file
+        if loader.cancel_event.is_set():
+            return
+        opengl_obj.add_model(mesh)
+        obj_path.setText(f"Added {os.path.basename(file_name)} to the scene")
+
+    loader = MeshLoader(file_name, opengl_obj, stream=False, optimize=opengl_obj.index_optimization)
+    loader.progress.connect(lambda percent, message: obj_path.setText(
+        f"Adding {os.path.basename(file_name)}: {message} ({percent}%)"))
+    loader.loaded.connect(loaded)
+    loader.failed.connect(lambda error: obj_path.setText(f"Failed to load {file_name}: {error}"))
+    loader.cancelled.connect(lambda: obj_path.setText(""))
+    loader.finished.connect(lambda: scene_loader_finished(loader))
+    scene_loaders.append(loader)
+    loader.start()
+
+
+def scene_loader_finished(loader):
+    scene_loaders.remove(loader)
+    loader.deleteLater()
+
+
+def set_scene_list(scene, scene_list):
+    # One checkable row per model, the check mark is its visibility
+    row = scene_list.currentRow()
+    scene_list.blockSignals(True)
+    scene_list.clear()
+    for model in scene.models:
+        item = QtWidgets.QListWidgetItem(model.name)
+        item.setFlags(item.flags() | QtCore.Qt.ItemIsUserCheckable)
+        item.setCheckState(QtCore.Qt.Checked if model.visible else QtCore.Qt.Unchecked)
+        scene_list.addItem(item)
+    scene_list.blockSignals(False)
+    scene_list.setCurrentRow(min(max(row, 0), scene_list.count() - 1) if scene_list.count() else -1)
+
+
+def show_model(row, openGL, color_button, x_box, y_box, z_box):
+    if row < 0 or row >= len(openGL.scene.models):
+        return
+    model = openGL.scene.models[row]
+    for box, value in zip((x_box, y_box, z_box), model.offset):
+        box.blockSignals(True)
+        box.setValue(value)
+        box.blockSignals(False)
+    r, g, b = (int(value * 255) for value in model.color)
+    set_button_color(color_button, f"rgb({r}, {g}, {b})")
+
+
+def set_model_visible(item, scene_list, openGL):
+    openGL.set_model_visible(scene_list.row(item), item.checkState() == QtCore.Qt.Checked)
+
+
+def set_model_offset(scene_list, openGL, x_box, y_box, z_box):
+    row = scene_list.currentRow()
+    if row >= 0:
+        openGL.set_model_offset(row, (x_box.value(), y_box.value(), z_box.value()))
+
+
+def get_model_color(scene_list, color_button, openGL):
+    row = scene_list.currentRow()
+    if row < 0:
+        return
+    color = QColorDialog().getColor()
+    if color.isValid():
+        r, g, b, a = color.getRgb()
+        set_button_color(color_button, f"rgb({r}, {g}, {b})")
+        openGL.set_model_color(row, (r / 255, g / 255, b / 255))
 
-    _, file_extension = os.path.splitext(file_name)
-    file_format = file_extension.replace(".", "")
-    if file_format == "obj":
-        has_uv(file_name, uv_label)
-        materials(file_name, material_label)
-        draw_calls(file_name, drawcalls_label)
+
+def remove_model(scene_list, openGL):
+    row = scene_list.currentRow()
+    if row >= 0:
+        openGL.remove_model(row)
+
+
+def set_scene_memory(stats, scene_memory_label):
+    resident, budget = stats["scene_memory"]
+    scene_memory_label.setText(f"{resident / 2 ** 20:.0f} / {budget / 2 ** 20:.0f} MB")
+
+
+def loader_finished(loader):
+    global current_loader
+    if current_loader is loader:
+        current_loader = None
+    loader.deleteLater()
+
+
+def cancel_loading(scene=False):
+    # The opened file's load; with scene, also the models still being added to the scene
+    if current_loader is not None:
+        current_loader.cancel()
+    if scene:
+        for loader in scene_loaders:
+            loader.cancel()
 
 
 def set_name(file_name, obj_path, obj_name):
@@ -35,38 +173,50 @@ def set_name(file_name, obj_path, obj_name):
 
 
 def set_file_info(mesh, vertices_label, triangles_label, edges_label):
-    vertex_count = mesh.n_vertices()
-    triangle_count = mesh.n_faces()
-    edges_count = mesh.n_edges()
+    vertex_count = mesh.n_vertices
+    triangle_count = mesh.n_faces
+    edges_count = mesh.n_edges
     vertices_label.setText(str(vertex_count))
     triangles_label.setText(str(triangle_count))
     edges_label.setText(str(edges_count))
 
 
-def has_uv(file_path, has_label):
-    with open(file_path, "r") as file:
-        contents = file.read()
-        if "vt" in contents:
-            has_label.setText(str("Yes"))
-        else:
-            has_label.setText(str("No"))
+def set_mesh_stats(mesh, surface_area_label, boundary_edges_label, non_manifold_edges_label, degenerate_faces_label):
+    stats = mesh.stats
+    surface_area_label.setText(f"{stats.get('surface_area', 0):.6g}")
+    boundary_edges_label.setText(str(stats.get("boundary_edges", 0)))
+    non_manifold_edges_label.setText(str(stats.get("non_manifold_edges", 0)))
+    degenerate_faces_label.setText(str(stats.get("degenerate_faces", 0)))
 
 
-def materials(file_path, material_label):
-    with open(file_path, "r") as file:
-        contents = file.read()
-        num = set(re.findall(r'usemtl (\S+)', contents))
-        material_label.setText(str(len(num)))
+def set_pick_info(hit, pick_label):
+    # None while the BVH is still building, empty when the click missed the mesh
+    if hit is None:
+        pick_label.setText("Picking is available once the BVH is built")
+        return
+    if not hit:
+        pick_label.setText("No surface under the cursor")
+        return
+    x, y, z = hit["point"]
+    nx, ny, nz = hit["normal"]
+    text = f"Face {hit['face']}  ({x:.4g}, {y:.4g}, {z:.4g})  normal ({nx:.3f}, {ny:.3f}, {nz:.3f})"
+    if "distance" in hit:
+        text += f"  distance {hit['distance']:.6g}"
+    pick_label.setText(text + f"  [{hit['seconds'] * 1000:.1f} ms]")
 
 
-def draw_calls(file_path, drawcalls_label):
-    with open(file_path, "r") as file:
-        contents = file.read()
-        draw = tuple(re.findall(r'usemtl (\S+)', contents))
-        if len(draw) > 1:
-            drawcalls_label.setText(str(len(draw)))
-        else:
-            drawcalls_label.setText(str(1))
+def set_obj_info(obj_info, uv_label, material_label):
+    uv_label.setText("Yes" if obj_info.has_uv else "No")
+    material_label.setText(str(len(obj_info.materials)))
+
+
+def set_draw_calls(draw_calls, drawcalls_label):
+    drawcalls_label.setText(str(draw_calls))
+
+
+def set_lod_info(level, triangles, lod_label, lod_triangles_label):
+    lod_label.setText(str(level))
+    lod_triangles_label.setText(str(triangles))
 
 
 def get_color(button, button_color, btn_name, openGL):
@@ -79,7 +229,7 @@ def get_color(button, button_color, btn_name, openGL):
         if btn_name == "background":
             openGL.background_color((r / 255, g / 255, b / 255))
         if btn_name == "wire":
-            openGL.change_light_color((r/255, g/255, b/255))
+            openGL.change_wire_color((r/255, g/255, b/255))
 
 
 def set_button_color(button, color):
@@ -117,7 +267,32 @@ def update_grid_size(text, openGL, btn_name):
         openGL.update_grid_size(value)
 
 
+def set_performance_info(stats, fps_label, cpu_time_label, gpu_time_label, gpu_memory_label, load_time_label,
+                         chunks_label):
+    fps_label.setText(str(stats["fps"]))
+    for name, label in (("cpu", cpu_time_label), ("gpu", gpu_time_label)):
+        if name in stats:
+            label.setText(f"{stats[name]['p50']:.2f} / {stats[name]['p95']:.2f}")
+    gpu_memory_label.setText(f"{stats['gpu_memory'] / 2 ** 20:.1f} MB")
+    if stats["load_time"] is not None:
+        load_time_label.setText(f"{stats['load_time']:.2f} s")
+    if stats["chunks"] is None:
+        chunks_label.setText("-")
+    else:
+        chunks_label.setText("%d / %d" % stats["chunks"])
+
+
+def export_trace(openGL):
+    file_name = QtWidgets.QFileDialog.getSaveFileName(
+        None, 'Export trace', 'trace.json', "Chrome trace (*.json)")
+    if not file_name[0]:
+        return
+    openGL.profiler.export(file_name[0])
+
+
 def close_file(openGL, obj_path, obj_name):
+    cancel_loading(scene=True)
+    openGL.clear_scene()
     openGL.set_mesh(None)
     obj_path.setText("")
     obj_name.setText("")
@@ -0,0 +1,85 @@
+import numpy
+
+
+def triangle_normals(points, indices):
+    # Unnormalized, the length is twice the triangle area
+    faces = indices.reshape(-1, 3)
+    v0 = points[faces[:, 0]]
+    return numpy.cross(points[faces[:, 1]] - v0, points[faces[:, 2]] - v0)
+
+
+def vertex_normals(points, indices, face_normals=None):
+    # Area weighted: the unnormalized face normal is twice the triangle area
+    if face_normals is None:
+        face_normals = triangle_normals(points, indices)
+
+    n = len(points)
+    flat = indices.reshape(-1)
+    normals = numpy.empty((n, 3), dtype="f4")
+    for axis in range(3):
+        weights = numpy.repeat(face_normals[:, axis], 3)
+        normals[:, axis] = numpy.bincount(flat, weights=weights, minlength=n)
+    length = numpy.linalg.norm(normals, axis=1)
+    length[length == 0] = 1.0
+    normals /= length[:, None]
+    return normals
+
+
+def edge_keys(indices):
+    # One sorted 64-bit key per face corner: (min vertex << 32) | max vertex,
+    # faces with a repeated vertex left out
+    faces = indices.reshape(-1, 3)
+    valid = (faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 2] != faces[:, 0])
+    faces = (faces if valid.all() else faces[valid]).astype("u8")
+    a = faces.reshape(-1)
+    b = faces[:, [1, 2, 0]].reshape(-1)
+    keys = (numpy.minimum(a, b) << numpy.uint64(32)) | numpy.maximum(a, b)
+    keys.sort()
+    return keys
+
+
+def edge_count(indices):
+    # Unique undirected edges via sorted 64-bit edge keys
+    keys = edge_keys(indices)
+    if len(keys) == 0:
+        return 0
+    return int(numpy.count_nonzero(keys[1:] != keys[:-1]) + 1)
+
+
+def mesh_statistics(points, indices, box=None, face_normals=None):
+    # Edge and face statistics from one sort of the edge keys and the face normals
+    if box is None:
+        box = bounding_box(points)
+    if face_normals is None:
+        face_normals = triangle_normals(points, indices)
+    stats = {"edges": 0, "boundary_edges": 0, "non_manifold_edges": 0}
+    keys = edge_keys(indices)
+    if len(keys):
+        # Faces sharing each edge: 1 is a boundary, more than 2 is non-manifold
+        starts = numpy.flatnonzero(numpy.concatenate(([True], keys[1:] != keys[:-1])))
+        faces_per_edge = numpy.diff(numpy.append(starts, len(keys)))
+        stats["edges"] = len(starts)
+        stats["boundary_edges"] = int(numpy.count_nonzero(faces_per_edge == 1))
+        stats["non_manifold_edges"] = int(numpy.count_nonzero(faces_per_edge > 2))
+    del keys
+
+    bounding_box_min, bounding_box_max = (numpy.asarray(corner, dtype="f8") for corner in box)
+    diagonal = numpy.linalg.norm(bounding_box_max - bounding_box_min)
+    doubled_area = numpy.sqrt(numpy.einsum("ij,ij->i", face_normals, face_normals))
+    faces = indices.reshape(-1, 3)
+    repeated = (faces[:, 0] == faces[:, 1]) | (faces[:, 1] == faces[:, 2]) | (faces[:, 2] == faces[:, 0])
+    stats["degenerate_faces"] = int(numpy.count_nonzero(repeated | (doubled_area <= 1e-12 * diagonal * diagonal)))
+    stats["surface_area"] = float(doubled_area.sum(dtype="f8") / 2)
+
+    # Sphere around the box center, the same center init_arcball uses
+    center = (bounding_box_min + bounding_box_max) / 2
+    radius = numpy.sqrt(((points - center.astype("f4")) ** 2).sum(axis=1).max()) if len(points) else 0.0
+    stats["bounding_sphere"] = [float(value) for value in center] + [float(radius)]
+    return stats
+
+
+def bounding_box(points):
+    # Column by column, several times quicker than reducing an (n, 3) array over axis 0
+    points = numpy.asarray(points)
+    return (numpy.array([points[:, axis].min() for axis in range(3)], dtype=points.dtype),
+            numpy.array([points[:, axis].max() for axis in range(3)], dtype=points.dtype))
@@ -0,0 +1,192 @@
+# Offscreen batch renderer: turntable PNGs for every mesh in a directory or glob.
+# Uses a standalone moderngl context (EGL, Mesa llvmpipe without a GPU) and never imports Qt.
+#
+#   python headless.py "assets/**/*.stl" --out previews --angles 8 --workers 8
+import argparse
+import concurrent.futures
+import glob
+import math
+import os
+import struct
+import sys
+import time
+import zlib
+
+import numpy
+
+from camera import view_projection, model_transform, turntable_rotation, camera_distance
+from resource import shaders
+from resources import GpuResources
+
+EXTENSIONS = (".obj", ".stl", ".ply", ".off", ".om")
+
+_renderer = None
+
+
+def find_meshes(pattern):
+    if os.path.isdir(pattern):
+        found = []
+        for root, _, files in os.walk(pattern):
+            found.extend(os.path.join(root, name) for name in files if os.path.splitext(name)[1].lower() in EXTENSIONS)
+        return sorted(found)
+    return sorted(name for name in glob.glob(pattern, recursive=True) if os.path.splitext(name)[1].lower() in EXTENSIONS)
+
+
+def write_png(file_name, width, height, rgba):
+    # Minimal RGBA PNG encoder, rows are flipped from GL's bottom-up order
+    rows = numpy.frombuffer(rgba, 'u1').reshape(height, width * 4)[::-1]
+    raw = numpy.hstack([numpy.zeros((height, 1), 'u1'), rows]).tobytes()
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+    with open(file_name, "wb") as file:
+        file.write(b"\x89PNG\r\n\x1a\n")
+        file.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)))
+        file.write(chunk(b"IDAT", zlib.compress(raw, 6)))
+        file.write(chunk(b"IEND", b""))
+
+
+class Renderer:
+    def __init__(self, width, height, backend=None, fov=60.0, background=(0.1, 0.1, 0.1, 1.0)):
+        import moderngl
+        self.moderngl = moderngl
+        kwargs = {"backend": backend} if backend else {}
+        self.ctx = moderngl.create_standalone_context(**kwargs)
+        self.prog = self.ctx.program(
+            vertex_shader=shaders.vertex_shader,
+            fragment_shader=shaders.fragment_shader
+        )
+        self.prog["Light"].value = (1.0, 1.0, 1.0)
+        self.prog["Color"].value = (1.0, 1.0, 1.0, 1.0)
+        self.size = (width, height)
+        self.fov = fov
+        self.background = background
+        self.fbo = self.ctx.simple_framebuffer(self.size)
+        self.resources = GpuResources(self.ctx)
+
+    def render(self, mesh, angles):
+        # Yields one RGBA frame per turntable angle
+        ctx = self.ctx
+        if mesh.point_cloud:
+            vao = self.point_array(mesh)
+        else:
+            index_buffer = self.resources.buffer("mesh_indices", mesh.indices)
+            vertex_buffer = self.resources.interleaved_buffer("mesh_vertices", (mesh.points, mesh.normals))
+            vao = self.resources.vertex_array("mesh", self.prog, [(vertex_buffer, '3f 3f', 'in_position', 'in_normal')],
+                                              index_buffer, 4)
+
+        bounding_box_min, bounding_box_max = mesh.bounding_box
+        center = 0.5 * (bounding_box_max + bounding_box_min)
+        scale = numpy.linalg.norm(bounding_box_max - center) or 1.0
+        view = view_projection(self.fov, self.size[0] / self.size[1], camera_distance(self.fov))
+
+        self.fbo.use()
+        try:
+            for step in range(angles):
+                transform = model_transform(turntable_rotation(2.0 * math.pi * step / angles), center, scale)
+                mvp = numpy.array(view * transform, dtype='f4')
+                self.prog["Mvp"].write(mvp)
+                self.fbo.clear(*self.background)
+                ctx.enable(self.moderngl.BLEND)
+                ctx.enable(self.moderngl.DEPTH_TEST | self.moderngl.CULL_FACE)
+                if mesh.point_cloud:
+                    # Same screen-space sizing as the viewer at full detail
+                    self.prog["PointScale"].value = 0.5 * self.size[1] * numpy.linalg.norm(mvp[:3, 1])
+                    vao.render(self.moderngl.POINTS, vertices=mesh.n_vertices)
+                else:
+                    vao.render()
+                yield self.fbo.read(components=4)
+        finally:
+            self.prog["Points"].value = False
+            self.prog["PointColors"].value = False
+            ctx.disable(self.moderngl.PROGRAM_POINT_SIZE)
+            self.resources.release("mesh")
+
+    def point_array(self, mesh):
+        arrays = (mesh.points,) if mesh.normals is None else (mesh.points, mesh.normals)
+        vertex_buffer = self.resources.interleaved_buffer("mesh_vertices", arrays)
+        content = [(vertex_buffer, '3f', 'in_position') if mesh.normals is None else
+                   (vertex_buffer, '3f 3f', 'in_position', 'in_normal')]
+        if mesh.colors is not None:
+            content.append((self.resources.buffer("mesh_colors", mesh.colors), '4f1', 'in_color'))
+        self.ctx.enable(self.moderngl.PROGRAM_POINT_SIZE)
+        self.prog["Points"].value = True
+        self.prog["PointColors"].value = mesh.colors is not None
+        # The viewer's default disc size, 1.5 point spacings
+        self.prog["PointSize"].value = 1.5 * mesh.point_spacing
+        return self.resources.vertex_array("mesh", self.prog, content)
+
+
+def render_file(file_name, out_dir, angles, width, height, backend, use_cache):
+    # Runs in a pool worker, each worker keeps its own context
+    global _renderer
+    import cache
+    from pipeline import load_mesh
+
+    start = time.perf_counter()
+    mesh = cache.load(file_name) if use_cache else None
+    if mesh is None:
+        mesh = load_mesh(file_name)
+        if use_cache:
+            try:
+                cache.store(mesh)
+            except OSError:
+                pass
+    load_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if _renderer is None:
+        _renderer = Renderer(width, height, backend)
+    stem = os.path.basename(file_name).replace(".", "_")
+    outputs = []
+    for step, frame in enumerate(_renderer.render(mesh, angles)):
+        output = os.path.join(out_dir, f"{stem}_{step:03d}.png")
+        write_png(output, width, height, frame)
+        outputs.append(output)
+    render_time = time.perf_counter() - start
+    return file_name, mesh.n_faces or mesh.n_vertices, load_time, render_time, outputs
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='3D Viewer headless renderer')
+    parser.add_argument('input', type=str, help='Directory or glob of meshes')
+    parser.add_argument('--out', type=str, default='renders', help='Output directory')
+    parser.add_argument('--angles', type=int, default=8, help='Turntable angles per mesh')
+    parser.add_argument('--size', type=str, default='512x512', help='Image size as WIDTHxHEIGHT')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Worker processes')
+    parser.add_argument('--backend', type=str, default='egl' if sys.platform.startswith('linux') else None,
+                        help='moderngl standalone backend')
+    parser.add_argument('--no-cache', action='store_true', help='Do not read or write the mesh cache')
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    width, height = (int(value) for value in args.size.lower().split('x'))
+    files = find_meshes(args.input)
+    if not files:
+        print('No meshes found: "%s"' % args.input)
+        return 1
+    os.makedirs(args.out, exist_ok=True)
+
+    failed = 0
+    start = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers) as pool:
+        jobs = {pool.submit(render_file, file_name, args.out, args.angles, width, height,
+                            args.backend, not args.no_cache): file_name for file_name in files}
+        for job in concurrent.futures.as_completed(jobs):
+            try:
+                file_name, faces, load_time, render_time, outputs = job.result()
+            except Exception as error:
+                failed += 1
+                print(f"failed  {jobs[job]}: {error}")
+                continue
+            print(f"{file_name}: {faces} primitives, load {load_time:.3f}s, "
+                  f"render {render_time:.3f}s ({render_time / max(1, len(outputs)):.3f}s/frame)")
+    print(f"{len(files) - failed}/{len(files)} meshes in {time.perf_counter() - start:.1f}s")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
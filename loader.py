@@ -0,0 +1,125 @@
+import multiprocessing
+import os
+import queue
+import time
+
+from PyQt5 import QtCore
+from pipeline import LoadCancelled, load_mesh
+import cache
+
+# Files at least this large are shown progressively while they load
+STREAM_MIN_BYTES = 32 * 2 ** 20
+
+
+def _load_process(file_name, messages, cancel_event, compact, stream, optimize):
+    # Runs in a child process so parsing never holds the GUI thread's GIL
+    try:
+        partial = None
+        if stream:
+            partial = lambda points, indices: messages.put(("partial", points, indices))
+        data = load_mesh(file_name,
+                         lambda percent, message: messages.put(("progress", percent, message)),
+                         cancel_event.is_set, compact, partial, optimize)
+        try:
+            path = cache.store(data)
+        except OSError:
+            path = None
+        if path is None or not os.path.exists(path):
+            # Without a cache entry (too big for the limit, or not writable)
+            # the arrays are pickled through the queue
+            messages.put(("done", data))
+        else:
+            # The parent memory-maps the entry instead of receiving a pickled copy
+            messages.put(("cached", data.timings))
+    except LoadCancelled:
+        messages.put(("cancelled",))
+    except Exception as error:
+        messages.put(("error", str(error)))
+
+
+class MeshLoader(QtCore.QThread):
+    progress = QtCore.pyqtSignal(int, str)
+    partial = QtCore.pyqtSignal(object, object)
+    loaded = QtCore.pyqtSignal(object)
+    failed = QtCore.pyqtSignal(str)
+    cancelled = QtCore.pyqtSignal()
+
+    def __init__(self, file_name, parent=None, compact=False, stream=True, optimize=None):
+        super(MeshLoader, self).__init__(parent)
+        self.file_name = file_name
+        self.compact = compact
+        self.optimize = optimize
+        self.stream = stream
+        self.cancel_event = multiprocessing.Event()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def run(self):
+        # A cache hit is memory-mapped here, no worker process needed
+        start = time.perf_counter()
+        try:
+            data = cache.load(self.file_name)
+        except (OSError, ValueError, KeyError):
+            data = None
+        if data is not None and not cache.serves(data, self.compact, self.optimize):
+            # Entry without the quantized vertices or the triangle order asked for, rebuild it
+            data = None
+        if data is not None:
+            data.timings = [("Cache mapping", time.perf_counter() - start)]
+            self.loaded.emit(data)
+            return
+
+        messages = multiprocessing.Queue()
+        stream = self.stream and os.path.exists(self.file_name) and os.path.getsize(self.file_name) >= STREAM_MIN_BYTES
+        process = multiprocessing.Process(target=_load_process,
+                                          args=(self.file_name, messages, self.cancel_event, self.compact, stream,
+                                                self.optimize),
+                                          daemon=True)
+        process.start()
+        result = None
+        cancel_deadline = None
+        while result is None:
+            try:
+                message = messages.get(timeout=0.1)
+            except queue.Empty:
+                message = None
+                if self.cancel_event.is_set():
+                    # Give the worker a moment to stop at a checkpoint, then kill it
+                    if cancel_deadline is None:
+                        cancel_deadline = QtCore.QDeadlineTimer(500)
+                    elif cancel_deadline.hasExpired() or not process.is_alive():
+                        process.terminate()
+                        result = ("cancelled",)
+                elif not process.is_alive():
+                    try:
+                        message = messages.get(timeout=0.5)
+                    except queue.Empty:
+                        result = ("error", "Loader process exited unexpectedly")
+            if message is None:
+                continue
+            if message[0] == "progress":
+                self.progress.emit(message[1], message[2])
+            elif message[0] == "partial":
+                if not self.cancel_event.is_set():
+                    self.partial.emit(message[1], message[2])
+            else:
+                result = message
+        process.join()
+
+        if result[0] == "cached" and not self.cancel_event.is_set():
+            try:
+                data = cache.load(self.file_name)
+            except (OSError, ValueError, KeyError):
+                data = None
+            if data is None:
+                self.failed.emit("Cache entry disappeared before it could be mapped")
+                return
+            data.timings = result[1]
+            self.loaded.emit(data)
+        elif result[0] == "done" and not self.cancel_event.is_set():
+            self.loaded.emit(result[1])
+        elif result[0] == "error":
+            self.failed.emit(result[1])
+        else:
+            self.cancelled.emit()
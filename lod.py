@@ -0,0 +1,76 @@
+import numpy
+
+from materials import material_ranges
+
+# Meshes below this many triangles are drawn at full detail only
+LOD_MIN_TRIANGLES = 200000
+# Each level keeps roughly this fraction of the previous level's triangles
+LOD_RATIO = 0.25
+LOD_MAX_LEVELS = 4
+
+
+def cluster_indices(points, indices, resolution, bounding_box):
+    # Vertex clustering: snap vertices to a grid and keep, per cell, the vertex
+    # closest to the cell mean, so every level indexes the full-detail vertex buffer
+    bounding_box_min, bounding_box_max = bounding_box
+    extent = numpy.maximum(bounding_box_max - bounding_box_min, 1e-12)
+    cells = numpy.minimum(((points - bounding_box_min) / extent * resolution).astype("i8"), resolution - 1)
+    keys = (cells[:, 0] * resolution + cells[:, 1]) * resolution + cells[:, 2]
+    _, cluster = numpy.unique(keys, return_inverse=True)
+    cluster = cluster.reshape(-1)
+
+    n = cluster.max() + 1
+    counts = numpy.bincount(cluster, minlength=n)
+    mean = numpy.stack([numpy.bincount(cluster, weights=points[:, axis], minlength=n) for axis in range(3)], axis=1)
+    mean /= counts[:, None]
+    distance = numpy.einsum("ij,ij->i", points - mean[cluster], points - mean[cluster])
+    order = numpy.lexsort((distance, cluster))
+    first = numpy.ones(len(order), dtype=bool)
+    first[1:] = cluster[order][1:] != cluster[order][:-1]
+    representative = numpy.empty(n, dtype="u4")
+    representative[cluster[order][first]] = order[first]
+
+    # Remap triangles, drop the ones that collapsed and the duplicates left over
+    # Kept triangles stay in input order, so material runs stay contiguous
+    faces = representative[cluster[indices.reshape(-1, 3)]]
+    keep = (faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 2] != faces[:, 0])
+    kept = numpy.flatnonzero(keep)
+    faces = faces[keep]
+    if len(faces):
+        rolled = numpy.where(faces[:, :1] == faces.min(axis=1, keepdims=True), faces,
+                             numpy.where(faces[:, 1:2] == faces.min(axis=1, keepdims=True),
+                                         faces[:, [1, 2, 0]], faces[:, [2, 0, 1]]))
+        _, unique = numpy.unique(rolled, axis=0, return_index=True)
+        unique.sort()
+        faces = faces[unique]
+        kept = kept[unique]
+    return numpy.ascontiguousarray(faces, dtype="u4").reshape(-1), kept
+
+
+def build_lods(points, indices, bounding_box, progress=None, triangle_materials=None):
+    # Returns coarser index buffers, finest first, level 0 (the input) excluded,
+    # and their material draw ranges when the triangles carry materials
+    levels = []
+    ranges = []
+    triangles = len(indices) // 3
+    if triangles < LOD_MIN_TRIANGLES:
+        return levels, ranges
+    # A closed surface in a grid of r^3 cells keeps roughly 2 * 6 * r^2 triangles
+    resolution = int(numpy.sqrt(triangles * LOD_RATIO / 12))
+    while len(levels) < LOD_MAX_LEVELS and resolution >= 8:
+        level, kept = cluster_indices(points, indices, resolution, bounding_box)
+        if len(level) == 0:
+            break
+        if len(level) // 3 > triangles * 0.5:
+            # Not coarse enough for this shape, try a coarser grid
+            resolution = int(resolution * 0.7)
+            continue
+        levels.append(level)
+        ranges.append(None if triangle_materials is None else material_ranges(triangle_materials[kept]))
+        triangles = len(level) // 3
+        if progress is not None:
+            progress(len(levels) / LOD_MAX_LEVELS)
+        if triangles < LOD_MIN_TRIANGLES // 4:
+            break
+        resolution = int(resolution * numpy.sqrt(LOD_RATIO))
+    return levels, ranges
@@ -1,24 +1,48 @@
-from PyQt5 import QtWidgets, QtCore, uic
+import time
+STARTED = time.perf_counter()
+
+import argparse
+import importlib
+import os
+import sys
+
+from PyQt5 import QtWidgets, QtCore, QtGui
 from PyQt5.QtGui import QIcon
-from OpenGL.GLUT import *
-from engine import QGLControllerWidget
 import functions as f
-import argparse
 
+IMPORTED = time.perf_counter()
+
+
+def compiled_ui(ui_file):
+    # pyuic output is cached next to the .ui and rebuilt when the .ui changes,
+    # so a normal launch neither imports uic nor parses the XML
+    module_name = "ui_" + os.path.splitext(os.path.basename(ui_file))[0]
+    py_file = os.path.join(os.path.dirname(ui_file), module_name + ".py")
+    try:
+        if not os.path.exists(py_file) or os.path.getmtime(py_file) < os.path.getmtime(ui_file):
+            from PyQt5 import uic
+            with open(py_file + ".tmp", "w", encoding="utf-8") as file:
+                uic.compileUi(ui_file, file)
+            os.replace(py_file + ".tmp", py_file)
+        return importlib.import_module("resource." + module_name).Ui_MainWindow
+    except (OSError, ImportError):
+        # Read-only install, parse the .ui on every launch
+        from PyQt5 import uic
+        return uic.loadUiType(ui_file)[0]
+
+
+Ui_MainWindow = compiled_ui("%s/resource/3DView02.ui" % os.path.dirname(os.path.abspath(__file__)))
+UI_COMPILED = time.perf_counter()
 
-class MainWindow(QtWidgets.QMainWindow):
+
+class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
     def __init__(self):
-        # Load UI file
+        # Build the UI from the compiled .ui
         QtWidgets.QMainWindow.__init__(self)
-        uic.loadUi("%s/resource/3DView02.ui" % os.path.dirname(__file__), self)
+        self.setupUi(self)
 
-        # Create openGL context
-        self.openGL = QGLControllerWidget(self)
-        self.openGL.setGeometry(0, 37, 870, 731)
-        timer = QtCore.QTimer(self)
-        timer.setInterval(20)  # refresh speed in milliseconds
-        timer.timeout.connect(self.openGL.updateGL)
-        timer.start()
+        # The GL widget is created once the window is on screen, see create_gl
+        self.openGL = None
 
         # Load button
         load_icon = QIcon("%s/resource/load.png" % os.path.dirname(__file__))
@@ -26,16 +50,30 @@ class MainWindow(QtWidgets.QMainWindow):
 
         self.load_button.clicked.connect(self.load_file)
         self.actionLoad.triggered.connect(self.load_file)
+        self.actionAddToScene.triggered.connect(lambda: f.add_to_scene_ask(self.openGL, self.obj_path_label))
 
         # Menubar Buttons
         self.actionQuit.triggered.connect(lambda: f.exit_app())
         self.actionClose.triggered.connect(lambda: f.close_file(self.openGL, self.obj_path_label, self.obj_name_label))
         self.actionAbout.triggered.connect(lambda: f.show_message_box())
+        self.actionExportTrace.triggered.connect(lambda: f.export_trace(self.openGL))
+
+        # Escape cancels the loads in progress, models being added to the scene included
+        cancel_shortcut = QtWidgets.QShortcut(QtGui.QKeySequence(QtCore.Qt.Key_Escape), self)
+        cancel_shortcut.activated.connect(lambda: f.cancel_loading(scene=True))
 
         # Buttons
         self.wireframe_color.clicked.connect(lambda: f.get_color(self.wireframe_color, f.set_button_color, "wire", self.openGL))
         self.background_color.clicked.connect(lambda: f.get_color(self.background_color, f.set_button_color, "background", self.openGL))
 
+        # Scene models
+        self.scene_list.currentRowChanged.connect(lambda row: f.show_model(row, self.openGL, self.scene_color, self.scene_x, self.scene_y, self.scene_z))
+        self.scene_list.itemChanged.connect(lambda item: f.set_model_visible(item, self.scene_list, self.openGL))
+        for box in (self.scene_x, self.scene_y, self.scene_z):
+            box.valueChanged.connect(lambda: f.set_model_offset(self.scene_list, self.openGL, self.scene_x, self.scene_y, self.scene_z))
+        self.scene_color.clicked.connect(lambda: f.get_model_color(self.scene_list, self.scene_color, self.openGL))
+        self.scene_remove.clicked.connect(lambda: f.remove_model(self.scene_list, self.openGL))
+
         # Settings Sliders
         self.fov_slider.valueChanged.connect(lambda: f.change_slider(self.fov_slider, self.fov_slider_value, self.openGL, "fov"))
         self.fov_slider_value.textChanged.connect(lambda: f.update_slider(self.fov_slider, self.fov_slider_value))
@@ -49,6 +87,7 @@ class MainWindow(QtWidgets.QMainWindow):
         # Settings radio buttons
         self.wireframe_radio.toggled.connect(lambda: self.openGL.make_wireframe())
         self.solid_radio.toggled.connect(lambda: self.openGL.make_solid())
+        self.overlay_radio.toggled.connect(lambda: self.openGL.make_overlay())
 
         # Grid settings
         self.grid_cell.textChanged.connect(lambda: f.update_grid_size(self.grid_cell, self.openGL, "cell"))
@@ -56,6 +95,27 @@ class MainWindow(QtWidgets.QMainWindow):
         self.grid_slider.valueChanged.connect(lambda: f.change_slider(self.grid_slider, self.grid_slider_value, self.openGL, "grid"))
         self.grid_slider_value.textChanged.connect(lambda: f.update_slider(self.grid_slider, self.grid_slider_value))
 
+    def create_gl(self):
+        # The engine brings in moderngl, QtOpenGL and the mesh modules; imported here,
+        # once the window is shown, instead of with main's own imports
+        from engine import QGLControllerWidget
+        self.openGL = QGLControllerWidget(self)
+        self.openGL.setGeometry(0, 37, 870, 731)
+        self.openGL.hide()
+        self.openGL.draw_calls_changed.connect(lambda draw_calls: f.set_draw_calls(draw_calls, self.drawcalls_label))
+        self.openGL.lod_changed.connect(lambda level, triangles: f.set_lod_info(level, triangles, self.lod_label, self.lod_triangles_label))
+        self.openGL.mesh_changed.connect(lambda mesh: f.set_mesh_stats(mesh, self.surface_area_label, self.boundary_edges_label, self.non_manifold_edges_label, self.degenerate_faces_label))
+        self.openGL.mesh_changed.connect(lambda mesh: self.pick_label.setText(""))
+        self.openGL.picked.connect(lambda hit: f.set_pick_info(hit, self.pick_label))
+        self.openGL.stats_changed.connect(lambda stats: f.set_scene_memory(stats, self.scene_memory_label))
+        self.openGL.scene_changed.connect(lambda scene: f.set_scene_list(scene, self.scene_list))
+        self.openGL.stats_changed.connect(lambda stats: f.set_performance_info(stats, self.fps_label, self.cpu_time_label, self.gpu_time_label, self.gpu_memory_label, self.load_time_label, self.chunks_label))
+
+    def show_gl(self):
+        # Creating the context, compiling shaders and building the grid happen on
+        # the GL widget's first show, after the window itself is on screen
+        QtCore.QTimer.singleShot(0, self.openGL.show)
+
     def load_file(self, scene=None):
         if isinstance(scene, str):
             f.open_file(scene, self.openGL, self.obj_path_label, self.obj_name_label, self.uv2_label, self.material_label, self.drawcalls_label, self.vertices_label, self.triangles_label, self.edges_label)
@@ -63,6 +123,18 @@ class MainWindow(QtWidgets.QMainWindow):
             f.open_file_ask(self.openGL, self.obj_path_label, self.obj_name_label, self.uv2_label, self.material_label, self.drawcalls_label, self.vertices_label, self.triangles_label, self.edges_label)
 
 
+def report_startup(profiler, phases):
+    # Phases timed here plus the GL ones the widget recorded, then quit
+    for name, start, end in phases:
+        profiler.record(name, start, end - start, "startup")
+    events = sorted((event for event in profiler.events if event["cat"] == "startup"), key=lambda event: event["ts"])
+    print(f"{'phase':24} {'start ms':>9} {'ms':>8}")
+    for event in events:
+        print(f"{event['name']:24} {(event['ts'] - profiler.timestamp(STARTED)) / 1e3:9.1f} {event['dur'] / 1e3:8.1f}")
+    print(f"{'first frame':24} {(time.perf_counter() - STARTED) * 1e3:9.1f}")
+    QtWidgets.QApplication.quit()
+
+
 def get_parser():
     parser = argparse.ArgumentParser(description='3D Viewer', add_help=False)
 
@@ -70,15 +142,72 @@ def get_parser():
 
     parser.add_argument('--scene', type=str, required=False, default=None, help='Scene to open')
 
+    parser.add_argument('--multi-draw', action='store_true', help='Submit material batches with one indirect multi-draw call')
+
+    parser.add_argument('--occlusion', action='store_true', help='Skip chunks hidden behind nearer ones with occlusion queries')
+
+    parser.add_argument('--vram-budget', type=int, default=None, help='GPU memory in MB the extra scene models may use')
+
+    parser.add_argument('--texture-budget', type=int, default=None, help='GPU memory in MB the textures may use')
+
+    parser.add_argument('--wire-width', type=float, default=None, help='Edge width in pixels of the wire overlay (default 1)')
+
+    parser.add_argument('--point-size', type=float, default=None, help='Point cloud disc size in point spacings (default 1.5)')
+
+    parser.add_argument('--optimize-indices', nargs='?', const='overdraw', choices=('cache', 'overdraw'), default=None,
+                        help='Reorder triangles and vertices at load time for the vertex cache (and overdraw, the default)')
+
+    parser.add_argument('--compact', action='store_true', help='Upload 16-bit positions and octahedral normals')
+
+    parser.add_argument('--build-cache', type=str, required=False, default=None, help='Prebuild mesh caches for a directory')
+
+    parser.add_argument('--trace', type=str, required=False, default=None, help='Write a Chrome trace of loads and frames on exit')
+
+    parser.add_argument('--profile-startup', action='store_true', help='Print a startup time breakdown after the first frame and exit')
+
     return parser
 
 
 if __name__ == '__main__':
     args = get_parser().parse_args()
 
+    if args.build_cache is not None:
+        import cache
+        cache.build_directory(args.build_cache, optimize=args.optimize_indices, compact=args.compact)
+        sys.exit(0)
+
+    phases = [("Imports", STARTED, IMPORTED), ("Compile UI", IMPORTED, UI_COMPILED)]
+    start = time.perf_counter()
     app = QtWidgets.QApplication(sys.argv)
+    phases.append(("QApplication", start, time.perf_counter()))
+    start = time.perf_counter()
     win = MainWindow()
+    phases.append(("Main window", start, time.perf_counter()))
+    start = time.perf_counter()
     win.show()
+    # Painted now, before the engine import below holds the GUI thread
+    QtCore.QCoreApplication.processEvents()
+    phases.append(("Show window", start, time.perf_counter()))
+    start = time.perf_counter()
+    win.create_gl()
+    phases.append(("Engine import", start, time.perf_counter()))
+    win.openGL.set_multi_draw(args.multi_draw)
+    win.openGL.set_compact_vertices(args.compact)
+    win.openGL.set_index_optimization(args.optimize_indices)
+    win.openGL.set_occlusion_culling(args.occlusion)
+    if args.wire_width is not None:
+        win.openGL.set_wire_width(args.wire_width)
+    if args.point_size is not None:
+        win.openGL.set_point_scale(args.point_size)
+    if args.vram_budget is not None:
+        win.openGL.set_scene_budget(args.vram_budget * 2 ** 20)
+    if args.texture_budget is not None:
+        win.openGL.set_texture_budget(args.texture_budget * 2 ** 20)
+    if args.trace is not None:
+        app.aboutToQuit.connect(lambda: win.openGL.profiler.export(args.trace))
+    if args.profile_startup:
+        win.openGL.first_frame_drawn.connect(lambda: report_startup(win.openGL.profiler, phases))
+    win.show_gl()
 
     if args.scene is not None:
         if os.path.exists(args.scene):
@@ -0,0 +1,81 @@
+import os
+import numpy
+
+# map_Kd options and how many values follow each
+MAP_OPTIONS = {"-blendu": 1, "-blendv": 1, "-bm": 1, "-boost": 1, "-cc": 1, "-clamp": 1, "-imfchan": 1,
+               "-mm": 2, "-o": 3, "-s": 3, "-t": 3, "-texres": 1}
+
+
+def read_mtl(file_name):
+    # Only what the viewer draws: the diffuse color and texture, the map path
+    # resolved next to the .mtl file with any -option arguments before it dropped
+    materials = {}
+    directory = os.path.dirname(os.path.abspath(file_name))
+    current = None
+    with open(file_name, "r", errors="replace") as file:
+        for line in file:
+            words = line.split()
+            if not words:
+                continue
+            if words[0] == "newmtl":
+                current = materials.setdefault(" ".join(words[1:]), {})
+            elif current is None:
+                continue
+            elif words[0] == "Kd" and len(words) >= 4:
+                current["Kd"] = tuple(float(value) for value in words[1:4])
+            elif words[0] == "map_Kd" and len(words) >= 2:
+                path = map_path(line.split(None, 1)[1].strip())
+                if path:
+                    current["map_Kd"] = os.path.normpath(os.path.join(directory, path))
+    return materials
+
+
+def map_path(arguments):
+    # "-s 1 1 1 -clamp on textures/wood.png" to "textures/wood.png"; every option has
+    # a fixed number of values, the rest of the line is the (possibly spaced) path
+    words = arguments.replace("\\", "/").split(" ")
+    while words and (words[0] == "" or words[0] in MAP_OPTIONS):
+        words = words[1 + MAP_OPTIONS.get(words[0], 0):]
+    return " ".join(words).strip()
+
+
+def material_table(file_name, mtllibs, names):
+    # One entry per material id, in the order the reader assigned them
+    library = {}
+    directory = os.path.dirname(os.path.abspath(file_name))
+    for mtllib in mtllibs:
+        path = os.path.join(directory, mtllib)
+        if os.path.exists(path):
+            for name, values in read_mtl(path).items():
+                library.setdefault(name, values)
+    return [{"name": name, "color": library.get(name, {}).get("Kd"), "texture": library.get(name, {}).get("map_Kd")}
+            for name in names]
+
+
+def split_texcoords(indices, texcoord_indices, texcoords):
+    # One vertex per distinct (position, texture coordinate) pair, so UV seams get their own
+    # vertices; returns the position each new vertex comes from, its coordinates and the
+    # new indices. Corners without coordinates (index 0) sample the texture at (0, 0)
+    pairs = (indices.astype("u8") << numpy.uint64(32)) | texcoord_indices.astype("u8")
+    pairs, split = numpy.unique(pairs, return_inverse=True)
+    positions = (pairs >> numpy.uint64(32)).astype("u4")
+    coordinates = numpy.vstack([numpy.zeros((1, 2), dtype="f4"), texcoords.astype("f4", copy=False)])
+    coordinates = coordinates[(pairs & numpy.uint64(0xFFFFFFFF)).astype("i8")]
+    return positions, coordinates, split.reshape(-1).astype("u4")
+
+
+def sort_by_material(indices, triangle_materials):
+    # Stable, so the original triangle order survives inside each material;
+    # also returns the old index of every sorted triangle
+    order = numpy.argsort(triangle_materials, kind="stable")
+    return indices.reshape(-1, 3)[order].reshape(-1), triangle_materials[order], order
+
+
+def material_ranges(triangle_materials):
+    # Rows of (material, first triangle, triangle count) for sorted triangles
+    if len(triangle_materials) == 0:
+        return numpy.empty((0, 3), dtype="u4")
+    starts = numpy.flatnonzero(numpy.diff(triangle_materials.astype("i8"))) + 1
+    starts = numpy.concatenate(([0], starts))
+    counts = numpy.diff(numpy.concatenate((starts, [len(triangle_materials)])))
+    return numpy.stack([triangle_materials[starts], starts, counts], axis=1).astype("u4")
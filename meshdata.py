@@ -0,0 +1,52 @@
+import geometry
+
+
+class MeshData:
+    def __init__(self, file_name, points, normals, indices, n_edges, obj_info=None, bounding_box=None, lods=None):
+        self.file_name = file_name
+        self.obj_info = obj_info
+        self.points = points
+        self.normals = normals
+        self.indices = indices
+        self.n_vertices = len(points)
+        self.n_faces = len(indices) // 3
+        self.n_edges = n_edges
+        if bounding_box is None:
+            bounding_box = geometry.bounding_box(points)
+        self.bounding_box = bounding_box
+        # Coarser index buffers over the same vertices, finest first
+        self.lods = lods or []
+        # Material draw ranges, rows of (material, first triangle, triangle count)
+        self.materials = []
+        self.ranges = None
+        self.lod_ranges = [None] * len(self.lods)
+        # Surface area, boundary/non-manifold edges, ... (geometry.mesh_statistics)
+        self.stats = {}
+        # (stage, seconds) pairs recorded while loading
+        self.timings = []
+        # Quantized vertex records (quantize.COMPACT_VERTEX), built on request
+        self.compact = None
+        # Spatial chunks of the triangles, rows of (material, first triangle, triangle count),
+        # and their (min, max) boxes; None for meshes drawn whole
+        self.chunks = None
+        self.chunk_bounds = None
+        # Per-vertex texture coordinates, only kept when a material has a texture (map_Kd)
+        self.texcoords = None
+        # File index of every triangle when loading reordered them (materials, chunks,
+        # vertex cache), None when they are in file order
+        self.triangle_order = None
+        # Vertex-only scans are drawn as points: RGBA byte colors when the file has them
+        # and the typical distance between points; normals may be None, lods are voxel subsets
+        self.point_cloud = False
+        self.colors = None
+        self.point_spacing = None
+
+    def set_materials(self, materials, ranges, lod_ranges):
+        self.materials = materials
+        self.ranges = ranges
+        self.lod_ranges = lod_ranges
+
+    def set_points(self, colors, spacing):
+        self.point_cloud = True
+        self.colors = colors
+        self.point_spacing = spacing
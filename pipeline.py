@@ -0,0 +1,196 @@
+import numpy
+import os
+import time
+
+from chunks import CHUNK_MIN_TRIANGLES, build_chunks
+from lod import build_lods
+from materials import material_table, material_ranges, sort_by_material, split_texcoords
+from meshdata import MeshData
+from pointcloud import point_spacing, read_point_cloud, voxel_levels
+from quantize import compact_vertices
+from readers import read_mesh
+from scanner import ObjInfo, scan_obj
+from vertexcache import VERTEX_CACHE_SIZE, acmr, fetch_order, optimize_indices
+import geometry
+
+
+class LoadCancelled(Exception):
+    pass
+
+
+def load_mesh(file_name, progress=None, is_cancelled=None, compact=False, partial=None, optimize=None):
+    # Parse the file and build the arrays the GL thread uploads,
+    # timing every stage for the profiler; partial receives parsed data early (readers.read_mesh);
+    # optimize is None, "cache" or "overdraw" (optimize_mesh)
+    timings = []
+    stage = [None, time.perf_counter()]
+
+    def step(percent, message):
+        if is_cancelled is not None and is_cancelled():
+            raise LoadCancelled(file_name)
+        if message != stage[0]:
+            now = time.perf_counter()
+            if stage[0] is not None:
+                timings.append((stage[0], now - stage[1]))
+            stage[:] = [message, now]
+        if progress is not None:
+            progress(percent, message)
+
+    extension = os.path.splitext(file_name)[1].lower()
+    is_obj = extension == ".obj"
+    obj_info = ObjInfo() if is_obj else None
+    step(0, "Reading")
+    if extension in (".ply", ".off"):
+        # Files without faces are point clouds, meshes fall through to the readers below
+        try:
+            cloud = read_point_cloud(file_name, lambda done: step(int(done * 60), "Reading"), partial)
+        except LoadCancelled:
+            raise
+        except Exception:
+            cloud = None
+        if cloud is not None:
+            mesh = point_cloud_mesh(file_name, cloud, step)
+            timings.append((stage[0], time.perf_counter() - stage[1]))
+            mesh.timings = timings
+            return mesh
+    try:
+        arrays = read_mesh(file_name, lambda done: step(int(done * 60), "Reading"), obj_info, partial)
+    except LoadCancelled:
+        raise
+    except Exception:
+        # Anything the fast path cannot handle is left to openmesh
+        arrays = None
+
+    materials = []
+    triangle_materials = None
+    texcoord_indices = None
+    # File index of every triangle once sorting, chunking or optimizing reorders them
+    triangle_order = None
+    if arrays is not None:
+        points, indices = arrays["points"], arrays["indices"]
+        texcoord_indices = arrays.get("texcoord_indices")
+        if "triangle_materials" in arrays:
+            # One contiguous index range per material
+            indices, triangle_materials, triangle_order = sort_by_material(indices, arrays["triangle_materials"])
+            if texcoord_indices is not None:
+                texcoord_indices = texcoord_indices.reshape(-1, 3)[triangle_order].reshape(-1)
+            materials = material_table(file_name, obj_info.mtllibs, arrays["material_names"])
+        step(60, "Computing normals")
+        face_normals = geometry.triangle_normals(points, indices)
+        normals = geometry.vertex_normals(points, indices, face_normals)
+    else:
+        if is_obj:
+            obj_info = scan_obj(file_name, progress=lambda done: step(int(done * 20), "Scanning"))
+        points, normals, indices = read_openmesh(file_name, step)
+        face_normals = None
+    step(75, "Mesh statistics")
+    bounding_box = geometry.bounding_box(points)
+    stats = geometry.mesh_statistics(points, indices, bounding_box, face_normals)
+    del face_normals
+    texcoords = None
+    if texcoord_indices is not None and any(material["texture"] for material in materials):
+        # UV seams become separate vertices, after the normals and statistics so that
+        # shading and edge counts still see one surface across them
+        step(78, "Splitting UV seams")
+        positions, texcoords, indices = split_texcoords(indices, texcoord_indices, arrays["texcoords"])
+        points, normals = points[positions], normals[positions]
+        del positions
+    del texcoord_indices
+    chunks = chunk_bounds = None
+    if len(indices) // 3 >= CHUNK_MIN_TRIANGLES:
+        step(80, "Building chunks")
+        indices, triangle_materials, chunks, chunk_bounds, order = build_chunks(points, indices, bounding_box,
+                                                                                triangle_materials)
+        triangle_order = order if triangle_order is None else triangle_order[order]
+    if optimize and len(indices):
+        step(82, "Optimizing indices")
+        if chunks is not None:
+            ranges = chunks
+        elif triangle_materials is not None:
+            ranges = material_ranges(triangle_materials)
+        else:
+            ranges = [(0, 0, len(indices) // 3)]
+        points, normals, texcoords, indices, order, stats["vertex_cache"] = optimize_mesh(
+            points, normals, texcoords, indices, ranges, bounding_box, optimize == "overdraw",
+            lambda done: step(82 + int(done * 3), "Optimizing indices"))
+        triangle_order = order if triangle_order is None else triangle_order[order]
+    step(85, "Building LODs")
+    lods, lod_ranges = build_lods(points, indices, bounding_box,
+                                  lambda done: step(85 + int(done * 10), "Building LODs"), triangle_materials)
+    if optimize and lods:
+        # Coarser levels keep the triangle order of level 0 only roughly, each gets its own pass
+        step(95, "Optimizing LOD indices")
+        lods = [optimize_indices(points, level, [(0, 0, len(level) // 3)] if ranges is None else ranges,
+                                 bounding_box, optimize == "overdraw")[0] for level, ranges in zip(lods, lod_ranges)]
+    step(95, "Finishing")
+    mesh = MeshData(file_name, points, normals, indices, stats["edges"], obj_info, bounding_box, lods)
+    mesh.stats = stats
+    mesh.chunks, mesh.chunk_bounds = chunks, chunk_bounds
+    mesh.texcoords = texcoords
+    if triangle_order is not None:
+        mesh.triangle_order = triangle_order.astype("u4")
+    if compact:
+        step(97, "Quantizing")
+        mesh.compact = compact_vertices(points, normals, bounding_box)
+    if triangle_materials is not None:
+        mesh.set_materials(materials, material_ranges(triangle_materials), lod_ranges)
+    timings.append((stage[0], time.perf_counter() - stage[1]))
+    mesh.timings = timings
+    return mesh
+
+
+def optimize_mesh(points, normals, texcoords, indices, ranges, bounding_box, overdraw, progress=None):
+    # Triangles reordered for the post-transform vertex cache (and overdraw) inside every draw
+    # range, then vertices renumbered in the order the triangles fetch them; the LODs built
+    # afterwards keep that order. Returns the new arrays, the old index of every reordered
+    # triangle and the ACMR before and after
+    acmr_before = acmr(indices)
+    indices, triangle_order = optimize_indices(points, indices, ranges, bounding_box, overdraw, progress)
+    order, remap = fetch_order(indices, len(points))
+    points, normals, indices = points[order], normals[order], remap[indices]
+    if texcoords is not None:
+        texcoords = texcoords[order]
+    report = {"cache_size": VERTEX_CACHE_SIZE, "acmr_before": acmr_before, "acmr": acmr(indices),
+              "mode": "overdraw" if overdraw else "cache"}
+    return points, normals, texcoords, indices, triangle_order, report
+
+
+def point_cloud_mesh(file_name, cloud, step):
+    # No faces, edges or compact vertices; the voxel subsets stand in for the LODs
+    points = cloud["points"]
+    step(60, "Point spacing")
+    bounding_box = geometry.bounding_box(points)
+    spacing = point_spacing(points, bounding_box)
+    step(70, "Building voxel levels")
+    levels = voxel_levels(points, bounding_box, spacing,
+                          lambda done: step(70 + int(done * 25), "Building voxel levels"))
+    step(95, "Finishing")
+    mesh = MeshData(file_name, points, cloud.get("normals"), numpy.empty(0, dtype="u4"), 0, None, bounding_box, levels)
+    mesh.stats = {"point_spacing": spacing}
+    mesh.set_points(cloud.get("colors"), spacing)
+    return mesh
+
+
+def read_openmesh(file_name, step):
+    import openmesh
+    step(20, "Reading")
+    mesh = openmesh.read_trimesh(file_name)
+    step(50, "Computing normals")
+    mesh.update_normals()
+    step(70, "Building arrays")
+    points = as_dtype(mesh.points(), "f4")
+    normals = as_dtype(mesh.vertex_normals(), "f4")
+    indices = as_dtype(mesh.face_vertex_indices(), "u4").reshape(-1)
+    return points, normals, indices
+
+
+def as_dtype(array, dtype):
+    # openmesh hands out fresh arrays, so only convert when the dtype really differs;
+    # int32 indices are reinterpreted as u4 without a copy
+    dtype = numpy.dtype(dtype)
+    array = numpy.ascontiguousarray(array)
+    if array.dtype == dtype:
+        return array
+    if array.dtype.kind in "iu" and dtype.kind in "iu" and array.dtype.itemsize == dtype.itemsize:
+        return array.view(dtype)
+    return array.astype(dtype)
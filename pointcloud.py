@@ -0,0 +1,283 @@
+import mmap
+import os
+import re
+import numpy
+
+from lod import LOD_MAX_LEVELS, LOD_RATIO
+from readers import ASCII_BLOCK, parse_ply_header, ply_element_dtype
+
+# Vertex-only PLY and OFF files (scans) load as point clouds: positions plus the normals
+# and colors the file carries, with voxel-grid subsets to draw while interacting
+
+# Points converted per block while reading, each block goes to partial as soon as it is ready
+POINT_BLOCK = 1 << 21
+# Clouds below this many points are always drawn whole
+VOXEL_MIN_POINTS = 1 << 20
+# Finest voxel grid along the longest side, cell keys stay within 32 bits
+VOXEL_MAX_RESOLUTION = 1023
+# Grid and sample size of the point spacing estimate
+SPACING_RESOLUTION = 128
+SPACING_SAMPLE = 1 << 20
+PLY_COLORS = (("red", "green", "blue", "alpha"), ("diffuse_red", "diffuse_green", "diffuse_blue", "diffuse_alpha"),
+              ("r", "g", "b", "a"))
+OFF_HEADER = re.compile(rb"(C?)(N?)OFF")
+OFF_HEADER_LINES = 64
+
+
+def read_point_cloud(file_name, progress=None, partial=None):
+    # Returns points and, when the file has them, normals and RGBA byte colors, or None for
+    # anything but a vertex-only PLY/OFF file; partial(points, None) gets every block read
+    extension = os.path.splitext(file_name)[1].lower()
+    if extension not in (".ply", ".off") or os.path.getsize(file_name) == 0:
+        return None
+    with open(file_name, "rb") as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            layout = ply_points(view) if extension == ".ply" else off_points(view)
+            if layout is None:
+                return None
+            count, has_normals, colors, blocks = layout
+            try:
+                return fill_points(count, has_normals, colors, blocks, progress, partial)
+            finally:
+                # A block reader left half way may still reference the mapping
+                blocks.close()
+
+
+def fill_points(count, has_normals, color_columns, blocks, progress=None, partial=None):
+    points = numpy.empty((count, 3), dtype="f4")
+    normals = numpy.empty((count, 3), dtype="f4") if has_normals else None
+    colors = None
+    if color_columns is not None:
+        # Colors of unknown range are kept as read until the whole column is in
+        unscaled = color_columns[0][1] is None
+        colors = numpy.empty((count, len(color_columns) if unscaled else 4), dtype="f4" if unscaled else "u1")
+    start = 0
+    for block_points, block_normals, block_colors in blocks:
+        stop = start + len(block_points)
+        if stop > count:
+            return None
+        points[start:stop] = block_points
+        if normals is not None:
+            normals[start:stop] = block_normals
+        if colors is not None:
+            colors[start:stop] = block_colors
+        if partial is not None:
+            partial(points[start:stop], None)
+        if progress is not None:
+            progress(stop / count)
+        start = stop
+    if count == 0 or start != count:
+        return None
+    arrays = {"points": points}
+    if normals is not None:
+        arrays["normals"] = normals
+    if colors is not None:
+        arrays["colors"] = colors if colors.dtype == "u1" else color_bytes(colors)
+    return arrays
+
+
+def color_bytes(values):
+    # RGB(A) read as numbers to RGBA bytes: 0-1 floats when no value in the file exceeds 1,
+    # 0-255 integers otherwise; alpha is opaque when the file has none
+    scale = 255.0 if float(values.max()) <= 1.0 else 1.0
+    colors = numpy.full((len(values), 4), 255, dtype="u1")
+    for channel in range(values.shape[1]):
+        column = values[:, channel] * scale
+        colors[:, channel] = numpy.clip(numpy.rint(column, out=column), 0, 255)
+    return colors
+
+
+def point_columns(columns, normal_names, colors):
+    # Named columns of one block to (points, normals, colors); colors are (name, scale)
+    # pairs taking each channel to 0-255, alpha is opaque when the file has none; a scale
+    # of None leaves the channels as read, for fill_points to scale
+    points = numpy.stack([columns["x"], columns["y"], columns["z"]], axis=1).astype("f4", copy=False)
+    normals = None
+    if normal_names is not None:
+        normals = numpy.stack([columns[name] for name in normal_names], axis=1).astype("f4", copy=False)
+    block_colors = None
+    if colors is not None and colors[0][1] is None:
+        block_colors = numpy.stack([columns[name] for name, _ in colors], axis=1).astype("f4", copy=False)
+    elif colors is not None:
+        block_colors = numpy.full((len(points), 4), 255, dtype="u1")
+        for channel, (name, scale) in enumerate(colors):
+            values = columns[name] * scale
+            block_colors[:, channel] = numpy.clip(numpy.rint(values, out=values), 0, 255)
+    return points, normals, block_colors
+
+
+def color_scale(kind):
+    # Float channels run from 0 to 1, integer ones over their whole range
+    if kind[0] == "f":
+        return 255.0
+    return 255.0 / (2 ** (8 * int(kind[1:])) - 1)
+
+
+def ascii_blocks(view, offset, count, names, normal_names, colors):
+    # One point per line of whitespace separated numbers, parsed a few MB at a time
+    end = len(view)
+    start = offset
+    rows = 0
+    while rows < count and start < end:
+        stop = view.find(b"\n", min(start + ASCII_BLOCK, end - 1))
+        stop = end if stop < 0 else stop + 1
+        values = numpy.fromstring(view[start:stop], dtype="f8", sep=" ")
+        start = stop
+        if len(values) % len(names):
+            raise ValueError("Point rows of unequal length")
+        values = values.reshape(-1, len(names))[:count - rows]
+        rows += len(values)
+        yield point_columns({name: values[:, column] for column, name in enumerate(names)}, normal_names, colors)
+
+
+def binary_blocks(view, offset, count, dtype, normal_names, colors):
+    records = numpy.frombuffer(view, dtype, count, offset)
+    for start in range(0, count, POINT_BLOCK):
+        block = records[start:start + POINT_BLOCK]
+        yield point_columns({name: block[name] for name in dtype.names}, normal_names, colors)
+
+
+# -------------- PLY --------------
+def ply_points(view):
+    # Point count, normals and colors present, and the block reader of a PLY
+    # whose first element is the vertex list and which has no faces
+    header = parse_ply_header(view)
+    if header is None:
+        return None
+    fmt, elements, offset = header
+    if not elements or elements[0][0] != "vertex" or any(count for _, count, _ in elements[1:]):
+        return None
+    _, count, properties = elements[0]
+    kinds = {name: kind for name, kind, item in properties}
+    if any(item is not None for _, _, item in properties) or not {"x", "y", "z"} <= set(kinds):
+        return None
+    normal_names = ("nx", "ny", "nz") if {"nx", "ny", "nz"} <= set(kinds) else None
+    colors = None
+    for names in PLY_COLORS:
+        if set(names[:3]) <= set(kinds):
+            colors = [(name, color_scale(kinds[name])) for name in names if name in kinds]
+            break
+
+    if fmt == "ascii":
+        blocks = ascii_blocks(view, offset, count, [name for name, _, _ in properties], normal_names, colors)
+    elif fmt in ("binary_little_endian", "binary_big_endian"):
+        dtype = ply_element_dtype(properties, "<" if fmt == "binary_little_endian" else ">")
+        if offset + count * dtype.itemsize > len(view):
+            return None
+        blocks = binary_blocks(view, offset, count, dtype, normal_names, colors)
+    else:
+        return None
+    return count, normal_names is not None, colors, blocks
+
+
+# -------------- OFF --------------
+def off_points(view):
+    # [C][N]OFF, "vertices faces edges", then one vertex per line: x y z, the normal
+    # for NOFF and the color for COFF (RGB or RGBA, 0-1 floats or 0-255 integers)
+    words = []
+    position = 0
+    for _ in range(OFF_HEADER_LINES):
+        stop = view.find(b"\n", position)
+        if stop < 0:
+            return None
+        words.extend(view[position:stop].split(b"#")[0].split())
+        position = stop + 1
+        if len(words) >= 4:
+            break
+    header = OFF_HEADER.fullmatch(words[0]) if len(words) >= 4 else None
+    if header is None or not all(word.isdigit() for word in words[1:4]):
+        return None
+    count, faces = int(words[1]), int(words[2])
+    if faces or count == 0:
+        return None
+
+    stop = view.find(b"\n", position)
+    first = view[position:stop if stop >= 0 else len(view)].split()
+    names = ["x", "y", "z"]
+    normal_names = None
+    if header.group(2):
+        normal_names = ("nx", "ny", "nz")
+        names.extend(normal_names)
+    colors = None
+    if header.group(1):
+        color_words = first[len(names):]
+        if len(color_words) not in (3, 4):
+            return None
+        # 0-1 or 0-255 is only known once every row is read
+        colors = [(name, None) for name in ("red", "green", "blue", "alpha")[:len(color_words)]]
+        names.extend(name for name, _ in colors)
+    if len(first) < len(names):
+        return None
+    # Anything after the known columns (texture coordinates, ...) is read and ignored
+    names.extend(f"extra{column}" for column in range(len(first) - len(names)))
+    return count, normal_names is not None, colors, ascii_blocks(
+        view, position, count, names, normal_names, colors)
+
+
+# -------------- Voxel levels --------------
+def cell_keys(points, low, high, size):
+    # Linear index of the cube of edge size each point falls into, computed in blocks
+    dims = numpy.floor((high - low) / size).astype("u4") + 1
+    keys = numpy.empty(len(points), dtype="u4")
+    for start in range(0, len(points), POINT_BLOCK):
+        cells = numpy.floor((points[start:start + POINT_BLOCK] - low) / size)
+        cells = numpy.clip(cells, 0, dims - 1).astype("u4")
+        keys[start:start + len(cells)] = (cells[:, 0] * dims[1] + cells[:, 1]) * dims[2] + cells[:, 2]
+    return keys
+
+
+def first_in_cells(keys):
+    # Index of the first point in every occupied cell, in cell order; one plain sort of
+    # the key and index packed in 64 bits is several times quicker than a stable argsort
+    packed = keys.astype("u8") << numpy.uint64(32)
+    packed |= numpy.arange(len(keys), dtype="u8")
+    packed.sort()
+    cells = packed >> numpy.uint64(32)
+    first = numpy.empty(len(packed), dtype=bool)
+    first[:1] = True
+    numpy.not_equal(cells[1:], cells[:-1], out=first[1:])
+    del cells
+    return (packed[first] & numpy.uint64(0xFFFFFFFF)).astype("u4")
+
+
+def point_spacing(points, bounding_box):
+    # Typical distance between neighbouring points, taking them to sample surfaces:
+    # the cells of a coarse grid they occupy give the area, which the points share evenly
+    low, high = (numpy.asarray(corner, dtype="f8") for corner in bounding_box)
+    size = max(float(numpy.max(high - low)), 1e-12) / SPACING_RESOLUTION
+    sample = points[::max(1, len(points) // SPACING_SAMPLE)]
+    occupied = len(numpy.unique(cell_keys(sample, low, high, size)))
+    return float(size * numpy.sqrt(occupied / max(1, len(points))))
+
+
+def voxel_levels(points, bounding_box, spacing, progress=None):
+    # Coarser subsets as index arrays into the full points, finest first: one point per
+    # occupied cube of an ever coarser grid, each level picked from the one before it
+    levels = []
+    if len(points) < VOXEL_MIN_POINTS:
+        return levels
+    low, high = (numpy.asarray(corner, dtype="f8") for corner in bounding_box)
+    extent = max(float(numpy.max(high - low)), 1e-12)
+    selected = None
+    count = len(points)
+    size = spacing
+    while len(levels) < LOD_MAX_LEVELS:
+        # On a surface, a quarter of the points are twice as far apart
+        size = max(size / numpy.sqrt(LOD_RATIO), extent / VOXEL_MAX_RESOLUTION)
+        if extent / size < 8:
+            break
+        source = points if selected is None else points[selected]
+        first = first_in_cells(cell_keys(source, low, high, size))
+        del source
+        if len(first) > count * 0.5:
+            # Not coarse enough for this cloud, the next pass tries a coarser grid
+            continue
+        first.sort()
+        selected = first.astype("u4") if selected is None else selected[first]
+        levels.append(selected)
+        count = len(selected)
+        if progress is not None:
+            progress(len(levels) / LOD_MAX_LEVELS)
+        if count < VOXEL_MIN_POINTS // 4:
+            break
+    return levels
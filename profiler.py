@@ -0,0 +1,70 @@
+import collections
+import contextlib
+import json
+import os
+import threading
+import time
+import numpy
+
+
+class Profiler:
+    # Records load spans and per-frame CPU/GPU times, exportable as a Chrome trace
+    # (chrome://tracing or https://ui.perfetto.dev)
+    def __init__(self, history=600, max_events=200000):
+        self.origin = time.perf_counter()
+        self.events = collections.deque(maxlen=max_events)
+        self.frames = collections.deque(maxlen=history)
+        self.lock = threading.Lock()
+
+    def timestamp(self, moment=None):
+        # Microseconds since the profiler started, as the trace format expects
+        return ((time.perf_counter() if moment is None else moment) - self.origin) * 1e6
+
+    def record(self, name, start, duration, category="load", **args):
+        event = {"name": name, "cat": category, "ph": "X", "ts": self.timestamp(start),
+                 "dur": duration * 1e6, "pid": os.getpid(), "tid": threading.get_ident(), "args": args}
+        with self.lock:
+            self.events.append(event)
+
+    @contextlib.contextmanager
+    def span(self, name, category="load", **args):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter() - start, category, **args)
+
+    def record_timings(self, timings, end, category="load", **args):
+        # Spans measured elsewhere (the loader process), laid back to back up to end
+        start = end - sum(duration for _, duration in timings)
+        for name, duration in timings:
+            self.record(name, start, duration, category, **args)
+            start += duration
+
+    def frame(self, start, cpu_time, gpu_time=None):
+        self.frames.append((start, cpu_time, gpu_time))
+        self.record("frame", start, cpu_time, "frame", gpu_ms=None if gpu_time is None else gpu_time * 1e3)
+        if gpu_time is not None:
+            with self.lock:
+                self.events.append({"name": "gpu", "cat": "frame", "ph": "C", "ts": self.timestamp(start),
+                                    "pid": os.getpid(), "args": {"gpu_ms": gpu_time * 1e3}})
+
+    def frame_stats(self):
+        # Rolling FPS over the last second and CPU/GPU millisecond percentiles
+        if not self.frames:
+            return None
+        frames = numpy.array([(start, cpu, numpy.nan if gpu is None else gpu) for start, cpu, gpu in self.frames])
+        recent = frames[frames[:, 0] >= frames[-1, 0] - 1.0]
+        stats = {"fps": len(recent) if len(recent) > 1 else 0}
+        for column, name in ((1, "cpu"), (2, "gpu")):
+            values = frames[:, column][~numpy.isnan(frames[:, column])] * 1e3
+            if len(values):
+                stats[name] = dict(zip(("p50", "p95", "p99"), numpy.percentile(values, [50, 95, 99])))
+        return stats
+
+    def export(self, file_name):
+        with self.lock:
+            trace = {"traceEvents": list(self.events), "displayTimeUnit": "ms",
+                     "otherData": {"frame_stats": self.frame_stats()}}
+        with open(file_name, "w") as file:
+            json.dump(trace, file)
@@ -0,0 +1,44 @@
+import numpy
+
+# 12 bytes per vertex instead of 24: positions as 16-bit steps across the
+# bounding box, normals octahedral-encoded in two 16-bit components
+COMPACT_VERTEX = numpy.dtype([("position", "<u2", 3), ("padding", "<u2"), ("normal", "<i2", 2)])
+COMPACT_LAYOUT = ('3u2 x2 2i2', 'in_position', 'in_normal_oct')
+FLOAT_LAYOUT = ('3f 3f', 'in_position', 'in_normal')
+POSITION_STEPS = 65535
+NORMAL_STEPS = 32767
+
+
+def index_dtype(n_vertices):
+    # 0xFFFF stays free, it is the primitive restart index on some drivers
+    return "u2" if n_vertices < 0xFFFF else "u4"
+
+
+def position_range(bounding_box):
+    # Offset and per-step scale the vertex shader applies to the integer positions
+    bounding_box_min, bounding_box_max = (numpy.asarray(corner, dtype="f8") for corner in bounding_box)
+    extent = numpy.maximum(bounding_box_max - bounding_box_min, 1e-12)
+    return bounding_box_min, extent / POSITION_STEPS
+
+
+def octahedral_normals(normals):
+    # Project onto the octahedron |x|+|y|+|z| = 1 and fold the lower half over
+    normals = numpy.asarray(normals, dtype="f4")
+    length = numpy.abs(normals).sum(axis=1, keepdims=True)
+    length[length == 0] = 1
+    encoded = normals[:, :2] / length
+    folded = 1 - numpy.abs(encoded[:, ::-1])
+    folded = numpy.copysign(folded, encoded, out=folded)
+    encoded = numpy.where(normals[:, 2:] < 0, folded, encoded)
+    encoded *= NORMAL_STEPS
+    return numpy.rint(encoded, out=encoded).astype("i2")
+
+
+def compact_vertices(points, normals, bounding_box):
+    offset, scale = position_range(bounding_box)
+    vertices = numpy.zeros(len(points), dtype=COMPACT_VERTEX)
+    steps = (numpy.asarray(points, dtype="f4") - offset.astype("f4")) * (1 / scale).astype("f4")
+    numpy.clip(numpy.rint(steps, out=steps), 0, POSITION_STEPS, out=steps)
+    vertices["position"] = steps
+    vertices["normal"] = octahedral_normals(normals)
+    return vertices
@@ -0,0 +1,359 @@
+import mmap
+import os
+import re
+import numpy
+
+from scanner import iter_blocks
+
+# Fast-path readers returning a dict of arrays ready for upload
+# (points, indices and, for OBJ, material_names/triangle_materials and texcoords/texcoord_indices),
+# or None when the file needs the full openmesh reader
+
+PLY_TYPES = {
+    "char": "i1", "int8": "i1", "uchar": "u1", "uint8": "u1",
+    "short": "i2", "int16": "i2", "ushort": "u2", "uint16": "u2",
+    "int": "i4", "int32": "i4", "uint": "u4", "uint32": "u4",
+    "float": "f4", "float32": "f4", "double": "f8", "float64": "f8",
+}
+STL_RECORD = numpy.dtype([("normal", "<f4", 3), ("vertices", "<f4", (3, 3)), ("attribute", "<u2")])
+OBJ_INDEX_SUFFIX = re.compile(rb"/\S*")
+OBJ_USEMTL_LINE = re.compile(rb"\nusemtl[ \t]+(\S*)[^\n]*")
+# Face corners as v, v/vt, v/vt/vn or v//vn; the texture coordinate index is kept, 0 for none
+OBJ_BARE_INDEX = re.compile(rb"(?<!\S)-?\d+(?!\S)")
+OBJ_NO_TEXCOORD = re.compile(rb"-?\d+//\S*")
+OBJ_TEXCOORD_INDEX = re.compile(rb"-?\d+/(-?\d+)\S*")
+ASCII_BLOCK = 1 << 24
+
+
+def read_mesh(file_name, progress=None, obj_info=None, partial=None):
+    # partial(points, indices) gets the data as soon as it is parsed: new vertices to
+    # append and triangles over all vertices so far, block by block for OBJ, once otherwise
+    extension = os.path.splitext(file_name)[1].lower()
+    if extension == ".obj":
+        return read_obj(file_name, progress, obj_info, partial)
+    if extension == ".stl":
+        arrays = read_stl(file_name, progress)
+    elif extension == ".ply":
+        arrays = read_ply(file_name, progress)
+    else:
+        return None
+    if arrays is not None and partial is not None:
+        partial(arrays["points"], arrays["indices"])
+    return arrays
+
+
+def weld(corners):
+    # Merge identical corners, keeping vertices in first-use order
+    keys = numpy.ascontiguousarray(corners).view(numpy.dtype((numpy.void, corners.itemsize * 3))).reshape(-1)
+    _, first, inverse = numpy.unique(keys, return_index=True, return_inverse=True)
+    order = numpy.argsort(first)
+    remap = numpy.empty(len(order), dtype="u4")
+    remap[order] = numpy.arange(len(order), dtype="u4")
+    return corners[first[order]], remap[inverse.reshape(-1)]
+
+
+def triangulate(counts, indices):
+    # Fan triangulation of polygons stored back to back in indices
+    if len(counts) == 0:
+        return numpy.empty(0, dtype="u4")
+    if numpy.all(counts == 3):
+        return indices.astype("u4").reshape(-1)
+    starts = numpy.concatenate(([0], numpy.cumsum(counts)[:-1]))
+    fans = counts - 2
+    polygon = numpy.repeat(numpy.arange(len(counts)), fans)
+    corner = numpy.arange(len(polygon)) - numpy.repeat(numpy.cumsum(fans) - fans, fans)
+    base = starts[polygon]
+    triangles = numpy.stack([indices[base], indices[base + corner + 1], indices[base + corner + 2]], axis=1)
+    return triangles.astype("u4").reshape(-1)
+
+
+# -------------- STL --------------
+def read_stl(file_name, progress=None):
+    size = os.path.getsize(file_name)
+    if size < 84:
+        return None
+    with open(file_name, "rb") as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            count = int(numpy.frombuffer(view, "<u4", 1, 80)[0])
+            if size != 84 + count * STL_RECORD.itemsize:
+                # ASCII STL goes through openmesh
+                return None
+            records = numpy.frombuffer(view, STL_RECORD, count, 84)
+            corners = records["vertices"].reshape(-1, 3).copy()
+            del records
+    if progress is not None:
+        progress(0.5)
+    points, indices = weld(corners)
+    return {"points": points, "indices": indices}
+
+
+# -------------- PLY --------------
+def parse_ply_header(view):
+    end = view.find(b"end_header")
+    if view[:3] != b"ply" or end < 0:
+        return None
+    body = view.find(b"\n", end) + 1
+    fmt = None
+    elements = []
+    for line in view[:end].decode("ascii", errors="replace").splitlines():
+        words = line.split()
+        if not words:
+            continue
+        if words[0] == "format":
+            fmt = words[1]
+        elif words[0] == "element":
+            elements.append((words[1], int(words[2]), []))
+        elif words[0] == "property" and elements:
+            if words[1] == "list":
+                elements[-1][2].append((words[4], PLY_TYPES[words[2]], PLY_TYPES[words[3]]))
+            else:
+                elements[-1][2].append((words[2], PLY_TYPES[words[1]], None))
+    return fmt, elements, body
+
+
+def ply_element_dtype(properties, order, list_length=None):
+    fields = []
+    for name, kind, item in properties:
+        if item is None:
+            fields.append((name, order + kind))
+        else:
+            fields.append((name + "_count", order + kind))
+            fields.append((name, order + item, (list_length,)))
+    return numpy.dtype(fields)
+
+
+def read_ply(file_name, progress=None):
+    with open(file_name, "rb") as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            header = parse_ply_header(view)
+            if header is None:
+                return None
+            fmt, elements, offset = header
+            if fmt == "ascii":
+                arrays = read_ply_ascii(view, elements, offset, progress)
+            elif fmt in ("binary_little_endian", "binary_big_endian"):
+                arrays = read_ply_binary(view, elements, offset, "<" if fmt == "binary_little_endian" else ">")
+            else:
+                return None
+    if arrays is None or "vertex" not in arrays or "face" not in arrays:
+        return None
+
+    vertex = arrays["vertex"]
+    points = numpy.stack([vertex["x"], vertex["y"], vertex["z"]], axis=1).astype("f4")
+    counts, polygons = arrays["face"]
+    indices = triangulate(counts, polygons)
+    if len(indices) and indices.max() >= len(points):
+        return None
+    return {"points": points, "indices": indices}
+
+
+def read_ply_binary(view, elements, offset, order):
+    arrays = {}
+    for name, count, properties in elements:
+        lists = [prop for prop in properties if prop[2] is not None]
+        if len(lists) > 1:
+            return None
+        if not lists:
+            dtype = ply_element_dtype(properties, order)
+            arrays[name] = numpy.frombuffer(view, dtype, count, offset).copy()
+            offset += count * dtype.itemsize
+            continue
+
+        # Assume every list has the length of the first one, then verify
+        if count == 0:
+            arrays[name] = (numpy.empty(0, dtype="i8"), numpy.empty(0, dtype="i8"))
+            continue
+        probe = ply_element_dtype(properties, order, 1)
+        list_name = lists[0][0]
+        first = numpy.frombuffer(view, probe, 1, offset)[0][list_name + "_count"]
+        dtype = ply_element_dtype(properties, order, int(first))
+        if offset + count * dtype.itemsize > len(view):
+            return None
+        records = numpy.frombuffer(view, dtype, count, offset)
+        uniform = numpy.all(records[list_name + "_count"] == first)
+        polygons = records[list_name].astype("i8").reshape(-1) if uniform else None
+        del records
+        if not uniform:
+            return None
+        arrays[name] = (numpy.full(count, int(first), dtype="i8"), polygons)
+        offset += count * dtype.itemsize
+    return arrays
+
+
+def read_ply_ascii(view, elements, offset, progress=None):
+    # Every element is a run of whitespace separated numbers
+    numbers = []
+    end = len(view)
+    start = offset
+    while start < end:
+        stop = view.find(b"\n", min(start + ASCII_BLOCK, end - 1))
+        stop = end if stop < 0 else stop + 1
+        numbers.append(numpy.fromstring(view[start:stop], dtype="f8", sep=" "))
+        start = stop
+        if progress is not None:
+            progress(start / end)
+    numbers = numpy.concatenate(numbers) if numbers else numpy.empty(0)
+
+    arrays = {}
+    position = 0
+    for name, count, properties in elements:
+        lists = [prop for prop in properties if prop[2] is not None]
+        if len(lists) > 1 or (lists and properties[0][2] is None):
+            return None
+        if not lists:
+            width = len(properties)
+            values = numbers[position:position + count * width]
+            if len(values) != count * width:
+                return None
+            values = values.reshape(count, width)
+            arrays[name] = {prop[0]: values[:, column] for column, prop in enumerate(properties)}
+            position += count * width
+            continue
+
+        # A uniform polygon list followed by any scalar properties
+        if count == 0:
+            arrays[name] = (numpy.empty(0, dtype="i8"), numpy.empty(0, dtype="i8"))
+            continue
+        length = int(numbers[position])
+        width = 1 + length + len(properties) - 1
+        values = numbers[position:position + count * width]
+        if len(values) != count * width:
+            return None
+        values = values.reshape(count, width)
+        if numpy.any(values[:, 0] != length):
+            return None
+        arrays[name] = (numpy.full(count, length, dtype="i8"), values[:, 1:1 + length].astype("i8").reshape(-1))
+        position += count * width
+    return arrays
+
+
+# -------------- OBJ --------------
+def read_obj(file_name, progress=None, obj_info=None, partial=None):
+    # Block parsed, the optional ObjInfo is filled from the same pass
+    point_blocks = []
+    count_blocks = []
+    index_blocks = []
+    material_blocks = []
+    texcoord_blocks = []
+    texcoord_index_blocks = []
+    material_ids = {}
+    material = -1
+    vertex_count = 0
+    texcoord_count = 0
+    for block in iter_blocks(file_name, progress=progress):
+        if obj_info is not None:
+            obj_info.scan_block(block)
+        streamed = (len(point_blocks), len(index_blocks))
+        if b"\t" in block:
+            # Keywords may be followed by any whitespace, the line tests below look for a space
+            block = block.replace(b"\t", b" ")
+        # Split at usemtl lines: segment, name, segment, name, segment...
+        parts = OBJ_USEMTL_LINE.split(block)
+        for part in range(0, len(parts), 2):
+            if part:
+                name = parts[part - 1].decode(errors="replace")
+                material = material_ids.setdefault(name, len(material_ids))
+            lines = parts[part].split(b"\n")
+            vertex_lines = [line[2:] for line in lines if line.startswith(b"v ")]
+            texcoord_lines = [line[3:] for line in lines if line.startswith(b"vt ")]
+            face_lines = [line[2:] for line in lines if line.startswith(b"f ")]
+
+            if vertex_lines:
+                values = numpy.fromstring(b" ".join(vertex_lines), dtype="f4", sep=" ")
+                width = len(values) // len(vertex_lines)
+                if width < 3 or width * len(vertex_lines) != len(values):
+                    return None
+                point_blocks.append(values.reshape(-1, width)[:, :3])
+
+            if texcoord_lines:
+                values = numpy.fromstring(b" ".join(texcoord_lines), dtype="f4", sep=" ")
+                width = len(values) // len(texcoord_lines)
+                if width < 2 or width * len(texcoord_lines) != len(values):
+                    return None
+                texcoord_blocks.append(values.reshape(-1, width)[:, :2])
+            texcoord_count += len(texcoord_lines)
+
+            if face_lines:
+                counts = numpy.array([len(line.split()) for line in face_lines], dtype="i8")
+                faces = b" ".join(face_lines)
+                indices = numpy.fromstring(OBJ_INDEX_SUFFIX.sub(b"", faces), dtype="i8", sep=" ")
+                if len(indices) != counts.sum() or numpy.any(counts < 3):
+                    return None
+                if numpy.any(indices < 0):
+                    # Relative indices depend on the vertices read so far
+                    relative = obj_relative_base(lines, vertex_count)
+                    indices = numpy.where(indices < 0, indices + numpy.repeat(relative, counts) + 1, indices)
+                count_blocks.append(counts)
+                index_blocks.append(triangulate(counts, indices - 1))
+                # Faces before the first vt line cannot have texture coordinates
+                texcoord_index_blocks.append(
+                    obj_texcoord_indices(faces, counts, lines, texcoord_count - len(texcoord_lines))
+                    if texcoord_count else None)
+                material_blocks.append(numpy.full(len(counts), material, dtype="i4"))
+            vertex_count += len(vertex_lines)
+        if partial is not None and (len(point_blocks), len(index_blocks)) != streamed:
+            new_points = point_blocks[streamed[0]:]
+            new_indices = index_blocks[streamed[1]:]
+            partial(numpy.concatenate(new_points) if new_points else numpy.empty((0, 3), dtype="f4"),
+                    numpy.concatenate(new_indices) if new_indices else numpy.empty(0, dtype="u4"))
+
+    if not point_blocks or not index_blocks:
+        return None
+    points = numpy.concatenate(point_blocks)
+    counts = numpy.concatenate(count_blocks)
+    indices = numpy.concatenate(index_blocks)
+    if len(indices) and (indices.max() >= len(points)):
+        return None
+    arrays = {"points": points, "indices": indices}
+
+    if material_ids:
+        # Faces before the first usemtl get an unnamed material
+        triangle_materials = numpy.repeat(numpy.concatenate(material_blocks), counts - 2)
+        if numpy.any(triangle_materials < 0):
+            triangle_materials[triangle_materials < 0] = material_ids.setdefault("", len(material_ids))
+        arrays["material_names"] = list(material_ids)
+        arrays["triangle_materials"] = triangle_materials.astype("u2")
+
+    if texcoord_blocks:
+        # One 1-based texture coordinate index per triangle corner, 0 where a face has none
+        texcoord_indices = numpy.concatenate([numpy.zeros(len(block), dtype="u4") if texcoord_block is None
+                                              else texcoord_block
+                                              for block, texcoord_block in zip(index_blocks, texcoord_index_blocks)])
+        if len(texcoord_indices) and texcoord_indices.max() <= texcoord_count:
+            arrays["texcoords"] = numpy.concatenate(texcoord_blocks)
+            arrays["texcoord_indices"] = texcoord_indices
+    return arrays
+
+
+def obj_texcoord_indices(faces, counts, lines, texcoord_count):
+    # Triangulated like the vertex indices; texcoord_count is the number of vt lines
+    # before this part of the block, for relative indices
+    corners = int(counts.sum())
+    slashes = faces.count(b"/")
+    if slashes == 0 or faces.count(b"//") * 2 == slashes:
+        return numpy.zeros(int((counts - 2).sum()) * 3, dtype="u4")
+    fields = slashes // corners + 1
+    if slashes == corners * (fields - 1) and b"//" not in faces:
+        # Every corner is v/vt or every one v/vt/vn: one plain parse with the slashes as separators
+        indices = numpy.fromstring(faces.replace(b"/", b" "), dtype="i8", sep=" ")
+        indices = indices.reshape(-1, fields)[:, 1] if len(indices) == corners * fields else None
+    else:
+        # Mixed corner formats, a few times slower
+        faces = OBJ_NO_TEXCOORD.sub(b"0", OBJ_BARE_INDEX.sub(b"0", faces))
+        indices = numpy.fromstring(OBJ_TEXCOORD_INDEX.sub(rb"\1", faces), dtype="i8", sep=" ")
+    if indices is None or len(indices) != corners:
+        return numpy.zeros(int((counts - 2).sum()) * 3, dtype="u4")
+    if numpy.any(indices < 0):
+        relative = obj_relative_base(lines, texcoord_count, b"vt ")
+        indices = numpy.where(indices < 0, indices + numpy.repeat(relative, counts) + 1, indices)
+    return triangulate(counts, numpy.maximum(indices, 0))
+
+
+def obj_relative_base(lines, vertex_count, prefix=b"v "):
+    bases = []
+    for line in lines:
+        if line.startswith(prefix):
+            vertex_count += 1
+        elif line.startswith(b"f "):
+            bases.append(vertex_count)
+    return numpy.array(bases, dtype="i8")
@@ -2,46 +2,178 @@ vertex_shader = '''
                 #version 330
                 
                 uniform mat4 Mvp;
+                uniform bool CompactVertices;
+                uniform vec3 PositionOffset;
+                uniform vec3 PositionScale;
+                uniform bool Instanced;
+                uniform bool Points;
+                uniform float PointSize;
+                uniform float PointScale;
                 
                 in vec3 in_position;
                 in vec3 in_normal;
+                in vec2 in_normal_oct;
                 in vec2 in_texcoord_0;
+                in vec3 in_material;
+                in mat4 in_model;
+                in vec4 in_color;
                 
                 out vec3 v_vert;
                 out vec3 v_norm;
                 out vec2 v_text;
+                flat out vec3 v_material;
+                out vec4 v_color;
+                
+                vec3 octahedral_decode(vec2 encoded) {
+                    vec3 normal = vec3(encoded, 1.0 - abs(encoded.x) - abs(encoded.y));
+                    float fold = max(-normal.z, 0.0);
+                    normal.x += normal.x >= 0.0 ? -fold : fold;
+                    normal.y += normal.y >= 0.0 ? -fold : fold;
+                    return normalize(normal);
+                }
                 
                 void main() {
-                    v_vert = in_position;
-                    v_norm = in_normal;
+                    vec3 position = in_position;
+                    vec3 normal = in_normal;
+                    if (CompactVertices) {
+                        // 16-bit steps across the bounding box, octahedral normals
+                        position = PositionOffset + in_position * PositionScale;
+                        normal = octahedral_decode(in_normal_oct / 32767.0);
+                    }
+                    if (Instanced) {
+                        // Placement of one scene model, its color comes in in_material
+                        position = (in_model * vec4(position, 1.0)).xyz;
+                        normal = mat3(in_model) * normal;
+                    }
+                    v_vert = position;
+                    v_norm = normal;
                     v_text = in_texcoord_0;
-                    gl_Position = Mvp * vec4(in_position, 1.0);
+                    v_material = in_material;
+                    v_color = in_color;
+                    gl_Position = Mvp * vec4(position, 1.0);
+                    if (Points) {
+                        // Point spacing in world units to pixels at this depth
+                        gl_PointSize = clamp(PointSize * PointScale / gl_Position.w, 1.0, 64.0);
+                    }
                 }
             '''
 fragment_shader = '''
                 #version 330
                 
+                #ifdef WIREFRAME
+                // Inputs come from wire_geometry_shader, plus each corner's pixel distance to the edges
+                #define v_vert g_vert
+                #define v_norm g_norm
+                #define v_text g_text
+                #define v_material g_material
+                #define v_color g_color
+                uniform vec4 WireColor;
+                uniform float WireWidth;
+                noperspective in vec3 g_edge;
+                #endif
+                
                 uniform sampler2D Texture;
+                uniform bool Textured;
                 uniform vec4 Color;
                 uniform vec3 Light;
+                uniform bool MaterialColors;
+                uniform bool FlatShading;
+                uniform bool Points;
+                uniform bool PointColors;
                 
                 in vec3 v_vert;
                 in vec3 v_norm;
                 in vec2 v_text;
+                flat in vec3 v_material;
+                in vec4 v_color;
                 
                 out vec4 f_color;
                 
                 void main() {
-                    float lum = -dot(normalize(v_norm), normalize(v_vert + Light));
+                    vec3 normal = v_norm;
+                    if (Points && dot(gl_PointCoord * 2.0 - 1.0, gl_PointCoord * 2.0 - 1.0) > 1.0) {
+                        // Round points
+                        discard;
+                    }
+                    if (FlatShading) {
+                        // Face normal from screen-space derivatives, for vertices without normals
+                        normal = cross(dFdx(v_vert), dFdy(v_vert));
+                    }
+                    float lum = -dot(normalize(normal), normalize(v_vert + Light));
                     lum = acos(lum) / 3.14159265;
                     lum = clamp(lum, 0.0, 1.0);
                     lum = lum * lum;
                     lum = smoothstep(0.0, 1.0, lum);
                     lum *= smoothstep(0.0, 80.0, v_vert.z) * 0.3 + 0.7;
                     lum = lum * 0.8 + 0.2;
+                    if (Points && dot(normal, normal) == 0.0) {
+                        // Scans without normals are drawn unlit
+                        lum = 1.0;
+                    }
                     
-                    vec3 color = texture(Texture, v_text).rgb;
-                    color = color * (1.0 - Color.a) + Color.rgb * Color.a;
+                    // Nothing is bound to the sampler outside textured draws, it reads black there
+                    vec3 color = Textured ? texture(Texture, v_text).rgb : vec3(0.0);
+                    vec3 base = MaterialColors ? v_material : Color.rgb;
+                    if (PointColors) {
+                        base = v_color.rgb;
+                    }
+                    if (!Textured) {
+                        color = color * (1.0 - Color.a) + base * Color.a;
+                    }
                     f_color = vec4(color * lum, Color.a);
+                    #ifdef WIREFRAME
+                    // Edges over the shaded surface, antialiased across one pixel
+                    float edge = min(g_edge.x, min(g_edge.y, g_edge.z));
+                    float wire = 1.0 - smoothstep(0.5 * WireWidth - 0.5, 0.5 * WireWidth + 0.5, edge);
+                    f_color.rgb = mix(f_color.rgb, WireColor.rgb, wire * WireColor.a);
+                    #endif
+                }
+            '''
+# Solid and wireframe in one pass: the geometry shader gives every corner its
+# distance in pixels to the opposite edge, interpolated without perspective
+wire_geometry_shader = '''
+                #version 330
+                
+                layout(triangles) in;
+                layout(triangle_strip, max_vertices = 3) out;
+                
+                uniform vec2 Viewport;
+                
+                in vec3 v_vert[];
+                in vec3 v_norm[];
+                in vec2 v_text[];
+                flat in vec3 v_material[];
+                in vec4 v_color[];
+                
+                out vec3 g_vert;
+                out vec3 g_norm;
+                out vec2 g_text;
+                flat out vec3 g_material;
+                out vec4 g_color;
+                noperspective out vec3 g_edge;
+                
+                void main() {
+                    vec2 p0 = 0.5 * Viewport * gl_in[0].gl_Position.xy / gl_in[0].gl_Position.w;
+                    vec2 p1 = 0.5 * Viewport * gl_in[1].gl_Position.xy / gl_in[1].gl_Position.w;
+                    vec2 p2 = 0.5 * Viewport * gl_in[2].gl_Position.xy / gl_in[2].gl_Position.w;
+                    float area = abs((p1.x - p0.x) * (p2.y - p0.y) - (p1.y - p0.y) * (p2.x - p0.x));
+                    vec3 heights = area / max(vec3(length(p2 - p1), length(p2 - p0), length(p1 - p0)), 1e-6);
+                    if (min(gl_in[0].gl_Position.w, min(gl_in[1].gl_Position.w, gl_in[2].gl_Position.w)) <= 0.0) {
+                        // Crosses the camera plane, the projected distances mean nothing
+                        heights = vec3(1e6);
+                    }
+                    for (int corner = 0; corner < 3; corner++) {
+                        g_vert = v_vert[corner];
+                        g_norm = v_norm[corner];
+                        g_text = v_text[corner];
+                        g_material = v_material[corner];
+                        g_color = v_color[corner];
+                        g_edge = vec3(0.0);
+                        g_edge[corner] = heights[corner];
+                        gl_Position = gl_in[corner].gl_Position;
+                        EmitVertex();
+                    }
+                    EndPrimitive();
                 }
             '''
+wire_fragment_shader = fragment_shader.replace("#version 330", "#version 330\n#define WIREFRAME", 1)
@@ -0,0 +1,118 @@
+import numpy
+
+# Host-side conversions and interleaving never hold more than this many bytes
+UPLOAD_CHUNK = 1 << 24
+# Smallest step a growing buffer takes, appends then rarely copy on the GPU
+GROW_STEP = 1 << 26
+
+
+def write_array(buffer, data, dtype=None, offset=0):
+    if not isinstance(data, numpy.ndarray):
+        buffer.write(data, offset=offset)
+        return
+    dtype = numpy.dtype(dtype or data.dtype)
+    if data.dtype == dtype and data.flags.c_contiguous:
+        buffer.write(data, offset=offset)
+        return
+    rows = data.reshape(len(data), -1) if data.ndim else data.reshape(1, 1)
+    row_bytes = max(1, rows.shape[1] * dtype.itemsize)
+    step = max(1, UPLOAD_CHUNK // row_bytes)
+    for start in range(0, len(rows), step):
+        chunk = numpy.ascontiguousarray(rows[start:start + step], dtype=dtype)
+        buffer.write(chunk, offset=offset + start * row_bytes)
+
+
+class GpuResources:
+    # Owns every buffer and vertex array the widget creates.
+    # Buffers are looked up by name and refilled in place through orphan/write,
+    # so a VAO built on them stays valid and reloads never leak GPU memory.
+    def __init__(self, ctx):
+        self.ctx = ctx
+        self.buffers = {}
+        self.vertex_arrays = {}
+
+    def buffer(self, name, data=None, reserve=0, dynamic=False, dtype=None):
+        # Arrays already contiguous in dtype (memory-mapped cache arrays included) are
+        # written straight through the buffer protocol, anything else in bounded chunks
+        if isinstance(data, numpy.ndarray):
+            size = data.size * numpy.dtype(dtype or data.dtype).itemsize
+        else:
+            size = memoryview(data).nbytes if data is not None else reserve
+        buffer = self.allocate(name, size, dynamic)
+        if data is not None and size:
+            write_array(buffer, data, dtype)
+        return buffer
+
+    def interleaved_buffer(self, name, arrays, dtype="f4"):
+        # One vertex buffer holding the arrays side by side (position | normal),
+        # filled chunk by chunk so no interleaved copy of the whole mesh exists
+        dtype = numpy.dtype(dtype)
+        columns = [array.reshape(len(array), -1) for array in arrays]
+        width = sum(column.shape[1] for column in columns)
+        stride = width * dtype.itemsize
+        chunk = numpy.empty((min(max(1, UPLOAD_CHUNK // stride), len(columns[0])), width), dtype)
+
+        def interleave(start, stop):
+            first = 0
+            for column in columns:
+                chunk[:stop - start, first:first + column.shape[1]] = column[start:stop]
+                first += column.shape[1]
+            return chunk[:stop - start]
+        return self.chunked_buffer(name, len(columns[0]), stride, interleave)
+
+    def chunked_buffer(self, name, rows, stride, fill):
+        # fill(start, stop) returns the contiguous bytes of those rows
+        buffer = self.allocate(name, rows * stride)
+        step = max(1, UPLOAD_CHUNK // stride)
+        for start in range(0, rows, step):
+            buffer.write(fill(start, min(rows, start + step)), offset=start * stride)
+        return buffer
+
+    def allocate(self, name, size, dynamic=False):
+        buffer = self.buffers.get(name)
+        if buffer is None:
+            buffer = self.ctx.buffer(reserve=max(1, size), dynamic=dynamic)
+            self.buffers[name] = buffer
+        elif buffer.size != size:
+            # New storage of the right size, the buffer object stays the same
+            buffer.orphan(max(1, size))
+        else:
+            buffer.orphan()
+        return buffer
+
+    def grow(self, name, size):
+        # At least size bytes with the contents kept, the capacity doubles so appending
+        # with write(offset=...) copies on the GPU only a logarithmic number of times
+        buffer = self.buffers.get(name)
+        if buffer is not None and buffer.size >= size:
+            return buffer
+        grown = self.ctx.buffer(reserve=max(size, GROW_STEP, 2 * buffer.size if buffer is not None else 0))
+        if buffer is not None:
+            self.ctx.copy_buffer(grown, buffer)
+            buffer.release()
+        self.buffers[name] = grown
+        return grown
+
+    def vertex_array(self, name, program, content, index_buffer=None, index_element_size=4):
+        # Reuse the VAO when it was built from the same buffers and layout
+        key = (program.glo, tuple((item[0].glo,) + tuple(item[1:]) for item in content),
+               None if index_buffer is None else index_buffer.glo, index_element_size)
+        cached = self.vertex_arrays.get(name)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        if cached is not None:
+            cached[1].release()
+        vertex_array = self.ctx.vertex_array(program, content, index_buffer, index_element_size)
+        self.vertex_arrays[name] = (key, vertex_array)
+        return vertex_array
+
+    def release(self, prefix=""):
+        # Frees every resource whose name starts with prefix
+        for name in [name for name in self.vertex_arrays if name.startswith(prefix)]:
+            self.vertex_arrays.pop(name)[1].release()
+        for name in [name for name in self.buffers if name.startswith(prefix)]:
+            self.buffers.pop(name).release()
+
+    @property
+    def allocated_bytes(self):
+        return sum(buffer.size for buffer in self.buffers.values())
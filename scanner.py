@@ -0,0 +1,96 @@
+import os
+import re
+
+CHUNK_SIZE = 1 << 22
+
+# Every line start in a scanned block is preceded by a newline
+LINE_PREFIXES = {
+    "vertices": (b"\nv ", b"\nv\t"),
+    "texcoords": (b"\nvt ", b"\nvt\t"),
+    "normals": (b"\nvn ", b"\nvn\t"),
+    "faces": (b"\nf ", b"\nf\t"),
+}
+USEMTL = re.compile(rb"^usemtl[ \t]+(\S+)", re.MULTILINE)
+GROUP = re.compile(rb"^g[ \t]+([^\r\n]+)", re.MULTILINE)
+OBJECT = re.compile(rb"^o[ \t]+([^\r\n]+)", re.MULTILINE)
+MTLLIB = re.compile(rb"^mtllib[ \t]+([^\r\n]+)", re.MULTILINE)
+
+
+class ObjInfo:
+    def __init__(self):
+        self.vertices = 0
+        self.texcoords = 0
+        self.normals = 0
+        self.faces = 0
+        self.usemtl = 0
+        self.materials = set()
+        self.groups = []
+        self.objects = []
+        self.mtllibs = []
+
+    def to_dict(self):
+        values = dict(self.__dict__)
+        values["materials"] = sorted(self.materials)
+        return values
+
+    @classmethod
+    def from_dict(cls, values):
+        info = cls()
+        info.__dict__.update(values)
+        info.materials = set(values["materials"])
+        return info
+
+    @property
+    def has_uv(self):
+        return self.texcoords > 0
+
+    @property
+    def draw_calls(self):
+        return max(1, self.usemtl)
+
+    def scan_block(self, block):
+        # block holds whole lines and starts with a newline
+        for name, prefixes in LINE_PREFIXES.items():
+            setattr(self, name, getattr(self, name) + sum(block.count(prefix) for prefix in prefixes))
+        if b"usemtl" in block:
+            names = USEMTL.findall(block)
+            self.usemtl += len(names)
+            self.materials.update(name.decode(errors="replace") for name in names)
+        if b"\ng" in block:
+            self.groups.extend(name.strip().decode(errors="replace") for name in GROUP.findall(block))
+        if b"mtllib" in block:
+            self.mtllibs.extend(name.strip().decode(errors="replace") for name in MTLLIB.findall(block))
+        if b"\no" in block:
+            self.objects.extend(name.strip().decode(errors="replace") for name in OBJECT.findall(block))
+
+
+def iter_blocks(file_name, chunk_size=CHUNK_SIZE, progress=None):
+    # Yields blocks of whole lines, each starting with a newline
+    total = max(1, os.path.getsize(file_name))
+    done = 0
+    remainder = b"\n"
+    with open(file_name, "rb") as file:
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                break
+            done += len(chunk)
+            block = remainder + chunk
+            end = block.rfind(b"\n")
+            if end <= 0:
+                remainder = block
+                continue
+            yield block[:end + 1]
+            remainder = block[end:]
+            if progress is not None:
+                progress(done / total)
+    if len(remainder) > 1:
+        yield remainder + b"\n"
+
+
+def scan_obj(file_name, chunk_size=CHUNK_SIZE, progress=None):
+    # Single streaming pass, memory stays bounded by chunk_size
+    info = ObjInfo()
+    for block in iter_blocks(file_name, chunk_size, progress):
+        info.scan_block(block)
+    return info
@@ -0,0 +1,115 @@
+import collections
+import os
+import numpy
+
+# GPU memory the extra scene models may hold, least recently viewed meshes are evicted beyond it
+SCENE_BUDGET = int(os.environ.get("VIEWER_VRAM_BUDGET_MB", "1024")) * 2 ** 20
+# Space left between models placed side by side, relative to the scene width
+PLACEMENT_GAP = 0.1
+
+
+def transformed_bounds(bounding_box, transform):
+    # Axis-aligned box around the eight transformed corners (row-vector transform)
+    bounding_box_min, bounding_box_max = (numpy.asarray(corner, dtype="f8") for corner in bounding_box)
+    corners = numpy.array([[x, y, z, 1.0] for x in (bounding_box_min[0], bounding_box_max[0])
+                           for y in (bounding_box_min[1], bounding_box_max[1])
+                           for z in (bounding_box_min[2], bounding_box_max[2])]) @ transform
+    return corners[:, :3].min(axis=0), corners[:, :3].max(axis=0)
+
+
+class SceneModel:
+    # One placement of a mesh; models sharing a mesh are drawn as instances of it
+    def __init__(self, mesh, transform=None, color=(0.8, 0.8, 0.8)):
+        self.mesh = mesh
+        self.name = os.path.basename(mesh.file_name)
+        self.transform = numpy.identity(4, dtype="f4") if transform is None else numpy.asarray(transform, "f4")
+        self.visible = True
+        self.color = tuple(color)
+
+    @property
+    def offset(self):
+        return tuple(float(value) for value in self.transform[3, :3])
+
+    @property
+    def bounds(self):
+        return transformed_bounds(self.mesh.bounding_box, self.transform)
+
+
+class Residency:
+    # Least recently used order over the meshes uploaded to the GPU, with their sizes in bytes
+    def __init__(self, budget=SCENE_BUDGET):
+        self.budget = budget
+        self.entries = collections.OrderedDict()
+
+    @property
+    def total(self):
+        return sum(self.entries.values())
+
+    def touch(self, key):
+        self.entries.move_to_end(key)
+
+    def admit(self, key, size, pinned=()):
+        # Records an upload and returns the keys to evict first, oldest first;
+        # pinned meshes (the ones in view) stay even if that means going over budget
+        evict = []
+        total = self.total
+        for other in list(self.entries):
+            if total + size <= self.budget:
+                break
+            if other in pinned or other == key:
+                continue
+            total -= self.entries.pop(other)
+            evict.append(other)
+        self.entries[key] = size
+        return evict
+
+    def discard(self, key):
+        self.entries.pop(key, None)
+
+
+class Scene:
+    def __init__(self, budget=SCENE_BUDGET):
+        self.models = []
+        self.residency = Residency(budget)
+
+    def find_mesh(self, file_name):
+        # A file already in the scene is placed again without reloading it
+        file_name = os.path.abspath(file_name)
+        for model in self.models:
+            if os.path.abspath(model.mesh.file_name) == file_name:
+                return model.mesh
+        return None
+
+    def add(self, mesh, bounds=None, color=(0.8, 0.8, 0.8)):
+        # Placed to the right of bounds (the rest of the scene) along x
+        model = SceneModel(mesh, color=color)
+        if bounds is not None:
+            bounding_box_min = numpy.asarray(mesh.bounding_box[0], dtype="f8")
+            width = bounds[1][0] - bounds[0][0]
+            model.transform[3, 0] = bounds[1][0] + PLACEMENT_GAP * width - bounding_box_min[0]
+        self.models.append(model)
+        return model
+
+    def remove(self, index):
+        # Returns the mesh when no other model uses it any more
+        mesh = self.models.pop(index).mesh
+        if any(model.mesh is mesh for model in self.models):
+            return None
+        return mesh
+
+    def bounds(self, extra=None):
+        # Box around every model, plus an optional (min, max) box such as the primary mesh
+        boxes = [model.bounds for model in self.models]
+        if extra is not None:
+            boxes.append(extra)
+        if not boxes:
+            return None
+        return (numpy.min([box[0] for box in boxes], axis=0), numpy.max([box[1] for box in boxes], axis=0))
+
+    def visible_groups(self):
+        # Visible models grouped by mesh, in first-added order
+        groups = collections.OrderedDict()
+        for model in self.models:
+            if model.visible:
+                groups.setdefault(id(model.mesh), (model.mesh, []))[1].append(model)
+        return groups
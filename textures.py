@@ -0,0 +1,89 @@
+import concurrent.futures
+import os
+
+import moderngl
+from PyQt5 import QtCore, QtGui
+from scene import Residency
+
+# GPU memory the textures may hold, least recently drawn ones are released beyond it
+TEXTURE_BUDGET = int(os.environ.get("VIEWER_TEXTURE_BUDGET_MB", "512")) * 2 ** 20
+# Images decoded at the same time, QImage releases the GIL while it decodes
+DECODE_WORKERS = min(4, os.cpu_count() or 1)
+# Decoded images uploaded per frame, so a batch of large textures never stalls one frame
+UPLOADS_PER_FRAME = 1
+
+
+def decode_image(file_name, max_size):
+    # Runs in the pool: RGBA bytes, bottom row first as GL and OBJ texture coordinates
+    # expect, scaled down to what the GPU takes; None when the file cannot be read
+    image = QtGui.QImage(file_name)
+    if image.isNull():
+        return None
+    if max(image.width(), image.height()) > max_size:
+        image = image.scaled(max_size, max_size, QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation)
+    image = image.convertToFormat(QtGui.QImage.Format_RGBA8888).mirrored()
+    return (image.width(), image.height()), image.constBits().asstring(image.width() * image.height() * 4)
+
+
+class TextureCache(QtCore.QObject):
+    # Textures by absolute path, shared by the opened mesh and the scene models; decoded in
+    # a thread pool and uploaded with mipmaps from paintGL, where the context is current
+    decoded = QtCore.pyqtSignal(str, object)
+    ready = QtCore.pyqtSignal()
+
+    def __init__(self, budget=TEXTURE_BUDGET, parent=None):
+        super(TextureCache, self).__init__(parent)
+        self.pool = concurrent.futures.ThreadPoolExecutor(DECODE_WORKERS, thread_name_prefix="texture")
+        self.residency = Residency(budget)
+        self.textures = {}
+        self.pending = set()
+        self.failed = set()
+        self.images = {}
+        self.max_size = 4096
+        # Paths the current frame draws with, never evicted to make room
+        self.in_use = set()
+        # Emitted from pool threads, delivered on the GUI thread
+        self.decoded.connect(self.store_image, QtCore.Qt.QueuedConnection)
+
+    def get(self, file_name):
+        # The texture once it is on the GPU, None (and decoding started) until then
+        texture = self.textures.get(file_name)
+        if texture is not None:
+            self.residency.touch(file_name)
+            return texture
+        if file_name not in self.pending and file_name not in self.failed:
+            self.pending.add(file_name)
+            future = self.pool.submit(decode_image, file_name, self.max_size)
+            future.add_done_callback(lambda future: self.decoded.emit(
+                file_name, None if future.exception() is not None else future.result()))
+        return None
+
+    def store_image(self, file_name, image):
+        if image is None:
+            self.pending.discard(file_name)
+            self.failed.add(file_name)
+            return
+        self.images[file_name] = image
+        self.ready.emit()
+
+    def upload_pending(self, ctx):
+        # Returns True when decoded images are still waiting for a later frame
+        for file_name in list(self.images)[:UPLOADS_PER_FRAME]:
+            size, data = self.images.pop(file_name)
+            self.pending.discard(file_name)
+            texture = ctx.texture(size, 4, data)
+            texture.build_mipmaps()
+            texture.filter = (moderngl.LINEAR_MIPMAP_LINEAR, moderngl.LINEAR)
+            # The mipmap chain adds a third to the base level
+            for evicted in self.residency.admit(file_name, len(data) * 4 // 3, self.in_use):
+                self.textures.pop(evicted).release()
+            self.textures[file_name] = texture
+        return bool(self.images)
+
+    def set_budget(self, budget):
+        # Takes effect with the next upload
+        self.residency.budget = budget
+
+    @property
+    def total(self):
+        return self.residency.total
@@ -0,0 +1,141 @@
+import numpy
+
+# Post-transform vertex cache the triangle order is tuned for and measured against (FIFO)
+VERTEX_CACHE_SIZE = 16
+# ACMR is measured on at most this many triangles from the start of the index buffer
+ACMR_TRIANGLES = 1 << 20
+# Smallest run of triangles the overdraw pass moves as one piece
+OVERDRAW_CLUSTER = 256
+
+
+def acmr(indices, cache_size=VERTEX_CACHE_SIZE):
+    # Average cache miss ratio: vertex shader runs per triangle with a FIFO cache,
+    # 3 for no reuse at all and about 0.5 at best on a regular grid
+    indices = numpy.asarray(indices)[:3 * ACMR_TRIANGLES]
+    if len(indices) < 3:
+        return 0.0
+    _, local = numpy.unique(indices, return_inverse=True)
+    stamps = [-cache_size - 1] * (int(local.max()) + 1)
+    misses = 0
+    for vertex in local.reshape(-1).tolist():
+        if misses - stamps[vertex] > cache_size:
+            stamps[vertex] = misses
+            misses += 1
+    return misses / (len(indices) // 3)
+
+
+def tipsify(triangles, cache_size=VERTEX_CACHE_SIZE):
+    # Tipsify (Sander, Nehab and Barczak 2007): fans out around one vertex at a time, moving
+    # on to a neighbour still in the cache; returns the triangle order and the positions in it
+    # where no neighbour was left and the walk jumped elsewhere
+    _, local = numpy.unique(triangles, return_inverse=True)
+    local = local.reshape(-1)
+    vertex_count = int(local.max()) + 1
+    order = numpy.argsort(local, kind="stable")
+    offsets = numpy.concatenate(([0], numpy.cumsum(numpy.bincount(local, minlength=vertex_count)))).tolist()
+    adjacency = (order // 3).tolist()
+    live = numpy.diff(offsets).tolist()
+    corners = local.tolist()
+    del order, local
+
+    stamps = [0] * vertex_count
+    clock = cache_size + 1
+    emitted = bytearray(len(corners) // 3)
+    output = []
+    jumps = [0]
+    dead_ends = []
+    cursor = 0
+    fanning = 0
+    while fanning >= 0:
+        candidates = []
+        for triangle in adjacency[offsets[fanning]:offsets[fanning + 1]]:
+            if emitted[triangle]:
+                continue
+            emitted[triangle] = 1
+            output.append(triangle)
+            for vertex in corners[3 * triangle:3 * triangle + 3]:
+                dead_ends.append(vertex)
+                candidates.append(vertex)
+                live[vertex] -= 1
+                if clock - stamps[vertex] > cache_size:
+                    stamps[vertex] = clock
+                    clock += 1
+
+        # Next fan: the candidate longest in the cache that stays there while its fan is drawn
+        fanning = -1
+        best = -1
+        for vertex in candidates:
+            if live[vertex] > 0:
+                age = clock - stamps[vertex]
+                priority = age if age + 2 * live[vertex] <= cache_size else 0
+                if priority > best:
+                    best = priority
+                    fanning = vertex
+        if fanning < 0:
+            jumps.append(len(output))
+            while dead_ends:
+                vertex = dead_ends.pop()
+                if live[vertex] > 0:
+                    fanning = vertex
+                    break
+            else:
+                while cursor < vertex_count and live[cursor] == 0:
+                    cursor += 1
+                if cursor < vertex_count:
+                    fanning = cursor
+    return numpy.array(output, dtype="i8"), numpy.unique(jumps[:-1])
+
+
+def overdraw_order(points, triangles, jumps, center):
+    # Cuts the tipsified triangles into clusters at the jumps and draws the clusters that
+    # face away from the mesh center first, they are the ones most likely to occlude the rest
+    starts = []
+    for jump in jumps.tolist():
+        if not starts or jump - starts[-1] >= OVERDRAW_CLUSTER:
+            starts.append(jump)
+    if len(starts) < 2:
+        return numpy.arange(len(triangles))
+    corners = points[triangles].astype("f8")
+    normals = numpy.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    areas = numpy.linalg.norm(normals, axis=1)
+    centroids = corners.mean(axis=1) * areas[:, None]
+    normal = numpy.add.reduceat(normals, starts)
+    weight = numpy.maximum(numpy.add.reduceat(areas, starts), 1e-30)
+    centroid = numpy.add.reduceat(centroids, starts) / weight[:, None]
+    normal /= numpy.maximum(numpy.linalg.norm(normal, axis=1), 1e-30)[:, None]
+    facing = numpy.einsum("ij,ij->i", centroid - center, normal)
+    stops = starts[1:] + [len(triangles)]
+    clusters = numpy.argsort(-facing, kind="stable")
+    return numpy.concatenate([numpy.arange(starts[cluster], stops[cluster]) for cluster in clusters])
+
+
+def fetch_order(indices, vertex_count):
+    # Vertices renumbered in the order the index buffer first uses them, unused ones last;
+    # returns the new-to-old order and the old-to-new remap
+    first = numpy.full(vertex_count, len(indices), dtype="i8")
+    used, positions = numpy.unique(indices, return_index=True)
+    first[used] = positions
+    order = numpy.argsort(first, kind="stable")
+    remap = numpy.empty(vertex_count, dtype="u4")
+    remap[order] = numpy.arange(vertex_count, dtype="u4")
+    return order, remap
+
+
+def optimize_indices(points, indices, ranges, bounding_box, overdraw=True, progress=None):
+    # Tipsifies every draw range, rows of (material, first triangle, triangle count), on its
+    # own so chunk and material ranges keep their triangles, then reorders for overdraw;
+    # returns the new indices and the old index of every reordered triangle
+    triangles = indices.reshape(-1, 3)
+    optimized = numpy.empty_like(triangles)
+    triangle_order = numpy.arange(len(triangles))
+    center = (numpy.asarray(bounding_box[0], dtype="f8") + numpy.asarray(bounding_box[1], dtype="f8")) / 2
+    for row, (_, first, count) in enumerate(ranges):
+        source = triangles[first:first + count]
+        order, jumps = tipsify(source)
+        if overdraw:
+            order = order[overdraw_order(points, source[order], jumps, center)]
+        optimized[first:first + count] = source[order]
+        triangle_order[first:first + count] = first + order
+        if progress is not None:
+            progress((row + 1) / len(ranges))
+    return optimized.reshape(-1), triangle_order